@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+#
+# End-to-end provisioning benchmark
+#
+# Runs provision_fleet.py against mock_redfish_server.py for every
+# combination of vendor, latency profile and fleet size, and reports per
+# scenario:
+#
+#   wall time and hosts per second
+#   latency percentiles of every provisioning stage and of whole hosts
+#   requests and connections per host
+#   CPU time and peak memory of the provisioning process
+#
+# The mock and the provisioning run in separate processes, so the CPU and
+# memory figures are those of provision_fleet.py alone. Each scenario starts
+# with empty registry and resource caches.
+#
+# Results are written as JSON with -o. Pass an earlier result file with
+# --baseline to compare against it; metrics that got worse by more than
+# --threshold are reported and the exit code is 1.
+#
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SIZES = [1, 10, 100, 1000]
+DEFAULT_VENDORS = ['dell', 'hpe']
+DEFAULT_PROFILES = ['lan', 'bmc']
+
+# Seconds the mock adds to every request: (latency, random jitter on top)
+PROFILES = {
+    'none': (0.0, 0.0),
+    'lan': (0.005, 0.005),
+    'bmc': (0.1, 0.2),
+    'slow': (0.5, 0.5)
+}
+
+STAGES = ['detect', 'auth', 'wait_ready', 'bios', 'asset_tag', 'commit', 'reboot', 'wait_for_commit', 'end_session']
+
+# Metrics compared against a baseline; bigger is worse for all of them
+COMPARED = [
+    ('wall', 'wall time (s)'),
+    ('host.p50', 'host p50 (s)'),
+    ('host.p99', 'host p99 (s)'),
+    ('requests_per_host', 'requests/host'),
+    ('cpu_seconds', 'CPU (s)'),
+    ('peak_rss_mb', 'peak RSS (MB)')
+]
+
+def parse_list(value, cast=str):
+    return [cast(v) for v in value.split(',') if v]
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark provisioning against mock Dell and HPE BMCs',
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('--sizes', help='Fleet sizes (default: 1,10,100,1000)', type=lambda v: parse_list(v, int), default=DEFAULT_SIZES)
+    parser.add_argument('--vendors', help='dell, hpe and/or mixed (default: dell,hpe)', type=parse_list, default=DEFAULT_VENDORS)
+    parser.add_argument('--profiles', help='Latency profiles (default: lan,bmc)\n' +
+                                           '\n'.join("  %-5s %.3fs + up to %.3fs per request" % (name, latency, jitter)
+                                                     for name, (latency, jitter) in PROFILES.items()),
+                        type=parse_list, default=DEFAULT_PROFILES)
+    parser.add_argument('-w', '--workers', help='Hosts provisioned at once (default: 64)', type=int, default=64)
+    parser.add_argument('--job-duration', help='Seconds a mock Dell config job runs (default: 2)', type=float, default=2.0)
+    parser.add_argument('--post-duration', help='Seconds a mock HPE server spends in POST (default: 2)', type=float, default=2.0)
+    parser.add_argument('--dell-config', help='Dell BIOS config (default: dell_config.json)', default=os.path.join(HERE, 'dell_config.json'))
+    parser.add_argument('--hpe-config', help='HPE BIOS config (default: config.json)', default=os.path.join(HERE, 'config.json'))
+    parser.add_argument('-o', '--output', help='Write the results as JSON here')
+    parser.add_argument('--baseline', help='Compare against the results in this JSON file')
+    parser.add_argument('--threshold', help='Relative change counted as a regression (default: 0.10)', type=float, default=0.10)
+    args = parser.parse_args()
+
+    for vendor in args.vendors:
+        if vendor not in ('dell', 'hpe', 'mixed'):
+            parser.error("unknown vendor '%s'" % (vendor))
+    for profile in args.profiles:
+        if profile not in PROFILES:
+            parser.error("unknown latency profile '%s'" % (profile))
+    return args
+
+# Linear interpolation between the closest ranks
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(values) - 1)
+    return round(values[lower] + (values[upper] - values[lower]) * (k - lower), 4)
+
+def distribution(values):
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': round(max(values), 4) if values else None
+    }
+
+# Start the mock in its own process and wait for its inventory
+def start_mock_process(vendor, hosts, profile, args, workdir):
+    latency, jitter = PROFILES[profile]
+    inventory = os.path.join(workdir, 'inventory.csv')
+    command = [
+        sys.executable, os.path.join(HERE, 'mock_redfish_server.py'),
+        '-n', str(hosts), '--vendor', vendor, '--vhost', 'path',
+        '--latency', str(latency), '--jitter', str(jitter),
+        '--job-duration', str(args.job_duration), '--post-duration', str(args.post_duration),
+        '-o', inventory
+    ]
+    mock = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    for line in mock.stderr:
+        if 'Serving' in line:
+            return mock, inventory
+    mock.wait()
+    raise RuntimeError("mock server exited with code %s" % (mock.returncode))
+
+def stop_mock_process(mock):
+    mock.terminate()
+    mock.wait()
+    mock.stderr.close()
+
+# Run provision_fleet.py once over the inventory. Returns its result
+# records, the wall time and the resource usage of that process alone.
+def run_provision(inventory, args, workdir):
+    results = os.path.join(workdir, 'results.jsonl')
+    command = [
+        sys.executable, os.path.join(HERE, 'provision_fleet.py'),
+        '--inventory', inventory, '-u', 'root', '-p', 'calvin',
+        '--dell-config', args.dell_config, '--hpe-config', args.hpe_config,
+        '-r', '-w', str(args.workers), '-o', results,
+        '--registry-cache', os.path.join(workdir, 'registry'),
+        '--resource-cache', os.path.join(workdir, 'resources')
+    ]
+    start = time.time()
+    proc = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.time() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    with open(results) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return records, wall, usage
+
+def summarize(records, wall, usage):
+    ok = [r for r in records if r['status'] == 'ok']
+    stages = {}
+    for stage in STAGES:
+        values = [r['stages'][stage] for r in ok if stage in r.get('stages', {})]
+        if values:
+            stages[stage] = distribution(values)
+    requests = [r.get('requests', 0) for r in records]
+    connections = [r.get('connections', 0) for r in records]
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = usage.ru_maxrss / 1024.0 if sys.platform != 'darwin' else usage.ru_maxrss / 1048576.0
+    return {
+        'hosts': len(records),
+        'ok': len(ok),
+        'failed': len(records) - len(ok),
+        'wall': round(wall, 3),
+        'hosts_per_second': round(len(records) / wall, 3) if wall else None,
+        'host': distribution([r['elapsed'] for r in ok]),
+        'stages': stages,
+        'requests_per_host': round(sum(requests) / float(len(requests)), 2) if requests else None,
+        'connections_per_host': round(sum(connections) / float(len(connections)), 2) if connections else None,
+        'cpu_user': round(usage.ru_utime, 3),
+        'cpu_system': round(usage.ru_stime, 3),
+        'cpu_seconds': round(usage.ru_utime + usage.ru_stime, 3),
+        'peak_rss_mb': round(rss, 1)
+    }
+
+def run_scenario(vendor, profile, size, args):
+    workdir = tempfile.mkdtemp(prefix='bench_provision.')
+    try:
+        mock, inventory = start_mock_process(vendor, size, profile, args, workdir)
+        try:
+            records, wall, usage = run_provision(inventory, args, workdir)
+        finally:
+            stop_mock_process(mock)
+        return summarize(records, wall, usage)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def print_summary(key, summary):
+    print ("%-16s %5s hosts %3s failed  wall %8.2fs  %7.2f hosts/s  host p50 %6.2fs p99 %6.2fs  %6.1f req/host  CPU %7.2fs  RSS %6.1f MB" % (
+        key, summary['hosts'], summary['failed'], summary['wall'], summary['hosts_per_second'] or 0,
+        summary['host']['p50'] or 0, summary['host']['p99'] or 0, summary['requests_per_host'] or 0,
+        summary['cpu_seconds'], summary['peak_rss_mb']))
+    for stage, dist in summary['stages'].items():
+        print ("    %-16s p50 %7.3fs  p90 %7.3fs  p99 %7.3fs  max %7.3fs" % (stage, dist['p50'], dist['p90'], dist['p99'], dist['max']))
+    sys.stdout.flush()
+
+def metric(summary, name):
+    value = summary
+    for part in name.split('.'):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+# Print the change of every compared metric and return the regressions
+def compare(scenarios, baseline, threshold):
+    regressions = []
+    for key, summary in scenarios.items():
+        old = baseline.get('scenarios', {}).get(key)
+        if old is None:
+            print ("%-16s not in the baseline" % (key))
+            continue
+        for name, label in COMPARED:
+            before, after = metric(old, name), metric(summary, name)
+            if not before or after is None:
+                continue
+            change = (after - before) / float(before)
+            flag = ''
+            if change > threshold:
+                flag = '  REGRESSION'
+                regressions.append((key, label, before, after))
+            print ("%-16s %-16s %10.3f -> %10.3f  %+7.1f%%%s" % (key, label, before, after, change * 100, flag))
+    return regressions
+
+def main():
+    args = parse_args()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    scenarios = {}
+    for vendor in args.vendors:
+        for profile in args.profiles:
+            for size in args.sizes:
+                key = "%s/%s/%s" % (vendor, profile, size)
+                scenarios[key] = run_scenario(vendor, profile, size, args)
+                print_summary(key, scenarios[key])
+
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'settings': {
+            'workers': args.workers,
+            'job_duration': args.job_duration,
+            'post_duration': args.post_duration,
+            'profiles': dict((name, PROFILES[name]) for name in args.profiles)
+        },
+        'scenarios': scenarios
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if baseline is None:
+        sys.exit(1 if any(s['failed'] for s in scenarios.values()) else 0)
+    print ("")
+    regressions = compare(scenarios, baseline, args.threshold)
+    if regressions:
+        print ("# ERROR -- %s metrics regressed by more than %.0f%%" % (len(regressions), args.threshold * 100))
+        sys.exit(1)
+    print ("# INFO -- No regressions against %s" % (args.baseline))
+
+if __name__ == "__main__":
+    main()
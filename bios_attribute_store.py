@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+#
+# Deduplicated storage of BIOS attribute snapshots
+#
+# Servers of one model and config return nearly the same ~180 attributes.
+# Only a few, like AssetTag and SystemServiceTag, differ per host. Storing
+# the whole JSON document per host and snapshot repeats the same data
+# thousands of times.
+#
+# Instead, each snapshot is a reference to a shared base attribute set plus
+# a small delta of its own. Base sets are content-addressed: stored once
+# under the SHA-256 of their canonical JSON. A snapshot reuses the base of
+# the host's previous snapshot, or the most recently used one, as long as
+# the delta stays small. Otherwise its own attributes become a new base.
+#
+# Loaded base sets are kept in memory once per hash with their values
+# interned. HostAttributes looks up a host's delta first and then the shared
+# base, so an in-memory fleet view costs about one delta per host.
+#
+import sys
+import json
+import time
+import hashlib
+import threading
+from collections.abc import Mapping
+
+# Attributes that differ on every host; they always go in the delta
+HOST_ATTRIBUTES = ('AssetTag', 'SystemServiceTag', 'ServerAssetTag', 'ServerName')
+
+# A base is reused while the delta is at most this fraction of the attributes
+MAX_DELTA_RATIO = 0.25
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS attribute_sets (
+        hash TEXT PRIMARY KEY,
+        attributes TEXT
+    );
+    CREATE TABLE IF NOT EXISTS attribute_snapshots (
+        host TEXT,
+        taken_at REAL,
+        base TEXT,
+        delta TEXT
+    );
+    CREATE INDEX IF NOT EXISTS attribute_snapshots_host ON attribute_snapshots (host, taken_at);
+"""
+
+def canonical_json(attributes):
+    return json.dumps(attributes, sort_keys=True, separators=(',', ':'))
+
+def attribute_set_hash(attributes):
+    return hashlib.sha256(canonical_json(attributes).encode('utf-8')).hexdigest()
+
+def intern_value(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+# Changes that turn base into attributes: {'set': {...}, 'unset': [...]}
+def attribute_delta(base, attributes):
+    delta = {
+        'set': dict((k, v) for k, v in attributes.items() if k not in base or base[k] != v),
+        'unset': sorted(k for k in base if k not in attributes)
+    }
+    return delta
+
+def delta_size(delta):
+    return len(delta['set']) + len(delta['unset'])
+
+# The attributes of one snapshot, read through its delta and shared base
+class HostAttributes(Mapping):
+    __slots__ = ('base', 'changes', 'unset')
+
+    def __init__(self, base, delta):
+        self.base = base
+        self.changes = dict((intern_value(k), intern_value(v)) for k, v in delta.get('set', {}).items())
+        self.unset = frozenset(delta.get('unset', ()))
+
+    def __getitem__(self, key):
+        if key in self.changes:
+            return self.changes[key]
+        if key in self.unset:
+            raise KeyError(key)
+        return self.base[key]
+
+    def __iter__(self):
+        for key in self.base:
+            if key not in self.unset and key not in self.changes:
+                yield key
+        for key in self.changes:
+            yield key
+
+    def __len__(self):
+        return len(self.base) - len(self.unset & self.base.keys()) + sum(1 for k in self.changes if k not in self.base)
+
+# Snapshots on top of a StateStore-like execute(sql, params) that returns
+# the fetched rows
+class AttributeStore:
+    def __init__(self, execute):
+        self.execute = execute
+        self.bases = {}
+        self.last_base = None
+        self.lock = threading.Lock()
+        for statement in SCHEMA.split(';'):
+            if statement.strip():
+                self.execute(statement)
+
+    # The base set with this hash, shared and interned
+    def base(self, base_hash):
+        with self.lock:
+            base = self.bases.get(base_hash)
+        if base is None:
+            rows = self.execute("SELECT attributes FROM attribute_sets WHERE hash = ?", (base_hash,))
+            if not rows:
+                raise KeyError(base_hash)
+            base = dict((intern_value(k), intern_value(v)) for k, v in json.loads(rows[0][0]).items())
+            with self.lock:
+                base = self.bases.setdefault(base_hash, base)
+        return base
+
+    def add_base(self, attributes):
+        base_hash = attribute_set_hash(attributes)
+        self.execute("INSERT OR IGNORE INTO attribute_sets VALUES (?, ?)", (base_hash, canonical_json(attributes)))
+        return base_hash
+
+    def host_base(self, host):
+        rows = self.execute("SELECT base FROM attribute_snapshots WHERE host = ? ORDER BY taken_at DESC LIMIT 1", (host,))
+        if rows:
+            return rows[0][0]
+
+    # Pick the base for a snapshot: an identical set, else the candidate
+    # with the smallest delta if it is small enough, else a new base
+    def choose_base(self, host, common):
+        base_hash = attribute_set_hash(common)
+        if self.execute("SELECT 1 FROM attribute_sets WHERE hash = ?", (base_hash,)):
+            return base_hash, {'set': {}, 'unset': []}
+
+        best = None
+        for candidate in (self.host_base(host), self.last_base):
+            if candidate is None or (best is not None and candidate == best[0]):
+                continue
+            delta = attribute_delta(self.base(candidate), common)
+            if best is None or delta_size(delta) < delta_size(best[1]):
+                best = (candidate, delta)
+        if best is not None and delta_size(best[1]) <= len(common) * MAX_DELTA_RATIO:
+            return best
+        return self.add_base(common), {'set': {}, 'unset': []}
+
+    # Returns taken_at, which identifies the snapshot together with the host
+    def save(self, host, attributes, taken_at=None):
+        common = dict((k, v) for k, v in attributes.items() if k not in HOST_ATTRIBUTES)
+        base_hash, delta = self.choose_base(host, common)
+        delta['set'].update((k, v) for k, v in attributes.items() if k in HOST_ATTRIBUTES)
+        taken_at = taken_at or time.time()
+        self.execute("INSERT INTO attribute_snapshots VALUES (?, ?, ?, ?)",
+                     (host, taken_at, base_hash, canonical_json(delta)))
+        self.last_base = base_hash
+        return taken_at
+
+    # (taken_at, HostAttributes) of the host's snapshots, oldest first
+    def snapshots(self, host):
+        rows = self.execute("SELECT taken_at, base, delta FROM attribute_snapshots WHERE host = ? ORDER BY taken_at", (host,))
+        return [(taken_at, HostAttributes(self.base(base_hash), json.loads(delta))) for taken_at, base_hash, delta in rows]
+
+    def latest(self, host):
+        rows = self.execute("SELECT base, delta FROM attribute_snapshots WHERE host = ? ORDER BY taken_at DESC LIMIT 1", (host,))
+        if rows:
+            return HostAttributes(self.base(rows[0][0]), json.loads(rows[0][1]))
+
+    def snapshot(self, host, taken_at):
+        rows = self.execute("SELECT base, delta FROM attribute_snapshots WHERE host = ? AND taken_at = ?", (host, taken_at))
+        if rows:
+            return HostAttributes(self.base(rows[0][0]), json.loads(rows[0][1]))
+
+    # {host: HostAttributes} of the latest snapshot of every host, or with
+    # taken_at, of the snapshot {host: taken_at} names for each host in it
+    def fleet(self, taken_at=None):
+        if taken_at is None:
+            rows = self.execute("SELECT host, base, delta, MAX(taken_at) FROM attribute_snapshots GROUP BY host")
+        else:
+            rows = [row for row in self.execute("SELECT host, base, delta, taken_at FROM attribute_snapshots")
+                    if taken_at.get(row[0]) == row[3]]
+        return dict((host, HostAttributes(self.base(base_hash), json.loads(delta))) for host, base_hash, delta, _ in rows)
+
+    def stats(self):
+        bases, base_bytes = self.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(attributes)), 0) FROM attribute_sets")[0]
+        snapshots, delta_bytes = self.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(delta)), 0) FROM attribute_snapshots")[0]
+        return {'bases': bases, 'base_bytes': base_bytes, 'snapshots': snapshots, 'delta_bytes': delta_bytes}
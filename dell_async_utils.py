@@ -0,0 +1,620 @@
+#!/usr/bin/env python3
+#
+# asyncio implementation of the Dell iDRAC operations in dell_set_bios_attr.py
+#
+# A thread per host stops scaling at a few hundred BMCs, while almost all of
+# a host's time is spent waiting on the iDRAC. AsyncUtils mirrors the Utils
+# API method for method on top of one shared aiohttp connection pool, so a
+# single process can keep thousands of iDRAC conversations in flight.
+# Per-host semaphores make sure no single iDRAC sees more than a few
+# concurrent requests.
+#
+# The provisioning flow in dell_set_bios_attr.py is written once against
+# the AsyncUtils API; the threads engine runs it over the blocking Utils.
+# The helpers and job states below are shared by both.
+#
+# BlockingUtils wraps AsyncUtils for callers that want the old synchronous
+# calling convention.
+#
+import re
+import sys
+import json
+import time
+import asyncio
+import contextlib
+import redfish_metrics
+from redfish_transport import RedfishError, backoff_intervals, retry_delays, retryable_status, CircuitBreaker, BmcUnavailable, DeadlineExceeded, DEFAULT_MAX_SESSIONS, SESSION_WAIT, IDEMPOTENT_METHODS
+from redfish_transport import request_timeout, time_left, budget_deadline, budget_spent, clamp_interval
+from dell_bios_registry import cached_registry, store_registry
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Keep this in line with redfish_transport.DEFAULT_POOL_SIZE
+DEFAULT_PER_HOST_LIMIT = 4
+DEFAULT_TOTAL_LIMIT = 1000
+
+# Terminal states of an iDRAC job under Managers/iDRAC.Embedded.1/Jobs
+JOB_DONE_STATES = ('Completed',)
+JOB_FAILED_STATES = ('Failed', 'CompletedWithErrors')
+
+# NIC.Integrated.1-1-1 is listed as 'Integrated NIC 1 Port 1 Partition 1'
+# among the UEFI boot options
+NIC_FQDD = re.compile(r'NIC\.(Integrated|Embedded|Slot)\.(\d+)-(\d+)-(\d+)$')
+
+# The PXE option of the given NIC among the UEFI boot options of
+# Systems/System.Embedded.1/BootOptions, or None
+def nic_boot_option(options, nic):
+    names = [nic.lower()]
+    match = NIC_FQDD.match(nic)
+    if match:
+        kind, number, port, partition = match.groups()
+        if kind == 'Slot':
+            names.append("nic in slot %s port %s partition %s" % (number, port, partition))
+        else:
+            names.append("%s nic %s port %s partition %s" % (kind.lower(), number, port, partition))
+    for option in options:
+        text = ' '.join(str(option.get(key, '')) for key in ('Id', 'DisplayName', 'Description', 'UefiDevicePath')).lower()
+        if option.get('UefiDevicePath') and 'pxe' in text and any(name in text for name in names):
+            return option
+    return None
+
+# One-time boot override: the PXE option of a NIC when one was found,
+# otherwise plain PXE, which the firmware serves from the first PXE enabled
+# NIC of the boot sequence
+def pxe_boot_override(option=None):
+    boot = {'BootSourceOverrideEnabled': 'Once', 'BootSourceOverrideTarget': 'Pxe'}
+    if option is not None:
+        boot['BootSourceOverrideTarget'] = 'UefiTarget'
+        boot['UefiTargetBootSourceOverride'] = option['UefiDevicePath']
+    return {'Boot': boot}
+
+# Hard drive first, then the PXE NIC, then the other devices in their
+# current order. Takes the entries of a BootSeq or UefiBootSeq from
+# BootSources and returns them reordered, with their Index renumbered.
+def boot_sequence(entries):
+    bootseq_list = []
+    for e in entries:
+        if e['Name'] == 'HardDisk.List.1-1':
+            bootseq_list.insert(0, e)
+        elif e['Name'] in ('NIC.Integrated.1-1-1', 'NIC.Integrated.1-3-1'):
+            bootseq_list.insert(1, e)
+        else:
+            bootseq_list.append(e)
+    for index, e in enumerate(bootseq_list):
+        e['Index'] = index
+    return bootseq_list
+
+# Status of set_pxe_boot_once once the override is set
+def pxe_boot_message(boot_mode, nic, option):
+    if option is not None:
+        return ("# INFO -- Set one-time PXE boot from %s (%s)" % (nic, option.get('DisplayName', option['UefiDevicePath'])))
+    if boot_mode == 'Uefi':
+        return ("# WARN -- No UEFI PXE boot option for %s, set one-time PXE boot from the first PXE device" % (nic))
+    return ("# INFO -- Set one-time PXE boot from the first PXE enabled NIC of the boot sequence")
+
+def log_stderr(message):
+    print (message, file=sys.stderr)
+
+# Drop read-only and unknown attributes and validate the rest locally,
+# before anything is sent to the iDRAC. This is clean_bios_attr of both
+# Utils and AsyncUtils. A misspelled name, or one this model or BIOS
+# version lacks, would otherwise silently never be applied, so the dropped
+# names are logged once per host.
+def clean_bios_attr(utils_obj, bios_data):
+    if utils_obj.bios_registry is None:
+        return bios_data
+
+    def skip(names):
+        names = sorted(set(names) - utils_obj.skipped_bios_attr)
+        if names:
+            utils_obj.skipped_bios_attr.update(names)
+            registry = utils_obj.bios_registry
+            utils_obj.log ("# WARN -- Not setting %s: read-only or not in the %s BIOS %s registry" % (', '.join(names), registry.model, registry.bios_version))
+    return utils_obj.bios_registry.clean(bios_data, skip=skip)
+
+# Without the model and BIOS version the registry cannot be told apart from
+# another model's, so there is none to validate against
+def registry_unavailable(model, bios_version):
+    if not model or not bios_version:
+        return ("# WARN -- Could not read the model and BIOS version, attributes will not be validated")
+
+# Shared aiohttp session plus per-host admission control: in-flight
+# requests, sessions, and a circuit breaker per host, as in
+# redfish_transport. Create one per event loop and hand it to every
+# AsyncUtils.
+class AsyncEngine:
+    def __init__(self, per_host_limit=None, total_limit=None):
+        if aiohttp is None:
+            raise RedfishError("The asyncio engine requires aiohttp: pip3 install aiohttp")
+        self.per_host_limit = per_host_limit or DEFAULT_PER_HOST_LIMIT
+        self.total_limit = total_limit or DEFAULT_TOTAL_LIMIT
+        self.session = None
+        self.host_limits = {}
+        self.session_limits = {}
+        self.breakers = {}
+        self.locks = {}
+        self.service_features = {}
+
+    # Named lock for work that only one host should do, such as downloading
+    # a BIOS registry the whole fleet shares
+    def lock_for(self, key):
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.locks[key] = lock
+        return lock
+
+    def limit_for(self, host):
+        limit = self.host_limits.get(host)
+        if limit is None:
+            limit = asyncio.Semaphore(self.per_host_limit)
+            self.host_limits[host] = limit
+        return limit
+
+    def session_limit_for(self, host):
+        limit = self.session_limits.get(host)
+        if limit is None:
+            limit = asyncio.Semaphore(DEFAULT_MAX_SESSIONS)
+            self.session_limits[host] = limit
+        return limit
+
+    def breaker_for(self, host):
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker()
+            self.breakers[host] = breaker
+        return breaker
+
+    async def start(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(
+                limit=self.total_limit,
+                limit_per_host=self.per_host_limit,
+                ssl=False
+            )
+            trace_configs = None
+            if redfish_metrics.recorder is not None:
+                trace_configs = [redfish_metrics.aiohttp_trace_config()]
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                headers={'Content-Type': "application/json"},
+                trace_configs=trace_configs
+            )
+        return self
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+class AsyncUtils:
+    def __init__(self, iDRAC_https_url, iDRAC_account, iDRAC_password, engine, session_cache=None):
+        self.iDRAC_https_url = iDRAC_https_url
+        self.username = iDRAC_account
+        self.password = iDRAC_password
+        self.root_url = "%s/redfish/v1" % (iDRAC_https_url)
+        self.engine = engine
+        self.session_cache = session_cache
+        self.x_auth_token = None
+        self.bios_registry = None
+        self.skipped_bios_attr = set()
+        # Where clean_bios_attr logs; the provisioning flow points it at the
+        # host's log
+        self.log = log_stderr
+        self.bios_attr = None
+        # Redfish events are only received by the threads engine
+        self.events = None
+        self.session_slot = False
+        self.boot_order_changed = False
+        self.boot_order_deferred = False
+
+    # Every call funnels through here. Returns (status, headers, body text)
+    # so the body is fully read before the connection goes back to the pool.
+    # Connection errors and 5xx are retried with jittered backoff, and the
+    # timeouts are cut to the task's deadline budget, as in Transport.request.
+    async def request(self, method, url, payload=None, timeout=60.000):
+        breaker = self.engine.breaker_for(self.iDRAC_https_url)
+        delays = retry_delays()
+        while True:
+            connect_timeout, read_timeout = request_timeout(timeout, "%s %s" % (method, url))
+            probe = breaker.check(self.iDRAC_https_url)
+            try:
+                status, headers, text = await self.send(method, url, payload, read_timeout, connect_timeout)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                left = time_left()
+                if left is not None and left <= 0:
+                    raise DeadlineExceeded("%s %s: deadline budget spent" % (method, url)) from e
+                breaker.failure()
+                # A timeout already used up the caller's timeout
+                if isinstance(e, asyncio.TimeoutError):
+                    retryable = False
+                else:
+                    retryable = method in IDEMPOTENT_METHODS or isinstance(e, aiohttp.ClientConnectorError)
+                delay = next(delays, None) if retryable else None
+                if delay is None or (left is not None and delay >= left):
+                    raise
+            except Exception:
+                breaker.failure()
+                raise
+            else:
+                breaker.success()
+                if not retryable_status(method, status):
+                    return status, headers, text
+                delay = next(delays, None)
+                left = time_left()
+                if delay is None or (left is not None and delay >= left):
+                    return status, headers, text
+            finally:
+                if probe:
+                    breaker.end_probe()
+            await asyncio.sleep(delay)
+
+    async def send(self, method, url, payload=None, timeout=60.000, connect_timeout=None):
+        headers = {}
+        if self.x_auth_token:
+            headers['X-Auth-Token'] = self.x_auth_token
+        data = json.dumps(payload) if payload is not None else None
+        recorder = redfish_metrics.recorder
+        call = None
+        if recorder is not None:
+            call = redfish_metrics.Call(self.iDRAC_https_url, method, url)
+        try:
+            async with self.engine.limit_for(self.iDRAC_https_url):
+                async with self.engine.session.request(
+                    method,
+                    url,
+                    headers=headers,
+                    data=data,
+                    timeout=aiohttp.ClientTimeout(total=timeout, connect=connect_timeout),
+                    trace_request_ctx=call
+                ) as response:
+                    text = await response.text()
+                    if call is not None:
+                        call.status = response.status
+                        call.bytes = len(text)
+                    return response.status, response.headers, text
+        finally:
+            if call is not None:
+                recorder.finish(call)
+
+    # One of the iDRAC's session slots is held from login until the session
+    # is deleted or handed back to the cache
+    async def take_session_slot(self):
+        if not self.session_slot:
+            try:
+                await asyncio.wait_for(self.engine.session_limit_for(self.iDRAC_https_url).acquire(), SESSION_WAIT)
+            except asyncio.TimeoutError:
+                raise BmcUnavailable("%s: no free session slot after %s seconds" % (self.iDRAC_https_url, SESSION_WAIT))
+            self.session_slot = True
+
+    def free_session_slot(self):
+        if self.session_slot:
+            self.session_slot = False
+            self.engine.session_limit_for(self.iDRAC_https_url).release()
+
+    async def auth_session(self):
+        await self.take_session_slot()
+        try:
+            if self.session_cache is not None:
+                entry = self.session_cache.get(self.iDRAC_https_url, self.username)
+                if entry is not None:
+                    self.x_auth_token = entry['token']
+                    status, headers, text = await self.request("GET", entry['location'], timeout=10.000)
+                    if status == 200:
+                        self.curr_session_location = entry['location']
+                        self.session_cache.touch(self.iDRAC_https_url, self.username)
+                        return
+                    self.x_auth_token = None
+
+            sessions_url = "%s/Sessions" % (self.root_url)
+            payload = {'UserName': self.username, 'Password': self.password}
+            status, headers, text = await self.request("POST", sessions_url, payload, timeout=60.000)
+            # Check to make sure we get a successful HTTP 201 Created response
+            if status == 201:
+                self.x_auth_token = headers['X-Auth-Token']
+                session_id = headers['Location']
+                self.curr_session_location = "%s%s" % (self.iDRAC_https_url, session_id)
+                if self.session_cache is not None:
+                    self.session_cache.put(self.iDRAC_https_url, self.username, self.x_auth_token, self.curr_session_location)
+            else:
+                raise RedfishError("# ERROR -- Authorization attempt for %s returned err code %s" % (self.iDRAC_https_url, str(status)))
+        except BaseException:
+            self.free_session_slot()
+            raise
+
+    async def del_curr_session(self):
+        try:
+            status, headers, text = await self.request("DELETE", self.curr_session_location, timeout=30.000)
+        finally:
+            self.free_session_slot()
+        self.x_auth_token = None
+        if self.session_cache is not None:
+            self.session_cache.remove(self.iDRAC_https_url, self.username)
+        if status == 200:
+            return ("# INFO -- Successfully deleted current session")
+        else:
+            raise RedfishError("# ERROR -- Session deletion attempt failed returned err code %s" % (str(status)))
+
+    async def end_session(self):
+        if self.session_cache is None:
+            return await self.del_curr_session()
+        self.session_cache.touch(self.iDRAC_https_url, self.username, in_use=False)
+        self.x_auth_token = None
+        self.free_session_slot()
+        return ("# INFO -- Keeping session open for reuse")
+
+    async def sweep_sessions(self):
+        sessions_url = "%s/SessionService/Sessions" % (self.root_url)
+        swept = 0
+        async with contextlib.aclosing(self.iter_collection(sessions_url)) as members:
+            async for output in members:
+                session_url = "%s%s" % (self.iDRAC_https_url, output['@odata.id'])
+                if output.get('UserName') != self.username or session_url == self.curr_session_location:
+                    continue
+                status, headers, text = await self.request("DELETE", session_url, timeout=10.000)
+                if status in (200, 204):
+                    swept += 1
+        return ("# INFO -- Deleted %s leaked sessions for %s" % (swept, self.username))
+
+    async def get_power_state(self):
+        systems_url = "%s/Systems/System.Embedded.1" % (self.root_url)
+        status, headers, text = await self.request("GET", systems_url, timeout=10.000)
+        if status == 200:
+            return (json.loads(text)['PowerState'])
+
+    async def set_power_state(self, power_state_option):
+        power_url = "%s/Systems/System.Embedded.1/Actions/ComputerSystem.Reset" % (self.root_url)
+        payload = {'ResetType': power_state_option}
+        status, headers, text = await self.request("POST", power_url, payload, timeout=30.000)
+        if 200 <= status < 300:
+            return ("# INFO -- Successfully performed a '%s'" % (power_state_option))
+        else:
+            return ("# ERROR -- returned err code '%s' with err message '%s'" % (str(status), text))
+
+    async def get_system_info(self):
+        systems_url = "%s/Systems/System.Embedded.1" % (self.root_url)
+        status, headers, text = await self.request("GET", systems_url, timeout=10.000)
+        if status == 200:
+            return (json.loads(text))
+
+    async def load_bios_registry(self, cache_dir=None):
+        system = await self.get_system_info() or {}
+        model = system.get('Model')
+        bios_version = system.get('BiosVersion')
+        if registry_unavailable(model, bios_version):
+            return registry_unavailable(model, bios_version)
+        registry = cached_registry(model, bios_version, cache_dir)
+        if registry is None:
+            async with self.engine.lock_for((model, bios_version)):
+                registry = cached_registry(model, bios_version, cache_dir)
+                if registry is None:
+                    registry_url = "%s/Systems/System.Embedded.1/Bios/BiosRegistry" % (self.root_url)
+                    status, headers, text = await self.request("GET", registry_url, timeout=60.000)
+                    if status != 200:
+                        return ("# WARN -- Could not fetch BIOS registry, err code '%s'. Attributes will not be validated" % (str(status)))
+                    registry = store_registry(model, bios_version, json.loads(text), cache_dir)
+        self.bios_registry = registry
+        return ("# INFO -- Using BIOS registry for %s BIOS %s" % (model, bios_version))
+
+    clean_bios_attr = clean_bios_attr
+
+    async def set_bios_attr(self, bios_data):
+        set_bios_url = "%s/Systems/System.Embedded.1/Bios/Settings" % (self.root_url)
+        bios_data = self.clean_bios_attr(bios_data)
+        if not bios_data:
+            return ("# INFO -- No writable BIOS attributes to set")
+        payload = {'Attributes': bios_data}
+        status, headers, text = await self.request("PATCH", set_bios_url, payload, timeout=60.000)
+        if status == 200:
+            return ("# INFO -- Successfully returned code '%s' with message: '%s'" % (str(status), text))
+        else:
+            return ("# ERROR -- returned err code '%s' with err message '%s'" % (str(status), text))
+
+    async def reset_bios_dflt(self):
+        reset_bios_url = "%s/Systems/System.Embedded.1/Bios/Actions/Bios.ResetBios" % (self.root_url)
+        status, headers, text = await self.request("POST", reset_bios_url, timeout=60.000)
+        if status == 200:
+            return ('Success')
+
+    # The service's $expand flavour, read once per engine and host
+    async def expand_query(self):
+        key = ('expand', self.iDRAC_https_url)
+        if key not in self.engine.service_features:
+            expand = None
+            status, headers, text = await self.request("GET", self.root_url, timeout=10.000)
+            if status == 200:
+                features = json.loads(text).get('ProtocolFeaturesSupported', {}).get('ExpandQuery', {})
+                if features.get('NoLinks'):
+                    expand = '.($levels=1)'
+                elif features.get('ExpandAll'):
+                    expand = '*($levels=1)'
+            self.engine.service_features[key] = expand
+        return self.engine.service_features[key]
+
+    async def get_document(self, url, timeout=10.000):
+        status, headers, text = await self.request("GET", url, timeout=timeout)
+        if status != 200:
+            raise RedfishError("# ERROR -- GET %s returned err code %s" % (url, status))
+        return json.loads(text)
+
+    # Async counterpart of redfish_transport.iter_collection: yields member
+    # documents in arrival order. Use $expand when supported, otherwise fetch
+    # the members concurrently. A caller that may stop early should close it
+    # (contextlib.aclosing) so the fetches still running are cancelled.
+    async def iter_collection(self, collection_url, timeout=10.000):
+        expand = await self.expand_query()
+        if expand:
+            collection_url = "%s?$expand=%s" % (collection_url, expand)
+        members = (await self.get_document(collection_url, timeout=timeout)).get('Members', [])
+
+        # Expanded members carry their properties, plain ones only '@odata.id'
+        tasks = [asyncio.ensure_future(self.get_document("%s%s" % (self.iDRAC_https_url, member['@odata.id']), timeout=timeout))
+                 for member in members if len(member) <= 1]
+        try:
+            for member in members:
+                if len(member) > 1:
+                    yield member
+            for next_member in asyncio.as_completed(tasks):
+                yield await next_member
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    # Retrieve it, so a failed fetch nobody waited for isn't
+                    # reported as never retrieved
+                    task.exception()
+
+    async def set_idrac_credentials(self, new_username, new_password):
+        root_idrac_accounts_url = "%s/Managers/iDRAC.Embedded.1/Accounts" % (self.root_url)
+        async with contextlib.aclosing(self.iter_collection(root_idrac_accounts_url, timeout=30.000)) as members:
+            async for output in members:
+                if str(output['Id']) == '2':
+                    each_account_url = "%s%s" % (self.iDRAC_https_url, output['@odata.id'])
+                    payload = {'UserName': new_username, 'Password': new_password}
+                    status, headers, text = await self.request("PATCH", each_account_url, payload, timeout=30.000)
+                    if status == 200:
+                        return ("# INFO -- %s Response code: '%s' Output: %s" % (each_account_url, str(status), text))
+                    else:
+                        return ("# ERROR -- Could not set iDRAC password. Returned error code '%s' and err mesg: '%s'") % (status, text)
+
+    async def get_first_one_gbps_nic(self):
+        ethernet_dev_url = "%s/Systems/System.Embedded.1/EthernetInterfaces" % (self.root_url)
+        one_gbps_list = []
+        async for output in self.iter_collection(ethernet_dev_url):
+            if output.get('SpeedMbps') == 1000:
+                one_gbps_list.append(output['Id'])
+        if one_gbps_list:
+            return sorted(one_gbps_list)[0]
+        return 'NIC.Integrated.1-1-1'
+
+    async def set_pxe_boot_once(self, boot_mode=None):
+        systems_url = "%s/Systems/System.Embedded.1" % (self.root_url)
+        option = nic = None
+        if boot_mode == 'Uefi':
+            nic = await self.get_first_one_gbps_nic()
+            options = [member async for member in self.iter_collection(systems_url + '/BootOptions')]
+            option = nic_boot_option(options, nic)
+        status, headers, text = await self.request("PATCH", systems_url, pxe_boot_override(option), timeout=30.000)
+        if status not in (200, 204):
+            return ("# ERROR -- Could not set one-time PXE boot. Returned error code '%s' and err mesg: '%s'" % (status, text))
+        return pxe_boot_message(boot_mode, nic, option)
+
+    async def get_bios_attr(self):
+        get_bios_url = "%s/Systems/System.Embedded.1/Bios" % (self.root_url)
+        self.bios_attr = (await self.get_document(get_bios_url, timeout=10.000))['Attributes']
+        return self.bios_attr
+
+    async def get_bios_boot_mode(self):
+        self.current_boot_mode = (await self.get_bios_attr())["BootMode"]
+
+    async def set_boot_order(self, reconcile=False, boot_mode=None):
+        get_boot_ord_url = "%s/Systems/System.Embedded.1/BootSources" % (self.root_url)
+        set_boot_ord_url = "%s/Systems/System.Embedded.1/BootSources/Settings" % (self.root_url)
+        boot_mode = boot_mode or self.current_boot_mode
+        if boot_mode == "Uefi":
+            boot_seq = "UefiBootSeq"
+        else:
+            boot_seq = "BootSeq"
+
+        attributes = (await self.get_document(get_boot_ord_url, timeout=10.000))['Attributes']
+        self.boot_order_changed = False
+        self.boot_order_deferred = not attributes.get(boot_seq)
+        if self.boot_order_deferred:
+            return ("# WARN -- %s is not available until BootMode '%s' is applied, deferring boot order" % (boot_seq, boot_mode))
+
+        current_seq = attributes[boot_seq]
+        current_order = [e['Name'] for e in sorted(current_seq, key=lambda e: e['Index'])]
+        bootseq_list = boot_sequence(current_seq)
+
+        self.boot_order_changed = [e['Name'] for e in bootseq_list] != current_order
+        if reconcile and not self.boot_order_changed:
+            return ("# INFO -- Boot order already set, nothing to change")
+        self.boot_order_changed = True
+
+        payload = {'Attributes': {boot_seq: bootseq_list}}
+        status, headers, text = await self.request("PATCH", set_boot_ord_url, payload, timeout=60.000)
+        output = json.loads(text) if text else {}
+        if status == 200:
+            return ("# INFO -- Successfully set boot state to defaults")
+        elif status == 500:
+            return ("# WARN -- Experienced server err message: %s" % (str(output['error']['@Message.ExtendedInfo'])))
+        else:
+            return ("# ERROR -- set BIOS boot settings failed returned err code '%s' and err message: %s" % (str(status), str(output)))
+
+    async def create_bios_config_job(self, target):
+        idrac_jobs_url = "%s/Managers/iDRAC.Embedded.1/Jobs" % (self.root_url)
+        payload = {"TargetSettingsURI": target}
+        self.last_job_id = None
+        status, headers, text = await self.request("POST", idrac_jobs_url, payload, timeout=60.000)
+        output = json.loads(text) if text else {}
+        if status == 200:
+            self.last_job_id = headers.get('Location', '').rstrip('/').split('/')[-1] or None
+            return ("# INFO -- Successfully created job with ID: %s" % (self.last_job_id))
+        elif status == 500:
+            return ("# WARN -- Experienced server err message: %s" % (str(output['error']['@Message.ExtendedInfo'])))
+        else:
+            return ("# ERROR -- job creation job failed with err code '%s' and err message: '%s'" % (str(status), str(output)))
+
+    async def get_job_status(self, job_id):
+        job_url = "%s/Managers/iDRAC.Embedded.1/Jobs/%s" % (self.root_url, job_id)
+        status, headers, text = await self.request("GET", job_url, timeout=10.000)
+        if status == 200:
+            return json.loads(text)
+
+    @redfish_metrics.timed_operation('wait_for_job')
+    async def wait_for_job(self, job_id, timeout=1800):
+        deadline = budget_deadline(timeout)
+        self.last_job_state = None
+        for interval in backoff_intervals(initial=2.0, maximum=15.0):
+            job = await self.get_job_status(job_id) or {}
+            self.last_job_state = job.get('JobState')
+            if self.last_job_state in JOB_DONE_STATES:
+                return ("# INFO -- Job %s %s: %s" % (job_id, self.last_job_state, job.get('Message')))
+            if self.last_job_state in JOB_FAILED_STATES:
+                return ("# ERROR -- Job %s %s: %s" % (job_id, self.last_job_state, job.get('Message')))
+            if time.time() >= deadline:
+                break
+            await asyncio.sleep(clamp_interval(interval, deadline))
+        if budget_spent(deadline):
+            raise DeadlineExceeded("# ERROR -- Job %s still '%s' when the time budget ran out" % (job_id, self.last_job_state))
+        return ("# ERROR -- Job %s still '%s' after %s seconds" % (job_id, self.last_job_state, timeout))
+
+    @redfish_metrics.timed_operation('wait_for_power_state')
+    async def wait_for_power_state(self, power_state, timeout=300):
+        deadline = budget_deadline(timeout)
+        for interval in backoff_intervals(initial=1.0, maximum=5.0):
+            current_power_state = await self.get_power_state()
+            if current_power_state == power_state:
+                return ("# INFO -- Server is now '%s'" % (power_state))
+            if time.time() >= deadline:
+                break
+            await asyncio.sleep(clamp_interval(interval, deadline))
+        if budget_spent(deadline):
+            raise DeadlineExceeded("# ERROR -- Server still '%s' when the time budget ran out, expected '%s'" % (current_power_state, power_state))
+        return ("# ERROR -- Server still '%s' after %s seconds, expected '%s'" % (current_power_state, timeout, power_state))
+
+# Synchronous facade: every AsyncUtils coroutine method becomes a plain
+# blocking call running on a private event loop.
+class BlockingUtils:
+    def __init__(self, iDRAC_https_url, iDRAC_account, iDRAC_password, per_host_limit=None):
+        self.loop = asyncio.new_event_loop()
+        self.engine = AsyncEngine(per_host_limit=per_host_limit)
+        self.loop.run_until_complete(self.engine.start())
+        self.async_utils = AsyncUtils(iDRAC_https_url, iDRAC_account, iDRAC_password, self.engine)
+
+    def __getattr__(self, name):
+        attr = getattr(self.async_utils, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        def wrapper(*args, **kwargs):
+            return self.loop.run_until_complete(attr(*args, **kwargs))
+        return wrapper
+
+    def close(self):
+        self.loop.run_until_complete(self.engine.close())
+        self.loop.close()
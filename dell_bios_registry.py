@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+#
+# Cached Dell BIOS attribute registry
+#
+# The registry (Systems/System.Embedded.1/Bios/BiosRegistry) describes every
+# BIOS attribute: its type, allowed values and whether it is read-only. It
+# only changes with the server model and BIOS version, so it is fetched once
+# per (model, BIOS version), kept in memory for the rest of the run and
+# saved on disk for the next one.
+#
+# BiosRegistry.check() validates a desired attribute dict locally and drops
+# read-only and unknown keys, so inventory-style entries in dell_config.json
+# (SysMemSize, SystemServiceTag, ...) never reach the iDRAC.
+#
+import os
+import re
+import json
+import threading
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'redfish', 'bios_registry')
+
+# Only these keys of each registry entry are needed for validation
+ENTRY_KEYS = (
+    'AttributeName',
+    'Type',
+    'ReadOnly',
+    'Value',
+    'LowerBound',
+    'UpperBound',
+    'ScalarIncrement',
+    'MinLength',
+    'MaxLength',
+    'ValueExpression'
+)
+
+class BiosAttributeError(ValueError):
+    pass
+
+_registries = {}
+_registries_lock = threading.Lock()
+_fetch_locks = {}
+
+class BiosRegistry:
+    def __init__(self, model, bios_version, entries):
+        self.model = model
+        self.bios_version = bios_version
+        self.entries = dict((e['AttributeName'], e) for e in entries)
+
+    # Returns (clean, skipped, errors): the writable attributes to send, the
+    # read-only or unknown attribute names that were dropped, and a list of
+    # validation error strings.
+    def check(self, bios_data):
+        clean = {}
+        skipped = []
+        errors = []
+        for name, value in bios_data.items():
+            entry = self.entries.get(name)
+            if entry is None or entry.get('ReadOnly'):
+                skipped.append(name)
+                continue
+            error = self.check_value(entry, value)
+            if error:
+                errors.append("%s: %s" % (name, error))
+            else:
+                clean[name] = value
+        return clean, skipped, errors
+
+    # check() for callers that just want the attributes to send. The names
+    # that were dropped go to skip(), if given, since they are never applied.
+    def clean(self, bios_data, skip=None):
+        clean, skipped, errors = self.check(bios_data)
+        if errors:
+            raise BiosAttributeError("# ERROR -- BIOS attributes failed validation against the %s BIOS %s registry: %s" % (self.model, self.bios_version, '; '.join(errors)))
+        if skipped and skip is not None:
+            skip(skipped)
+        return clean
+
+    def check_value(self, entry, value):
+        attr_type = entry.get('Type')
+        if attr_type == 'Enumeration':
+            allowed = [v['ValueName'] for v in entry.get('Value', [])]
+            if value not in allowed:
+                return "'%s' is not one of %s" % (value, ', '.join(allowed))
+        elif attr_type == 'Integer':
+            if isinstance(value, bool) or not isinstance(value, int):
+                return "'%s' is not an integer" % (value)
+            if 'LowerBound' in entry and value < entry['LowerBound']:
+                return "%s is below the minimum of %s" % (value, entry['LowerBound'])
+            if 'UpperBound' in entry and value > entry['UpperBound']:
+                return "%s is above the maximum of %s" % (value, entry['UpperBound'])
+        elif attr_type in ('String', 'Password'):
+            if not isinstance(value, str):
+                return "'%s' is not a string" % (value)
+            if 'MinLength' in entry and len(value) < entry['MinLength']:
+                return "shorter than %s characters" % (entry['MinLength'])
+            if 'MaxLength' in entry and len(value) > entry['MaxLength']:
+                return "longer than %s characters" % (entry['MaxLength'])
+            if entry.get('ValueExpression') and not re.match(entry['ValueExpression'], value):
+                return "'%s' does not match '%s'" % (value, entry['ValueExpression'])
+        elif attr_type == 'Boolean':
+            if not isinstance(value, bool):
+                return "'%s' is not a boolean" % (value)
+        return None
+
+def cache_path(model, bios_version, cache_dir=None):
+    key = "%s-%s" % (model, bios_version)
+    key = re.sub(r'[^A-Za-z0-9._-]+', '_', key)
+    return os.path.join(cache_dir or DEFAULT_CACHE_DIR, key + '.json')
+
+# Return the registry for (model, BIOS version) from memory or disk, or None
+# if it has to be downloaded
+def cached_registry(model, bios_version, cache_dir=None):
+    key = (model, bios_version)
+    with _registries_lock:
+        registry = _registries.get(key)
+    if registry is not None:
+        return registry
+
+    path = cache_path(model, bios_version, cache_dir)
+    try:
+        with open(path) as f:
+            entries = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+    registry = BiosRegistry(model, bios_version, entries)
+    with _registries_lock:
+        _registries[key] = registry
+    return registry
+
+# Turn a downloaded BiosRegistry document into a BiosRegistry and save the
+# trimmed entries to disk. Failing to write the cache is not fatal.
+def store_registry(model, bios_version, registry_doc, cache_dir=None):
+    entries = []
+    for e in registry_doc['RegistryEntries']['Attributes']:
+        entry = dict((k, e[k]) for k in ENTRY_KEYS if k in e)
+        if 'Value' in entry:
+            entry['Value'] = [{'ValueName': v['ValueName']} for v in entry['Value']]
+        entries.append(entry)
+
+    path = cache_path(model, bios_version, cache_dir)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = "%s.%s.tmp" % (path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        pass
+
+    registry = BiosRegistry(model, bios_version, entries)
+    with _registries_lock:
+        _registries[(model, bios_version)] = registry
+    return registry
+
+# Lock shared by every thread fetching the same registry, so a fleet run of
+# one model only downloads it once
+def fetch_lock(model, bios_version):
+    with _registries_lock:
+        return _fetch_locks.setdefault((model, bios_version), threading.Lock())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+#
+# Dell Server Configuration Profiles (SCP)
+#
+# Setting the BIOS attributes, the boot sequence and the iDRAC account
+# through their own Redfish resources costs a round-trip per resource, a
+# config job and a reboot, and RAID cannot be set through Redfish at all.
+# A single import through EID_674_Manager.ImportSystemConfiguration carries
+# all of it in one job, which the iDRAC applies with one reboot.
+#
+# render_profile() builds the profile of one host from per-component
+# attributes, on top of an optional template, e.g. a profile exported from
+# a golden host with the RAID layout in it. Profiles go inline in the import
+# request, or the iDRACs fetch them from a local HTTP share (ScpShare). Each
+# shared profile is served once under a random name and then dropped, since
+# it holds the new iDRAC password.
+#
+import copy
+import atexit
+import secrets
+import threading
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+BIOS_FQDD = 'BIOS.Setup.1-1'
+IDRAC_FQDD = 'iDRAC.Embedded.1'
+
+SCP_ACTIONS = '/Managers/iDRAC.Embedded.1/Actions/Oem/EID_674_Manager.%s'
+
+# Overrides on top of base, both {fqdd: {attribute: value}}
+def merge_components(base, overrides):
+    merged = dict((fqdd, dict(attributes)) for fqdd, attributes in base.items())
+    for fqdd, attributes in (overrides or {}).items():
+        merged.setdefault(fqdd, {}).update(attributes)
+    return merged
+
+# Components can be nested, e.g. the virtual disks of a RAID controller.
+# Ones not in the profile yet are added at the top level.
+def find_component(root, fqdd):
+    for component in root.iter('Component'):
+        if component.get('FQDD') == fqdd:
+            return component
+    return ET.SubElement(root, 'Component', FQDD=fqdd)
+
+def set_attribute(component, name, value):
+    for attribute in component.findall('Attribute'):
+        if attribute.get('Name') == name:
+            break
+    else:
+        attribute = ET.SubElement(component, 'Attribute', Name=name)
+    attribute.text = str(value)
+
+# The profile of one host as XML text. template is the parsed XML of a
+# profile to start from; it is not modified.
+def render_profile(components, template=None):
+    if template is not None:
+        root = copy.deepcopy(template)
+    else:
+        root = ET.Element('SystemConfiguration')
+    for fqdd, attributes in components.items():
+        component = find_component(root, fqdd)
+        for name, value in attributes.items():
+            set_attribute(component, name, value)
+    return ET.tostring(root, encoding='unicode')
+
+def load_template(path):
+    root = ET.parse(path).getroot()
+    if root.tag != 'SystemConfiguration':
+        raise ValueError("%s is not a Server Configuration Profile" % (path))
+    return root
+
+class ShareHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        profile = self.server.share.take(self.path.rstrip('/').split('/')[-1])
+        if profile is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = profile.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class ShareServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class ScpShare:
+    # address is the host name or IP the iDRACs can reach this machine at
+    def __init__(self, address, port=0, bind='0.0.0.0'):
+        self.address = address
+        self.server = ShareServer((bind, port), ShareHandler)
+        self.server.share = self
+        self.port = self.server.server_address[1]
+        self.profiles = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+        return self
+
+    # Serve profile under a new random file name, once
+    def publish(self, profile):
+        name = "%s.xml" % (secrets.token_hex(16))
+        with self.lock:
+            self.profiles[name] = profile
+        return name
+
+    def take(self, name):
+        with self.lock:
+            return self.profiles.pop(name, None)
+
+    def withdraw(self, name):
+        self.take(name)
+
+    # ShareParameters of an import of the published file name
+    def share_parameters(self, name):
+        return {
+            'IPAddress': self.address,
+            'PortNumber': str(self.port),
+            'ShareName': 'scp',
+            'FileName': name,
+            'ShareType': 'HTTP',
+            'Target': 'ALL'
+        }
+
+    def close(self):
+        if self.thread is not None:
+            self.server.shutdown()
+            self.thread = None
+        self.server.server_close()
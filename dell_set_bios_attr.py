@@ -4,7 +4,8 @@
 # Written 12/14/2017
 #
 # This script gathers system attributes for Dell 12th, 13th, and 14th gen
-# servers. You should run it in parallel to gather info for many servers.
+# servers. To handle many servers at once, pass an inventory file with
+# --inventory and the whole fleet is driven from this one process.
 #
 #
 import re
@@ -13,14 +14,42 @@ import sys
 import json
 import time
 import sqlite3
+import csv
+import hashlib
+import threading
+import contextlib
+import asyncio
+import concurrent.futures
 import requests
 import argparse
 import traceback
 import warnings
+import redfish_metrics
+from redfish_transport import get_transport, close_transport, transport_stats, backoff_intervals, iter_collection, bmc_url
+from redfish_transport import budget, budget_deadline, budget_spent, clamp_interval, DeadlineExceeded, CLEANUP_BUDGET
+from dell_async_utils import AsyncEngine, AsyncUtils, RedfishError, nic_boot_option, pxe_boot_override, pxe_boot_message, boot_sequence, JOB_DONE_STATES, JOB_FAILED_STATES
+from dell_async_utils import clean_bios_attr, registry_unavailable, log_stderr
+from redfish_session_cache import SessionCache, session_valid, DEFAULT_CACHE_FILE as DEFAULT_SESSION_CACHE_FILE
+from dell_bios_registry import BiosAttributeError, cached_registry, store_registry, fetch_lock
+from redfish_events import EventListener, event_mark, event_pause
+from bios_attribute_store import AttributeStore
+from fleet_query import INDEX_SCHEMA, index_attributes, update_index
+from dell_scp import ScpShare, load_template, render_profile, merge_components, BIOS_FQDD, IDRAC_FQDD, SCP_ACTIONS
 
 warnings.filterwarnings("ignore")
 
+# Attributes in 'desired' whose value differs from 'current'. The iDRAC
+# reports some numeric attributes as integers, so compare loosely.
+def bios_delta(current, desired):
+    delta = {}
+    for key, value in desired.items():
+        if key in current and str(current[key]) == str(value):
+            continue
+        delta[key] = value
+    return delta
+
 def parse_args():
+    global iDRAC_ip
     global iDRAC_https_url
     global iDRAC_account
     global iDRAC_password
@@ -29,22 +58,128 @@ def parse_args():
     global reboot_flag
     global data_file
     global default
+    global pool_size
+    global inventory_file
+    global workers
+    global results_file
+    global engine
+    global reconcile_flag
+    global use_registry
+    global registry_cache
+    global state_db
+    global session_cache_file
+    global sweep_sessions
+    global event_address
+    global event_port
+    global event_cert
+    global event_key
+    global host_timeout
+    global pxe_once
+    global scp_mode
+    global scp_template_file
+    global scp_overrides_file
+    global scp_share_address
+    global scp_share_port
+    global scp_export_dir
+    global collect_mode
 
     parser = argparse.ArgumentParser(
         description='Set BIOS attributes for Dell 12th, 13th, and 14th gen servers',
         formatter_class=argparse.RawTextHelpFormatter
     )
-    parser.add_argument('-i', '--ip', help='Enter IP address', required=True)
-    parser.add_argument('-a', '--asset', help='Enter asset tag', required=True)
-    parser.add_argument('-u', '--username', help='Enter username', required=True)
-    parser.add_argument('-p', '--password', help='Enter password', required=True)
-    parser.add_argument('-c', '--credential', help='Enter new username/password comma-separated', required=True)
-    parser.add_argument('-f', '--file', help='Path to JSON config file', required=True)
+    parser.add_argument('-i', '--ip', help='Enter IP address')
+    parser.add_argument('-a', '--asset', help='Enter asset tag')
+    parser.add_argument('-u', '--username', help='Enter username')
+    parser.add_argument('-p', '--password', help='Enter password')
+    parser.add_argument('-c', '--credential', help='Enter new username/password comma-separated')
+    parser.add_argument('-f', '--file', help='Path to JSON config file (not needed with --collect)')
     parser.add_argument('-r', '--reboot', help='Toggle to reboot', action='store_true')
+    parser.add_argument('--pxe-once', help='PXE boot the host once through a one-time boot override instead of\n'
+                                           'changing the boot order; boots it right away with a single power\n'
+                                           'action that also applies any pending BIOS changes (implies -r)',
+                        action='store_true')
+    parser.add_argument('--scp', help='Apply the JSON config file, the boot order and the new iDRAC account\n'
+                                      'as one Server Configuration Profile import job per host, with a\n'
+                                      'single reboot when -r is given (threads engine only)',
+                        action='store_true')
+    parser.add_argument('--scp-template', help='SCP: XML profile to build on, e.g. one exported from a golden host\n'
+                                               'with the RAID layout')
+    parser.add_argument('--scp-overrides', help='SCP: JSON file of per-host overrides,\n'
+                                                '  {"<ip>": {"<FQDD>": {"<attribute>": "<value>"}}}')
+    parser.add_argument('--scp-share', help='SCP: serve the profiles over HTTP from this host name or IP of this\n'
+                                            'machine instead of sending them inline', metavar='ADDRESS')
+    parser.add_argument('--scp-share-port', help='SCP: port of the profile share (default: any free port)', type=int, default=0)
+    parser.add_argument('--scp-export', help='SCP: save the current profile of each host to DIR/<ip>.xml first', metavar='DIR')
+    parser.add_argument('--collect', help='Provision nothing; collect the power state, model, service tag,\n'
+                                          'BIOS version and BIOS attributes of each host into --state-db.\n'
+                                          'Repeat runs only download what changed (threads engine only)',
+                        action='store_true')
     parser.add_argument('-d', '--default', help='Reset BIOS to factory defaults', action='store_true')
+    parser.add_argument('-R', '--reconcile', help='Apply the JSON config file, but only PATCH attributes that differ\n'
+                                                  'and skip the config job and reboot when nothing changed',
+                        action='store_true')
+    parser.add_argument('--no-registry', help='Do not validate attributes against the BIOS attribute registry', action='store_true')
+    parser.add_argument('--registry-cache', help='Directory for cached BIOS registries (default: ~/.cache/redfish/bios_registry)')
+    parser.add_argument('-s', '--state-db', help='SQLite file recording per-host progress, so a re-run skips\n'
+                                                 'hosts and stages that already completed')
+    parser.add_argument('--session-cache', help='Reuse iDRAC sessions across runs, cached in this file\n'
+                                                '(default: ~/.cache/redfish/sessions.json)',
+                        nargs='?', const=DEFAULT_SESSION_CACHE_FILE)
+    parser.add_argument('--sweep-sessions', help='Delete all other iDRAC sessions of the login user, e.g. ones\n'
+                                                 'leaked by crashed runs. This includes sessions of runs still going',
+                        action='store_true')
+    parser.add_argument('--events', help='Wait for jobs and power changes on Redfish events instead of polling.\n'
+                                         'The iDRACs send them to this host name or IP of this machine\n'
+                                         '(threads engine only; hosts that refuse the subscription are polled)',
+                        metavar='ADDRESS')
+    parser.add_argument('--event-port', help='Port of the event receiver (default: any free port)', type=int, default=0)
+    parser.add_argument('--event-cert', help='TLS certificate file of the event receiver')
+    parser.add_argument('--event-key', help='TLS key file of the event receiver')
+    parser.add_argument('--pool-size', help='Max keep-alive connections per iDRAC (default: 4)', type=int, default=None)
+    parser.add_argument('--inventory', help='Fleet mode: CSV file with one host per row\n'
+                                            '  ip,asset[,username,password[,new_username,new_password]]\n'
+                                            'Missing columns fall back to -u/-p/-c')
+    parser.add_argument('-w', '--workers', help='Fleet mode: number of hosts provisioned at once (default: 32)', type=int, default=32)
+    parser.add_argument('--host-timeout', help='Give up on a host after this many seconds in total; every request\n'
+                                               'and wait of the host stops at this budget (default: no limit)', type=float)
+    parser.add_argument('-o', '--results', help='Fleet mode: write JSON result records here instead of stdout')
+    parser.add_argument('-e', '--engine', help='Fleet mode: threads (default) or asyncio\n'
+                                               'asyncio needs aiohttp and scales to thousands of hosts,\n'
+                                               'in which case --workers can be set far higher',
+                        choices=['threads', 'asyncio'], default='threads')
+    parser.add_argument('--metrics', help='Write per-endpoint request timings as a JSON report to this file', metavar='FILE')
+    parser.add_argument('--metrics-prom', help='Write the same metrics in Prometheus text format to this file', metavar='FILE')
+    parser.add_argument('--trace', help='Write every Redfish request as one JSON line to this file', metavar='FILE')
     args = vars(parser.parse_args())
 
-    iDRAC_https_url = 'https://' + args['ip']
+    if args['events'] and not (args['event_cert'] and args['event_key']):
+        parser.error("--events needs --event-cert and --event-key")
+    if args['scp'] and args['engine'] != 'threads':
+        parser.error("--scp needs the threads engine")
+    for option in ('scp_template', 'scp_overrides', 'scp_share', 'scp_export'):
+        if args[option] and not args['scp']:
+            parser.error("--%s needs --scp" % (option.replace('_', '-')))
+
+    # Before any transport is created, so connection timings are collected
+    if args['metrics'] or args['metrics_prom'] or args['trace']:
+        redfish_metrics.enable(args['metrics'], args['metrics_prom'], args['trace'])
+
+    if args['collect']:
+        if not args['state_db']:
+            parser.error("--collect needs --state-db to collect into")
+        if args['engine'] != 'threads':
+            parser.error("--collect needs the threads engine")
+    elif not args['file']:
+        parser.error("--file is required unless --collect is given")
+
+    if not args['inventory']:
+        required_args = ('ip', 'username', 'password') if args['collect'] else ('ip', 'asset', 'username', 'password', 'credential')
+        for required in required_args:
+            if not args[required]:
+                parser.error("--%s is required unless --inventory is given" % (required))
+
+    iDRAC_ip = args['ip']
+    iDRAC_https_url = bmc_url(args['ip']) if args['ip'] else None
     iDRAC_account = args['username']
     iDRAC_password = args['password']
     new_user_passwd = args['credential']
@@ -52,65 +187,158 @@ def parse_args():
     data_file = args['file']
     reboot_flag = args['reboot']
     default = args['default']
+    pool_size = args['pool_size']
+    inventory_file = args['inventory']
+    workers = args['workers']
+    results_file = args['results']
+    engine = args['engine']
+    reconcile_flag = args['reconcile']
+    use_registry = not args['no_registry']
+    registry_cache = args['registry_cache']
+    state_db = args['state_db']
+    session_cache_file = args['session_cache']
+    sweep_sessions = args['sweep_sessions']
+    event_address = args['events']
+    event_port = args['event_port']
+    event_cert = args['event_cert']
+    event_key = args['event_key']
+    host_timeout = args['host_timeout']
+    pxe_once = args['pxe_once']
+    scp_mode = args['scp']
+    scp_template_file = args['scp_template']
+    scp_overrides_file = args['scp_overrides']
+    scp_share_address = args['scp_share']
+    scp_share_port = args['scp_share_port']
+    scp_export_dir = args['scp_export']
+    collect_mode = args['collect']
 
 class Utils:
-    def __init__(self, iDRAC_https_url, iDRAC_account, iDRAC_password):
+    def __init__(self, iDRAC_https_url, iDRAC_account, iDRAC_password, pool_size=None, session_cache=None):
         self.iDRAC_https_url = iDRAC_https_url
         self.username = iDRAC_account
         self.password = iDRAC_password
         self.root_url = "%s/redfish/v1" % (iDRAC_https_url)
+        # All calls for this iDRAC share one pooled keep-alive session
+        self.transport = get_transport(iDRAC_https_url, pool_size=pool_size)
+        self.session_cache = session_cache
+        self.bios_registry = None
+        self.skipped_bios_attr = set()
+        # Where clean_bios_attr logs; the provisioning flow points it at the
+        # host's log
+        self.log = log_stderr
+        self.bios_attr = None
+        # HostEvents from an EventListener; waits then sleep until an event
+        # instead of polling
+        self.events = None
+        self.session_slot = False
+        self.boot_order_changed = False
+        self.boot_order_deferred = False
+
+    # One of the iDRAC's session slots (see redfish_transport) is held from
+    # login until the session is deleted or handed back to the cache
+    def take_session_slot(self):
+        if not self.session_slot:
+            self.transport.acquire_session()
+            self.session_slot = True
+
+    def free_session_slot(self):
+        if self.session_slot:
+            self.session_slot = False
+            self.transport.release_session()
 
     def auth_session(self):
-        sessions_url = "%s/Sessions" % (self.root_url)
-        headers = { 'Content-Type': "application/json" }
-        payload = "{\"UserName\": \"%s\", \"Password\": \"%s\"}" % (self.username, self.password)
-        response = requests.request(
-            "POST",
-            sessions_url,
-            headers=headers,
-            data=payload,
-            verify=False,
-            timeout=60.000
-        )
-        # Check to make sure we get a successful HTTP 201 Created response
-        #if re.search(r'^2[0-9][0-9]$', str(response.status_code)):
-        if response.status_code == requests.codes.created:
-            self.x_auth_token = response.headers['X-Auth-Token']
-            session_id = response.headers['Location']
-            self.curr_session_location = "%s%s" % (self.iDRAC_https_url, session_id)
-        else:
-            print ("# ERROR -- Authorization attempt for %s returned err code %s" % (self.iDRAC_https_url, str(response.status_code)))
-            sys.exit(1)
+        self.take_session_slot()
+        try:
+            # Reuse a cached session from an earlier run if the iDRAC still
+            # accepts it, instead of taking another slot in its session table
+            if self.session_cache is not None:
+                entry = self.session_cache.get(self.iDRAC_https_url, self.username)
+                if entry is not None and session_valid(self.transport, entry):
+                    self.x_auth_token = entry['token']
+                    self.transport.set_header('X-Auth-Token', self.x_auth_token)
+                    self.curr_session_location = entry['location']
+                    self.session_cache.touch(self.iDRAC_https_url, self.username)
+                    return
+
+            sessions_url = "%s/Sessions" % (self.root_url)
+            payload = "{\"UserName\": \"%s\", \"Password\": \"%s\"}" % (self.username, self.password)
+            response = self.transport.request(
+                "POST",
+                sessions_url,
+                data=payload,
+                verify=False,
+                timeout=60.000
+            )
+            # Check to make sure we get a successful HTTP 201 Created response
+            #if re.search(r'^2[0-9][0-9]$', str(response.status_code)):
+            if response.status_code == requests.codes.created:
+                self.x_auth_token = response.headers['X-Auth-Token']
+                self.transport.set_header('X-Auth-Token', self.x_auth_token)
+                session_id = response.headers['Location']
+                self.curr_session_location = "%s%s" % (self.iDRAC_https_url, session_id)
+                if self.session_cache is not None:
+                    self.session_cache.put(self.iDRAC_https_url, self.username, self.x_auth_token, self.curr_session_location)
+            else:
+                print ("# ERROR -- Authorization attempt for %s returned err code %s" % (self.iDRAC_https_url, str(response.status_code)))
+                sys.exit(1)
+        except BaseException:
+            self.free_session_slot()
+            raise
 
     def del_curr_session(self):
-        headers = {
-            'Content-Type': "application/json",
-            'X-Auth-Token': self.x_auth_token
-        }
-        response = requests.request(
-            "DELETE",
-            self.curr_session_location,
-            headers=headers,
-            verify=False,
-            timeout=30.000
-        )
+        try:
+            response = self.transport.request(
+                "DELETE",
+                self.curr_session_location,
+                verify=False,
+                timeout=30.000
+            )
+        finally:
+            self.free_session_slot()
+        self.transport.del_header('X-Auth-Token')
+        if self.session_cache is not None:
+            self.session_cache.remove(self.iDRAC_https_url, self.username)
         if response.status_code == requests.codes.ok:
             return ("# INFO -- Successfully deleted current session")
             sys.exit(0)
         else:
             print ("# ERROR -- Session deletion attempt failed returned err code %s" % (str(response.status_code)))
             sys.exit(1)
-    
+
+    # With a session cache, leave the session open for the next run instead
+    # of deleting it
+    def end_session(self):
+        if self.session_cache is None:
+            return self.del_curr_session()
+        self.session_cache.touch(self.iDRAC_https_url, self.username, in_use=False)
+        self.transport.del_header('X-Auth-Token')
+        self.free_session_slot()
+        return ("# INFO -- Keeping session open for reuse")
+
+    # Delete every session of our user other than the current one. Use this
+    # to clean up sessions leaked by runs from before the session cache.
+    def sweep_sessions(self):
+        sessions_url = "%s/SessionService/Sessions" % (self.root_url)
+        swept = 0
+        for output in self.iter_collection(sessions_url):
+            session_url = "%s%s" % (self.iDRAC_https_url, output['@odata.id'])
+            if output.get('UserName') != self.username or session_url == self.curr_session_location:
+                continue
+            response = self.transport.request(
+                "DELETE",
+                session_url,
+                verify=False,
+                timeout=10.000
+            )
+            if response.status_code in (requests.codes.ok, requests.codes.no_content):
+                swept += 1
+        return ("# INFO -- Deleted %s leaked sessions for %s" % (swept, self.username))
+
     def get_power_state(self):
         systems_url = "%s/Systems/System.Embedded.1" % (self.root_url)
-        headers = {
-            'Content-Type': "application/json",
-            'X-Auth-Token': self.x_auth_token
-        }
-        response = requests.request(
+        response = self.transport.request(
             "GET",
             systems_url,
-            headers=headers,
             verify=False,
             timeout=10.000
         )
@@ -127,14 +355,9 @@ class Utils:
         #   "PushPowerButton",
         #   "Nmi"
         payload = {'ResetType': power_state_option}
-        headers = {
-            'Content-Type': "application/json",
-            'X-Auth-Token': self.x_auth_token
-        }
-        response = requests.request(
+        response = self.transport.request(
             "POST",
             power_url,
-            headers=headers,
             data=json.dumps(payload),
             verify=False,
             timeout=30.000
@@ -144,17 +367,74 @@ class Utils:
         else:
             return ("# ERROR -- returned err code '%s' with err message '%s'" % (str(response.status_code), response.text))
 
+    def get_system_info(self):
+        systems_url = "%s/Systems/System.Embedded.1" % (self.root_url)
+        response = self.transport.request(
+            "GET",
+            systems_url,
+            verify=False,
+            timeout=10.000
+        )
+        if response.status_code == requests.codes.ok:
+            return (response.json())
+
+    # GET a resource unless it still matches the copy with the given ETag.
+    # Returns (etag, document), with None for the document on a 304.
+    def get_if_changed(self, url, etag=None, auth=None):
+        headers = {'If-None-Match': etag} if etag else None
+        response = self.transport.request(
+            "GET",
+            url,
+            headers=headers,
+            auth=auth,
+            verify=False,
+            timeout=10.000
+        )
+        if response.status_code == requests.codes.not_modified:
+            return etag, None
+        if response.status_code != requests.codes.ok:
+            raise RedfishError("# ERROR -- GET %s returned err code '%s' and err message: '%s'" % (url, response.status_code, response.text))
+        return response.headers.get('ETag'), response.json()
+
+    # Load the BIOS attribute registry for this model and BIOS version. It is
+    # only downloaded when neither the in-memory nor the on-disk cache has it.
+    def load_bios_registry(self, cache_dir=None):
+        system = self.get_system_info() or {}
+        model = system.get('Model')
+        bios_version = system.get('BiosVersion')
+        if registry_unavailable(model, bios_version):
+            return registry_unavailable(model, bios_version)
+        registry = cached_registry(model, bios_version, cache_dir)
+        if registry is None:
+            with fetch_lock(model, bios_version):
+                registry = cached_registry(model, bios_version, cache_dir)
+                if registry is None:
+                    registry_url = "%s/Systems/System.Embedded.1/Bios/BiosRegistry" % (self.root_url)
+                    response = self.transport.request(
+                        "GET",
+                        registry_url,
+                        verify=False,
+                        timeout=60.000
+                    )
+                    if response.status_code != requests.codes.ok:
+                        return ("# WARN -- Could not fetch BIOS registry, err code '%s'. Attributes will not be validated" % (str(response.status_code)))
+                    registry = store_registry(model, bios_version, response.json(), cache_dir)
+        self.bios_registry = registry
+        return ("# INFO -- Using BIOS registry for %s BIOS %s" % (model, bios_version))
+
+    # Drop read-only and unknown attributes and validate the rest locally,
+    # before anything is sent to the iDRAC
+    clean_bios_attr = clean_bios_attr
+
     def set_bios_attr(self, bios_data):
         set_bios_url = "%s/Systems/System.Embedded.1/Bios/Settings" % (self.root_url)
+        bios_data = self.clean_bios_attr(bios_data)
+        if not bios_data:
+            return ("# INFO -- No writable BIOS attributes to set")
         payload = {'Attributes':bios_data}
-        headers = {
-            'Content-Type': "application/json",
-            'X-Auth-Token': self.x_auth_token
-        }
-        response = requests.request(
+        response = self.transport.request(
             "PATCH",
             set_bios_url,
-            headers=headers,
             data=json.dumps(payload),
             verify=False,
             timeout=60.000
@@ -167,109 +447,84 @@ class Utils:
         
     def reset_bios_dflt(self):
         reset_bios_url = "%s/Systems/System.Embedded.1/Bios/Actions/Bios.ResetBios" % (self.root_url)
-        headers = {
-            'Content-Type': "application/json",
-            'X-Auth-Token': self.x_auth_token
-        }
-        response = requests.request(
+        response = self.transport.request(
             "POST",
             reset_bios_url,
-            headers=headers,
             verify=False,
             timeout=60.000
         )
         if response.status_code == requests.codes.ok:
             return ('Success')
 
+    # Walk a Redfish collection, yielding member documents as they arrive
+    def iter_collection(self, collection_url, timeout=10.000):
+        return iter_collection(self.transport, self.iDRAC_https_url, collection_url, root_url=self.root_url, timeout=timeout)
+
     def set_idrac_credentials(self, new_username, new_password):
         root_idrac_accounts_url = "%s/Managers/iDRAC.Embedded.1/Accounts" % (self.root_url)
-        headers = {
-            'Content-Type': "application/json",
-            'X-Auth-Token': self.x_auth_token
-        }
-        response = requests.request(
-            "GET",
-            root_idrac_accounts_url,
-            headers=headers,
-            verify=False,
-            timeout=30.000
-        )
-        output = response.json()
-        for e in output['Members']:
-            each_account_path = e['@odata.id']
-            each_account_url = "%s%s" % (self.iDRAC_https_url, each_account_path)
-            response = requests.request(
-                "GET",
-                each_account_url,
-                headers=headers,
-                verify=False,
-                timeout=10.000
-            )
-            output = response.json()
+        for output in self.iter_collection(root_idrac_accounts_url, timeout=30.000):
             #UserName = output['UserName']
             Id = str(output['Id'])
             if Id == '2':
-                print (each_account_url)
+                each_account_url = "%s%s" % (self.iDRAC_https_url, output['@odata.id'])
                 # Now that we have found the iDRAC account ID, we can proceed to change it 
                 # to out standard IT defaults
                 payload = {'UserName': new_username, 'Password': new_password}
-                response = requests.request(
+                response = self.transport.request(
                     "PATCH",
                     each_account_url,
-                    headers=headers,
                     data=json.dumps(payload),
                     verify=False,
                     timeout=30.000
                 )
                 if response.status_code == requests.codes.ok:
                     # TODO: Maybe parse JSON to deliver better output message
-                    return ("# INFO -- Response code: '%s' Output: %s" % (str(response.status_code), response.text))
+                    return ("# INFO -- %s Response code: '%s' Output: %s" % (each_account_url, str(response.status_code), response.text))
                 else:
                     return ("# ERROR -- Could not set iDRAC password. Returned error code '%s' and err mesg: '%s'") % (response.status_code, response.text)
-                break
-    
-        # Get 1Gbps NIC
-        def get_first_one_gbps_nic(self):
-            ethernet_dev_url = "%s/Systems/System.Embedded.1/EthernetInterfaces" % (self.root_url)
-            headers = {
-                'Content-Type': "application/json",
-                'X-Auth-Token': self.x_auth_token
-            }
-            # Determine the 1Gbps interface
-            # We want this to boot second after the hard drive
-            response = requests.request(
-                "GET",
-                ethernet_dev_url,
-                headers=headers,
-                verify=False,
-                timeout=10.000
-            )
-            output = response.json()
-
-            one_gbps_list = []
-            for e in output['Members']:
-                each_nic_path = e['@odata.id']
-                each_nic_url = "%s%s" % (self.iDRAC_https_url, each_nic_path)
-                response = requests.request(
-                    "GET",
-                    each_nic_url,
-                    headers=headers,
-                    verify=False,
-                    timeout=10.000
-                )
-                output = response.json()
-                if output['SpeedMbps'] == 1000:
-                    one_gbps_list.append(output['Id'])
-            try:
-                target_nic = sorted(one_gbps_list)[0]
-            except:
-                target_nic = 'NIC.Integrated.1-1-1'
 
-            return target_nic
+    # Get 1Gbps NIC
+    def get_first_one_gbps_nic(self):
+        ethernet_dev_url = "%s/Systems/System.Embedded.1/EthernetInterfaces" % (self.root_url)
+        # Determine the 1Gbps interface
+        # We want this to boot second after the hard drive
+        one_gbps_list = []
+        for output in self.iter_collection(ethernet_dev_url):
+            if output.get('SpeedMbps') == 1000:
+                one_gbps_list.append(output['Id'])
+        try:
+            target_nic = sorted(one_gbps_list)[0]
+        except:
+            target_nic = 'NIC.Integrated.1-1-1'
+
+        return target_nic
+
+    # One-time PXE boot for the OS install. Unlike set_boot_order this needs
+    # no config job and leaves the persistent boot sequence alone; the next
+    # boot uses the override and clears it. In UEFI mode the PXE option of
+    # the 1Gbps NIC is booted directly, in BIOS mode the firmware picks the
+    # first PXE enabled NIC of the boot sequence.
+    def set_pxe_boot_once(self, boot_mode=None):
+        systems_url = "%s/Systems/System.Embedded.1" % (self.root_url)
+        option = nic = None
+        if boot_mode == 'Uefi':
+            nic = self.get_first_one_gbps_nic()
+            option = nic_boot_option(list(self.iter_collection(systems_url + '/BootOptions')), nic)
+        response = self.transport.request(
+            "PATCH",
+            systems_url,
+            data=json.dumps(pxe_boot_override(option)),
+            verify=False,
+            timeout=30.000
+        )
+        if response.status_code not in (200, 204):
+            return ("# ERROR -- Could not set one-time PXE boot. Returned error code '%s' and err mesg: '%s'" % (response.status_code, response.text))
+        return pxe_boot_message(boot_mode, nic, option)
 
     # Dell currently does not support creating RAID virtual disks via Redfish
     # They plan on releasing this feature Q2 2018
     # Until then, you can use SCP feature to import these settings
+    # (--scp with a --scp-template that has the RAID components, see dell_scp.py)
     # TODO: Figure out whether using integrated or RAID controller maybe?
 
 
@@ -277,33 +532,53 @@ class Utils:
     # Boot order stuff
     # TODO: Need to figure out 1Gbps interface by comparing last octet of 'PermanentMACAddress'
     # Note that 'HardDisk.List.1-1' seems to work regardless whether or not RAID is integrated or discrete
-    def get_bios_boot_mode(self):
+    def get_bios_attr(self):
         get_bios_url = "%s/Systems/System.Embedded.1/Bios" % (self.root_url)
-        headers = {
-            'Content-Type': "application/json",
-            'X-Auth-Token': self.x_auth_token
-        }
-        response = requests.request(
+        response = self.transport.request(
             "GET",
             get_bios_url,
-            headers=headers,
             verify=False,
             timeout=10.000
         )
+        if response.status_code != requests.codes.ok:
+            raise RedfishError("# ERROR -- GET %s returned err code %s" % (get_bios_url, response.status_code))
         output = response.json()
-        current_boot_mode = output[u'Attributes']["BootMode"]
+        self.bios_attr = output[u'Attributes']
+        return self.bios_attr
+
+    def get_bios_boot_mode(self):
+        current_boot_mode = self.get_bios_attr()["BootMode"]
         self.current_boot_mode = current_boot_mode
 
-    #def get_boot_order(self):
+    # Reconcile mode: only PATCH the attributes that differ from what the host
+    # already has. An empty self.bios_delta means no config job is needed.
+    def apply_bios_delta(self, bios_data):
+        self.bios_delta = bios_delta(self.get_bios_attr(), self.clean_bios_attr(bios_data))
+        if not self.bios_delta:
+            return ("# INFO -- BIOS attributes already match, nothing to set")
+        return self.set_bios_attr(self.bios_delta)
 
-    def set_boot_order(self):
+    # The entries of a boot sequence, BootSeq or UefiBootSeq, in BootSources.
+    # None when the firmware only lists the sequence of the other BootMode.
+    def get_boot_seq(self, boot_seq):
         get_boot_ord_url = "%s/Systems/System.Embedded.1/BootSources" % (self.root_url)
+        response = self.transport.request(
+            "GET",
+            get_boot_ord_url,
+            verify=False,
+            timeout=10.000
+        )
+        if response.status_code != requests.codes.ok:
+            raise RedfishError("# ERROR -- GET %s returned err code '%s' and err message: '%s'" % (get_boot_ord_url, response.status_code, response.text))
+        return response.json()['Attributes'].get(boot_seq) or None
+
+    # boot_mode picks the sequence to set (BootSeq or UefiBootSeq). It
+    # defaults to the current mode; pass the pending BootMode to stage the
+    # boot order together with a BootMode change.
+    def set_boot_order(self, reconcile=False, boot_mode=None):
         set_boot_ord_url = "%s/Systems/System.Embedded.1/BootSources/Settings" % (self.root_url)
-        headers = {
-            'Content-Type': "application/json",
-            'X-Auth-Token': self.x_auth_token
-        }
-        if self.current_boot_mode == "Uefi":
+        boot_mode = boot_mode or self.current_boot_mode
+        if boot_mode == "Uefi":
             boot_seq = "UefiBootSeq"
         else:
             boot_seq = "BootSeq"
@@ -313,31 +588,25 @@ class Utils:
         # Then, make sure that hard drive is index 0 and PXE is 1 and all the others are after
         # Tricky coding below
         #
-        response = requests.request(
-            "GET",
-            get_boot_ord_url,
-            headers=headers,
-            verify=False,
-            timeout=10.000
-        )
-        output = response.json()
+        current_seq = self.get_boot_seq(boot_seq)
+
+        # Some firmware only lists the sequence of the active boot mode. Then
+        # the boot order has to wait until the BootMode change is applied.
+        self.boot_order_changed = False
+        self.boot_order_deferred = not current_seq
+        if self.boot_order_deferred:
+            return ("# WARN -- %s is not available until BootMode '%s' is applied, deferring boot order" % (boot_seq, boot_mode))
 
         payload = {}
-        bootseq_list = []
-
-        for e in output['Attributes'][boot_seq]:
-            if e['Name'] == 'HardDisk.List.1-1':
-                bootseq_list.insert(0, e)
-            elif e['Name'] == 'NIC.Integrated.1-1-1':
-                bootseq_list.insert(1, e)
-            elif e['Name'] == 'NIC.Integrated.1-3-1':
-                bootseq_list.insert(1, e)
-            else:
-                bootseq_list.append(e)
+        current_order = [e['Name'] for e in sorted(current_seq, key=lambda e: e['Index'])]
+        bootseq_list = boot_sequence(current_seq)
 
-        for i in bootseq_list:
-            index = bootseq_list.index(i)
-            i['Index'] = index
+        # In reconcile mode leave an already correct boot order alone, so the
+        # caller can skip the config job and reboot
+        self.boot_order_changed = [e['Name'] for e in bootseq_list] != current_order
+        if reconcile and not self.boot_order_changed:
+            return ("# INFO -- Boot order already set, nothing to change")
+        self.boot_order_changed = True
 
         payload['Attributes'] = {boot_seq:bootseq_list}
         json_data = json.dumps(payload)
@@ -372,12 +641,11 @@ class Utils:
         #
         #
 
-        response = requests.request(
+        response = self.transport.request(
             "PATCH",
             set_boot_ord_url,
             #data=json.dumps(payload),
             data=json_data,
-            headers=headers,
             verify=False,
             timeout=60.000
         )
@@ -391,97 +659,944 @@ class Utils:
 
     def create_bios_config_job(self,target):
         idrac_jobs_url = "%s/Managers/iDRAC.Embedded.1/Jobs" % (self.root_url)
-        headers = {
-            'Content-Type': "application/json",
-            'X-Auth-Token': self.x_auth_token
-        }
         payload = {"TargetSettingsURI":target}
-        response = requests.request(
+        self.last_job_id = None
+        response = self.transport.request(
             "POST",
             idrac_jobs_url,
             data=json.dumps(payload),
-            headers=headers,
             verify=False,
             timeout=60.000
         )
         output = response.json()
-        # TODO: Obtain Job ID from header and poll for its creation status
         if response.status_code == requests.codes.ok:
-            return ("# INFO -- Successfully created job with ID:")
+            # The new job's URI comes back in the Location header, e.g.
+            # /redfish/v1/Managers/iDRAC.Embedded.1/Jobs/JID_471269252011
+            self.last_job_id = response.headers.get('Location', '').rstrip('/').split('/')[-1] or None
+            return ("# INFO -- Successfully created job with ID: %s" % (self.last_job_id))
         elif response.status_code == 500:
             return ("# WARN -- Experienced server err message: %s" % (str(output['error']['@Message.ExtendedInfo'])))
         else:
             return ("# ERROR -- job creation job failed with err code '%s' and err message: '%s'" % (str(response.status_code), str(output)))
-        
+
+    # Import a Server Configuration Profile in one job: inline when profile
+    # is given, otherwise the iDRAC fetches it from share_parameters. With
+    # ShutdownType NoReboot the job waits for the next boot, like a BIOS
+    # config job.
+    def import_system_configuration(self, profile=None, share_parameters=None, shutdown_type='NoReboot'):
+        import_url = self.root_url + SCP_ACTIONS % ('ImportSystemConfiguration')
+        payload = {
+            'ShareParameters': share_parameters or {'Target': 'ALL'},
+            'ShutdownType': shutdown_type,
+            'HostPowerState': 'On'
+        }
+        if profile is not None:
+            payload['ImportBuffer'] = profile
+        self.last_job_id = None
+        response = self.transport.request(
+            "POST",
+            import_url,
+            data=json.dumps(payload),
+            verify=False,
+            timeout=60.000
+        )
+        if response.status_code == requests.codes.accepted:
+            self.last_job_id = response.headers.get('Location', '').rstrip('/').split('/')[-1] or None
+            return ("# INFO -- Successfully created SCP import job with ID: %s" % (self.last_job_id))
+        return ("# ERROR -- SCP import failed with err code '%s' and err message: '%s'" % (response.status_code, response.text))
+
+    # Export the current profile of the host. The export runs as a job; once
+    # it is done, its task URI returns the profile itself.
+    @redfish_metrics.timed_operation('wait_for_export')
+    def export_system_configuration(self, export_format='XML', target='ALL', timeout=600):
+        export_url = self.root_url + SCP_ACTIONS % ('ExportSystemConfiguration')
+        payload = {'ExportFormat': export_format, 'ShareParameters': {'Target': target}}
+        response = self.transport.request(
+            "POST",
+            export_url,
+            data=json.dumps(payload),
+            verify=False,
+            timeout=60.000
+        )
+        if response.status_code != requests.codes.accepted or not response.headers.get('Location'):
+            raise RedfishError("# ERROR -- SCP export failed with err code '%s' and err message: '%s'" % (response.status_code, response.text))
+        task_url = self.iDRAC_https_url + response.headers['Location']
+        deadline = budget_deadline(timeout)
+        for interval in backoff_intervals(initial=2.0, maximum=10.0):
+            response = self.transport.request("GET", task_url, verify=False, timeout=30.000)
+            if response.status_code == requests.codes.ok and 'SystemConfiguration' in response.text[:512]:
+                return response.text
+            if response.status_code not in (requests.codes.ok, requests.codes.accepted):
+                raise RedfishError("# ERROR -- SCP export task returned err code '%s' and err message: '%s'" % (response.status_code, response.text))
+            if time.time() >= deadline:
+                break
+            time.sleep(clamp_interval(interval, deadline))
+        if budget_spent(deadline):
+            raise DeadlineExceeded("# ERROR -- SCP export still running when the time budget ran out")
+        raise RedfishError("# ERROR -- SCP export still running after %s seconds" % (timeout))
+
+    def get_job_status(self, job_id):
+        job_url = "%s/Managers/iDRAC.Embedded.1/Jobs/%s" % (self.root_url, job_id)
+        response = self.transport.request(
+            "GET",
+            job_url,
+            verify=False,
+            timeout=10.000
+        )
+        if response.status_code == requests.codes.ok:
+            return response.json()
+
+    # Poll the job until it reaches a terminal state. The outcome is kept in
+    # self.last_job_state so callers can tell success from failure.
+    @redfish_metrics.timed_operation('wait_for_job')
+    def wait_for_job(self, job_id, timeout=1800):
+        deadline = budget_deadline(timeout)
+        self.last_job_state = None
+        for interval in backoff_intervals(initial=2.0, maximum=15.0):
+            mark = event_mark(self.events)
+            job = self.get_job_status(job_id) or {}
+            self.last_job_state = job.get('JobState')
+            if self.last_job_state in JOB_DONE_STATES:
+                return ("# INFO -- Job %s %s: %s" % (job_id, self.last_job_state, job.get('Message')))
+            if self.last_job_state in JOB_FAILED_STATES:
+                return ("# ERROR -- Job %s %s: %s" % (job_id, self.last_job_state, job.get('Message')))
+            if time.time() >= deadline:
+                break
+            event_pause(self.events, 'job', mark, clamp_interval(interval, deadline), deadline)
+        if budget_spent(deadline):
+            raise DeadlineExceeded("# ERROR -- Job %s still '%s' when the time budget ran out" % (job_id, self.last_job_state))
+        return ("# ERROR -- Job %s still '%s' after %s seconds" % (job_id, self.last_job_state, timeout))
+
+    # Confirm a power transition by polling PowerState instead of sleeping
+    @redfish_metrics.timed_operation('wait_for_power_state')
+    def wait_for_power_state(self, power_state, timeout=300):
+        deadline = budget_deadline(timeout)
+        for interval in backoff_intervals(initial=1.0, maximum=5.0):
+            mark = event_mark(self.events)
+            current_power_state = self.get_power_state()
+            if current_power_state == power_state:
+                return ("# INFO -- Server is now '%s'" % (power_state))
+            if time.time() >= deadline:
+                break
+            event_pause(self.events, 'power', mark, clamp_interval(interval, deadline), deadline)
+        if budget_spent(deadline):
+            raise DeadlineExceeded("# ERROR -- Server still '%s' when the time budget ran out, expected '%s'" % (current_power_state, power_state))
+        return ("# ERROR -- Server still '%s' after %s seconds, expected '%s'" % (current_power_state, timeout, power_state))
+
+# Local provisioning state. Each host gets BIOS attribute snapshots, the
+# config jobs created for it, and a timestamp and result per stage. All of
+# it is keyed by a hash of the config being applied, so a re-run (or a
+# crashed fleet run) skips the hosts and stages that already completed
+# with the same config. Without --state-db the store lives in memory.
+class StateStore:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS hosts (
+            host TEXT PRIMARY KEY,
+            asset TEXT,
+            config_hash TEXT,
+            status TEXT,
+            updated_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS stages (
+            host TEXT,
+            stage TEXT,
+            config_hash TEXT,
+            started_at REAL,
+            finished_at REAL,
+            result TEXT,
+            changed INTEGER,
+            message TEXT,
+            record TEXT,
+            PRIMARY KEY (host, stage, config_hash)
+        );
+        CREATE TABLE IF NOT EXISTS jobs (
+            host TEXT,
+            job_id TEXT,
+            stage TEXT,
+            config_hash TEXT,
+            created_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS inventory (
+            host TEXT PRIMARY KEY,
+            collected_at REAL,
+            power_state TEXT,
+            model TEXT,
+            service_tag TEXT,
+            bios_version TEXT,
+            system_etag TEXT,
+            bios_etag TEXT,
+            snapshot_at REAL
+        );
+    """
+
+    # snapshot_at is the taken_at of the host's snapshot in the attribute
+    # store holding the attributes that were collected
+    INVENTORY_COLUMNS = ('power_state', 'model', 'service_tag', 'bios_version', 'system_etag', 'bios_etag', 'snapshot_at')
+
+    def __init__(self, path=None):
+        self.conn = sqlite3.connect(path or ':memory:', check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.executescript(self.SCHEMA)
+            self.conn.executescript(INDEX_SCHEMA)
+        # BIOS snapshots are stored deduplicated, see bios_attribute_store.py
+        self.attribute_store = AttributeStore(self.execute)
+        self.migrate_stages()
+        self.migrate_snapshots()
+        self.migrate_inventory()
+        self.index_inventory()
+
+    def execute(self, sql, params=()):
+        with self.lock, self.conn:
+            return self.conn.execute(sql, params).fetchall()
+
+    def host_done(self, host, config_hash):
+        rows = self.execute("SELECT status FROM hosts WHERE host = ? AND config_hash = ?", (host, config_hash))
+        return bool(rows) and rows[0][0] == 'done'
+
+    def finish_host(self, host, asset, config_hash, status):
+        self.execute("INSERT OR REPLACE INTO hosts VALUES (?, ?, ?, ?, ?)", (host, asset, config_hash, status, time.time()))
+
+    # Returns the record of a stage that already completed, else None: at
+    # least {'changed': bool}, plus whatever else the stage put in it
+    def stage_result(self, host, stage, config_hash):
+        rows = self.execute("SELECT changed, record FROM stages WHERE host = ? AND stage = ? AND config_hash = ? AND result = 'ok'",
+                            (host, stage, config_hash))
+        if rows:
+            record = json.loads(rows[0][1]) if rows[0][1] else {}
+            record['changed'] = bool(rows[0][0])
+            return record
+
+    # Record a stage around the block. The block can set record['changed']
+    # and anything a resumed run needs, like the boot mode it staged; any
+    # exception, sys.exit() included, is recorded as a failed stage.
+    @contextlib.contextmanager
+    def stage(self, host, stage, config_hash):
+        record = {'changed': True}
+        started_at = time.time()
+        try:
+            yield record
+        except BaseException as e:
+            self.finish_stage(host, stage, config_hash, started_at, 'failed', record, "%s: %s" % (type(e).__name__, e))
+            raise
+        self.finish_stage(host, stage, config_hash, started_at, 'ok', record, None)
+
+    def finish_stage(self, host, stage, config_hash, started_at, result, record, message):
+        self.execute("INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     (host, stage, config_hash, started_at, time.time(), result, int(bool(record['changed'])), message,
+                      json.dumps(record, sort_keys=True)))
+
+    # Earlier versions kept only whether a stage changed anything
+    def migrate_stages(self):
+        columns = [row[1] for row in self.execute("PRAGMA table_info(stages)")]
+        if 'record' not in columns:
+            self.execute("ALTER TABLE stages ADD COLUMN record TEXT")
+
+    def record_job(self, host, job_id, stage, config_hash):
+        if job_id:
+            self.execute("INSERT INTO jobs VALUES (?, ?, ?, ?, ?)", (host, job_id, stage, config_hash, time.time()))
+
+    def last_job(self, host, stage, config_hash):
+        rows = self.execute("SELECT job_id FROM jobs WHERE host = ? AND stage = ? AND config_hash = ? ORDER BY created_at DESC LIMIT 1",
+                            (host, stage, config_hash))
+        if rows:
+            return rows[0][0]
+
+    def save_snapshot(self, host, attributes):
+        return self.attribute_store.save(host, attributes)
+
+    # Earlier versions stored every snapshot as a full JSON document
+    def migrate_snapshots(self):
+        if not self.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'bios_snapshots'"):
+            return
+        for host, taken_at, attributes in self.execute("SELECT host, taken_at, attributes FROM bios_snapshots ORDER BY taken_at"):
+            self.attribute_store.save(host, json.loads(attributes), taken_at)
+        self.execute("DROP TABLE bios_snapshots")
+
+    # What the last --collect found on a host, ETags included, or None. The
+    # attributes are read from the snapshot the entry references.
+    def inventory_entry(self, host):
+        rows = self.execute("SELECT %s FROM inventory WHERE host = ?" % (', '.join(self.INVENTORY_COLUMNS)), (host,))
+        if rows:
+            entry = dict(zip(self.INVENTORY_COLUMNS, rows[0]))
+            entry['attributes'] = self.attribute_store.snapshot(host, entry['snapshot_at']) if entry['snapshot_at'] is not None else None
+            return entry
+
+    # {host: entry} of every collected host, with the attributes read in one
+    # fleet view of the attribute store
+    def inventory_entries(self):
+        entries = dict((row[0], dict(zip(self.INVENTORY_COLUMNS, row[1:])))
+                       for row in self.execute("SELECT host, %s FROM inventory" % (', '.join(self.INVENTORY_COLUMNS))))
+        fleet = self.attribute_store.fleet(dict((host, entry['snapshot_at']) for host, entry in entries.items()))
+        for host, entry in entries.items():
+            entry['attributes'] = fleet.get(host)
+        return entries
+
+    # Along with the entry, the rows of the fleet_query.py index that changed
+    # since the previous entry of the host. The entry's attributes must
+    # already be saved as the snapshot at entry['snapshot_at'].
+    def save_inventory(self, host, entry, previous=None):
+        values = [entry.get(column) for column in self.INVENTORY_COLUMNS]
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO inventory VALUES (?, ?, %s)" % (', '.join('?' * len(self.INVENTORY_COLUMNS))),
+                              [host, time.time()] + values)
+            update_index(self.conn, host, index_attributes(previous), index_attributes(entry))
+
+    # Earlier versions stored the collected attributes again in the inventory
+    # table. Point each host at a snapshot holding them instead: its latest
+    # one if that matches, else a new one.
+    def migrate_inventory(self):
+        columns = [row[1] for row in self.execute("PRAGMA table_info(inventory)")]
+        if 'attributes' not in columns:
+            return
+        rows = self.execute("SELECT host, collected_at, %s, attributes FROM inventory" % (', '.join(self.INVENTORY_COLUMNS[:-1])))
+        latest = self.attribute_store.fleet()
+        entries = []
+        for row in rows:
+            host, attributes = row[0], json.loads(row[-1]) if row[-1] else None
+            snapshot_at = None
+            if attributes is not None:
+                if latest.get(host) == attributes:
+                    snapshot_at = self.execute("SELECT MAX(taken_at) FROM attribute_snapshots WHERE host = ?", (host,))[0][0]
+                else:
+                    snapshot_at = self.attribute_store.save(host, attributes, row[1])
+            entries.append(list(row[:-1]) + [snapshot_at])
+        # One transaction; executescript() would commit a pending one first
+        with self.lock, self.conn:
+            self.conn.executescript("BEGIN; ALTER TABLE inventory RENAME TO inventory_old; %s" % (self.SCHEMA))
+            self.conn.executemany("INSERT INTO inventory VALUES (?, ?, %s)" % (', '.join('?' * len(self.INVENTORY_COLUMNS))), entries)
+            self.conn.execute("DROP TABLE inventory_old")
+
+    # Index hosts collected before the index existed
+    def index_inventory(self):
+        if self.execute("SELECT 1 FROM attribute_index LIMIT 1") or not self.execute("SELECT 1 FROM inventory LIMIT 1"):
+            return
+        entries = self.inventory_entries()
+        with self.lock, self.conn:
+            for host, entry in entries.items():
+                update_index(self.conn, host, {}, index_attributes(entry))
 
 ##===main program==
 
+# Read the fleet inventory. Blank lines and lines starting with '#' are
+# skipped, and a header row starting with 'ip' is ignored.
+def read_inventory(path):
+    if new_user_passwd:
+        default_new_username, default_new_password = new_user_passwd.split(',')
+    else:
+        default_new_username, default_new_password = None, None
+
+    hosts = []
+    with open(path) as f:
+        for row in csv.reader(f):
+            row = [c.strip() for c in row]
+            if not row or not row[0] or row[0].startswith('#') or row[0].lower() == 'ip':
+                continue
+            row = row + [''] * (6 - len(row))
+            host = {
+                'ip': row[0],
+                'asset': row[1],
+                'username': row[2] or iDRAC_account,
+                'password': row[3] or iDRAC_password,
+                'new_username': row[4] or default_new_username,
+                'new_password': row[5] or default_new_password
+            }
+            # Collecting needs nothing but the login
+            missing = [k for k, v in host.items() if not v and not (collect_mode and k in ('asset', 'new_username', 'new_password'))]
+            if missing:
+                print ("# ERROR -- Inventory row for %s is missing: %s" % (row[0], ', '.join(missing)), file=sys.stderr)
+                sys.exit(1)
+            hosts.append(host)
+    return hosts
+
+# Hash of everything that decides what gets applied to a host. Completed
+# stages are only skipped on a re-run when this hash is unchanged.
+def provision_config_hash(ip, asset, new_username):
+    config = {
+        'bios': desired_bios_attr(asset) if reconcile_flag else {'BootMode': 'Bios'},
+        'reconcile': reconcile_flag,
+        'reboot': reboot_flag,
+        'new_username': new_username
+    }
+    if pxe_once:
+        config['pxe_once'] = True
+    if scp_mode:
+        config['scp'] = {
+            'bios': desired_bios_attr(asset),
+            'overrides': scp_overrides.get(ip),
+            'template': scp_template_hash
+        }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+
+# Desired BIOS attributes for reconcile mode: the JSON config file plus the
+# per-host asset tag
+def desired_bios_attr(asset):
+    data = {}
+    data['BootMode'] = 'Bios'
+    data.update(bios_config)
+    data['AssetTag'] = asset
+    return data
+
+# The provisioning flow below is written once, as coroutines over the
+# AsyncUtils API. The threads engine runs it over the blocking Utils through
+# AwaitableUtils: every method that is a coroutine on AsyncUtils returns an
+# awaitable of the blocking call's result. Attributes read and set pass
+# straight through to the wrapped Utils.
+class AwaitableUtils:
+    def __init__(self, utils_obj):
+        object.__setattr__(self, 'utils_obj', utils_obj)
+
+    def __getattr__(self, name):
+        attr = getattr(self.utils_obj, name)
+        # Plain methods on AsyncUtils, like clean_bios_attr, stay plain
+        async_attr = getattr(AsyncUtils, name, None)
+        if not callable(attr) or (async_attr is not None and not asyncio.iscoroutinefunction(async_attr)):
+            return attr
+
+        async def call(*args, **kwargs):
+            return attr(*args, **kwargs)
+        return call
+
+    def __setattr__(self, name, value):
+        setattr(self.utils_obj, name, value)
+
+# Log the status message of a step, if given a log. Utils reports most
+# failures as an "# ERROR" message or no result at all rather than raising,
+# so turn those into RedfishError: the stage is then recorded as failed,
+# not completed.
+def checked(message, step, log=None):
+    if log is not None:
+        log (message)
+    if message is None:
+        raise RedfishError("# ERROR -- %s returned no result" % (step))
+    if message.startswith('# ERROR'):
+        raise RedfishError(message)
+    return message
+
+# A BIOS config job for the staged settings; no job aborts the host
+async def create_config_job(utils_obj, log=print):
+    message = await utils_obj.create_bios_config_job('/redfish/v1/Systems/System.Embedded.1/Bios/Settings')
+    log (message)
+    if not utils_obj.last_job_id:
+        raise RedfishError(message)
+
+# Stage the BIOS attribute changes and the boot sequence for the BootMode
+# the host will have once the pending job has run. Returns whether anything
+# was staged and whether the boot order had to be deferred.
+async def stage_changes(utils_obj, asset, log=print):
+    data = {}
+    data['BootMode'] = 'Bios'
+    if reconcile_flag:
+        data = utils_obj.clean_bios_attr(desired_bios_attr(asset))
+        delta = bios_delta(await utils_obj.get_bios_attr(), data)
+        if delta:
+            checked(await utils_obj.set_bios_attr(delta), 'Setting BIOS attributes', log)
+        else:
+            log ("# INFO -- BIOS attributes already match, nothing to set")
+        bios_changed = bool(delta)
+    else:
+        checked(await utils_obj.set_bios_attr(data), 'Setting BIOS attributes', log)
+        bios_changed = True
+
+    if utils_obj.bios_attr is None:
+        await utils_obj.get_bios_attr()
+    utils_obj.current_boot_mode = utils_obj.bios_attr['BootMode']
+    target_boot_mode = data.get('BootMode', utils_obj.current_boot_mode)
+    if pxe_once:
+        log ("# INFO -- Leaving the boot order alone, the host PXE boots through a one-time override")
+    else:
+        checked(await utils_obj.set_boot_order(reconcile=reconcile_flag, boot_mode=target_boot_mode), 'Setting the boot order', log)
+
+    return {
+        'changed': bios_changed or utils_obj.boot_order_changed,
+        'deferred': utils_obj.boot_order_deferred,
+        'boot_mode': target_boot_mode
+    }
+
+# ForceOff and wait until the iDRAC reports the box is really off before
+# powering it back on, instead of a fixed sleep. A step that fails aborts
+# the host, rather than powering on a box that never went off and waiting
+# for a job that will not start.
+async def power_cycle(utils_obj, log=print):
+    checked(await utils_obj.set_power_state('ForceOff'), 'ForceOff', log)
+    checked(await utils_obj.wait_for_power_state('Off'), 'Waiting for power off', log)
+    checked(await utils_obj.set_power_state('On'), 'Power on', log)
+
+# The override only applies to the next boot, so a single power action does:
+# power on a host that is off, otherwise restart it. A pending config job
+# runs during that same POST.
+async def pxe_boot(utils_obj, boot_mode, log=print):
+    checked(await utils_obj.set_pxe_boot_once(boot_mode), 'Setting the one-time PXE boot', log)
+    if await utils_obj.get_power_state() == 'Off':
+        checked(await utils_obj.set_power_state('On'), 'Power on', log)
+    else:
+        checked(await utils_obj.set_power_state('ForceRestart'), 'ForceRestart', log)
+
+# Wait for the last created config job; a failed or stuck job aborts the host
+async def wait_for_last_job(utils_obj, log=print):
+    if not getattr(utils_obj, 'last_job_id', None):
+        return
+    message = await utils_obj.wait_for_job(utils_obj.last_job_id)
+    log (message)
+    if utils_obj.last_job_state not in JOB_DONE_STATES:
+        raise RedfishError(message)
+
+# Render the host's profile: the JSON config file with its asset tag, the
+# boot order and the new iDRAC account, then the per-host overrides
+# boot_order is the device names of the boot sequence, None leaves it alone.
+def render_host_profile(bios, ip, new_username, new_password, boot_order=None):
+    bios = dict(bios)
+    if boot_order:
+        boot_seq = 'UefiBootSeq' if bios.get('BootMode') == 'Uefi' else 'BootSeq'
+        bios[boot_seq] = ','.join(boot_order)
+    components = {
+        BIOS_FQDD: bios,
+        IDRAC_FQDD: {'Users.2#UserName': new_username, 'Users.2#Password': new_password, 'Users.2#Enable': 'Enabled'}
+    }
+    return render_profile(merge_components(components, scp_overrides.get(ip)), template=scp_template)
+
+# Import the host's profile as one job, inline or through the share. With
+# --reboot the iDRAC restarts the host itself once the profile checks out;
+# for a one-time PXE boot the job waits for pxe_boot() instead.
+async def import_profile(utils_obj, ip, asset, new_username, new_password, log=print):
+    bios = utils_obj.clean_bios_attr(desired_bios_attr(asset))
+    boot_order = None
+    # The same order set_boot_order would set, from the devices this host
+    # has. A one-time PXE boot leaves the boot order alone.
+    if not pxe_once:
+        boot_mode = bios.get('BootMode') or (await utils_obj.get_bios_attr())['BootMode']
+        boot_seq = 'UefiBootSeq' if boot_mode == 'Uefi' else 'BootSeq'
+        entries = await utils_obj.get_boot_seq(boot_seq)
+        if entries:
+            boot_order = [e['Name'] for e in boot_sequence(entries)]
+        else:
+            log ("# WARN -- %s is not available until BootMode '%s' is applied, leaving the boot order out of the profile" % (boot_seq, boot_mode))
+    profile = render_host_profile(bios, ip, new_username, new_password, boot_order)
+    shutdown_type = 'Forced' if reboot_flag and not pxe_once else 'NoReboot'
+    if scp_share is None:
+        message = await utils_obj.import_system_configuration(profile=profile, shutdown_type=shutdown_type)
+    else:
+        name = scp_share.publish(profile)
+        message = await utils_obj.import_system_configuration(share_parameters=scp_share.share_parameters(name), shutdown_type=shutdown_type)
+        if utils_obj.last_job_id is None:
+            scp_share.withdraw(name)
+    log (message)
+    if utils_obj.last_job_id is None:
+        raise RedfishError(message)
+
+async def export_profile(utils_obj, ip, log=print):
+    # The inventory may give full URLs
+    path = os.path.join(scp_export_dir, "%s.xml" % (re.sub(r'[^A-Za-z0-9.-]+', '_', ip).strip('_')))
+    os.makedirs(scp_export_dir, exist_ok=True)
+    profile = await utils_obj.export_system_configuration()
+    with open(path, 'w') as f:
+        f.write(profile)
+    log ("# INFO -- Saved the current profile to %s" % (path))
+
+# Provision a single iDRAC through utils_obj, an AsyncUtils or an
+# AwaitableUtils. Status messages go through log() so that fleet mode can
+# collect them per host instead of interleaving them on stdout. Progress is
+# recorded per stage in the state store so that a re-run can pick up where
+# the last one stopped.
+async def provision_host_async(ip, asset, utils_obj, new_username, new_password, log=print):
+    config_hash = provision_config_hash(ip, asset, new_username)
+    if state_store.host_done(ip, config_hash):
+        log ("# INFO -- %s was already provisioned with this config, skipping" % (ip))
+        return
+
+    try:
+        await provision_host_stages(ip, asset, utils_obj, new_username, new_password, config_hash, log)
+    except BaseException:
+        state_store.finish_host(ip, asset, config_hash, 'failed')
+        raise
+    state_store.finish_host(ip, asset, config_hash, 'done')
+
+# Blocking provision_host_async() for the threads engine and single hosts.
+# Every Utils call blocks this thread, so the event loop only runs the flow.
+def provision_host(ip, asset, username, password, new_username, new_password, log=print):
+    utils_obj = AwaitableUtils(Utils(bmc_url(ip), username, password, pool_size=pool_size, session_cache=session_cache))
+    asyncio.run(provision_host_async(ip, asset, utils_obj, new_username, new_password, log))
+
+async def provision_host_stages(ip, asset, utils_obj, new_username, new_password, config_hash, log=print):
+    utils_obj.log = log
+    await utils_obj.auth_session()
+    # Out of time: still log out (or hand the session back to the cache)
+    # on a short budget of its own before giving up the host
+    try:
+        if sweep_sessions:
+            log (await utils_obj.sweep_sessions())
+        if use_registry:
+            log (await utils_obj.load_bios_registry(registry_cache))
+        if event_listener is not None:
+            utils_obj.events = event_listener.subscribe(utils_obj.transport, utils_obj.iDRAC_https_url, auth=(utils_obj.username, utils_obj.password))
+            if not utils_obj.events.subscribed:
+                log ("# WARN -- iDRAC refused the event subscription, polling instead")
+
+        # TODO: stuff here
+        checked(await utils_obj.get_power_state(), 'Reading the power state', log)
+
+        def completed(stage):
+            result = state_store.stage_result(ip, stage, config_hash)
+            if result is not None:
+                log ("# INFO -- Stage '%s' already completed, skipping" % (stage))
+            return result
+
+        # One SCP import job carries the BIOS attributes, the boot order, the
+        # iDRAC account and whatever else is in the template, RAID included
+        job_stage = 'scp' if scp_mode else 'stage'
+        if scp_mode:
+            if scp_export_dir and not completed('scp_export'):
+                with state_store.stage(ip, 'scp_export', config_hash):
+                    await export_profile(utils_obj, ip, log)
+            plan = completed('scp')
+            if not plan:
+                with state_store.stage(ip, 'scp', config_hash) as plan:
+                    await import_profile(utils_obj, ip, asset, new_username, new_password, log)
+                    state_store.record_job(ip, utils_obj.last_job_id, 'scp', config_hash)
+                    plan['boot_mode'] = desired_bios_attr(asset).get('BootMode')
+            # The iDRAC reboots the host itself
+            if reboot_flag and not pxe_once and not completed('scp_job'):
+                with state_store.stage(ip, 'scp_job', config_hash):
+                    utils_obj.last_job_id = state_store.last_job(ip, 'scp', config_hash)
+                    await wait_for_last_job(utils_obj, log)
+        else:
+            # Stage every pending change (BIOS attributes and boot sequence) first,
+            # so that one config job and a single reboot apply all of it
+            plan = completed('stage')
+            if not plan:
+                with state_store.stage(ip, 'stage', config_hash) as plan:
+                    plan.update(await stage_changes(utils_obj, asset, log))
+                    if plan['changed']:
+                        await create_config_job(utils_obj, log)
+                        state_store.record_job(ip, utils_obj.last_job_id, 'stage', config_hash)
+
+            # Account changes take effect right away and need no job
+            if not completed('credentials'):
+                with state_store.stage(ip, 'credentials', config_hash):
+                    # TODO: Implement dynamic way to set credentials rather than numeric ID
+                    checked(await utils_obj.set_idrac_credentials(new_username, new_password), 'Setting the iDRAC credentials', log)
+
+    #    success_flag = (utils_obj.reset_bios_dflt())
+    #    if success_flag == 'Success':
+    #        print (utils_obj.set_power_state('ForceOff'))
+    #
+    #        counter = 0
+    #        interval = 1
+    #        max_count = 600
+    #
+    #        while counter <= max_count:
+    #            time.sleep(interval)
+    #            srv_power_state = utils_obj.get_power_state()
+    #            print (srv_power_state)
+    #            if srv_power_state == 'Off':
+    #                break
+    #            counter = counter + interval
+    #            remainder = max_count - counter
+    #            s = str(remainder) + ' seconds remaining in POST'
+    #            print(s, end='')
+    #            print('\r', end='')
+    #
+    #    print (utils_obj.set_power_state('On'))
+
+        # One power action both runs the config job and PXE boots the host,
+        # and the boot order is never touched
+        if pxe_once and not completed('pxe_boot'):
+            with state_store.stage(ip, 'pxe_boot', config_hash):
+                utils_obj.last_job_id = state_store.last_job(ip, job_stage, config_hash) if plan['changed'] else None
+                # The plan of a resumed run comes from the state store, where
+                # stages recorded by older versions lack the boot mode
+                boot_mode = plan.get('boot_mode') or (await utils_obj.get_bios_attr())['BootMode']
+                await pxe_boot(utils_obj, boot_mode, log)
+                await wait_for_last_job(utils_obj, log)
+
+        # The config job only runs during POST, so there is nothing to wait for
+        # unless we reboot
+        if not scp_mode and not pxe_once and reboot_flag and plan['changed'] and not completed('reboot'):
+            with state_store.stage(ip, 'reboot', config_hash):
+                # After a resume the job was created by an earlier run
+                utils_obj.last_job_id = state_store.last_job(ip, 'stage', config_hash)
+                await power_cycle(utils_obj, log)
+                await wait_for_last_job(utils_obj, log)
+
+        # Only when the firmware could not stage the boot order together with the
+        # BootMode change does the host need a second pass. After a resume it is
+        # unknown, so check; reconcile makes this a no-op when nothing is left.
+        if not scp_mode and not pxe_once and plan.get('deferred', True) and not completed('boot_order'):
+            if reboot_flag:
+                with state_store.stage(ip, 'boot_order', config_hash):
+                    await utils_obj.get_bios_boot_mode()
+                    checked(await utils_obj.set_boot_order(reconcile=True), 'Setting the boot order', log)
+                    if utils_obj.boot_order_changed:
+                        await create_config_job(utils_obj, log)
+                        state_store.record_job(ip, utils_obj.last_job_id, 'boot_order', config_hash)
+                        await power_cycle(utils_obj, log)
+                        await wait_for_last_job(utils_obj, log)
+            elif plan.get('deferred'):
+                log ("# WARN -- Boot order will be set by a run with --reboot once the BootMode change is applied")
+
+        if utils_obj.bios_attr is not None:
+            state_store.save_snapshot(ip, utils_obj.bios_attr)
+
+        if utils_obj.events is not None:
+            utils_obj.events.unsubscribe()
+
+        # Logout of iDRAC, or keep the session for the next run
+        log (await utils_obj.end_session())
+    except DeadlineExceeded:
+        with budget(CLEANUP_BUDGET, replace=True):
+            if utils_obj.events is not None:
+                utils_obj.events.unsubscribe()
+            await utils_obj.end_session()
+        raise
+
+
+def new_fleet_record(host):
+    return {
+        'ip': host['ip'],
+        'asset': host['asset'],
+        'status': 'ok',
+        'error': None,
+        'messages': []
+    }
+
+# Run provision_host() for one inventory row and turn the outcome into a
+# structured result record. Utils still calls sys.exit() on hard failures,
+# so SystemExit is caught here as well to keep the rest of the fleet going.
+def provision_fleet_host(host):
+    record = new_fleet_record(host)
+    start = time.time()
+    try:
+        with budget(host_timeout):
+            provision_host(
+                host['ip'],
+                host['asset'],
+                host['username'],
+                host['password'],
+                host['new_username'],
+                host['new_password'],
+                log=lambda msg: record['messages'].append(msg)
+            )
+    except DeadlineExceeded as e:
+        record['status'] = 'timeout'
+        record['error'] = "no result within %s seconds: %s" % (host_timeout, e)
+    except SystemExit as e:
+        record['status'] = 'failed'
+        record['error'] = "exited with code %s" % (e.code)
+    except Exception as e:
+        record['status'] = 'failed'
+        record['error'] = "%s: %s" % (type(e).__name__, e)
+        record['traceback'] = traceback.format_exc()
+    record['elapsed'] = round(time.time() - start, 3)
+    return record
+
+# Collect one host into the state store: power state, model, service tag and
+# BIOS version from the system resource, and the BIOS attributes. Both GETs
+# carry the ETag of the last collection, so an unchanged host costs two 304s
+# instead of the whole attribute document. Basic auth saves the login and
+# logout round-trips of a session.
+def collect_host(host):
+    record = {'ip': host['ip'], 'status': 'ok', 'error': None, 'changed': False}
+    base_url = bmc_url(host['ip'])
+    start = time.time()
+    try:
+        with budget(host_timeout):
+            utils_obj = Utils(base_url, host['username'], host['password'], pool_size=pool_size)
+            auth = (host['username'], host['password'])
+            systems_url = "%s/Systems/System.Embedded.1" % (utils_obj.root_url)
+            entry = state_store.inventory_entry(host['ip']) or {}
+            previous = dict(entry)
+            if entry.get('attributes') is None:
+                entry['bios_etag'] = None
+
+            system_etag, system = utils_obj.get_if_changed(systems_url, entry.get('system_etag'), auth=auth)
+            if system is not None:
+                entry.update({
+                    'system_etag': system_etag,
+                    'power_state': system.get('PowerState'),
+                    'model': system.get('Model'),
+                    'service_tag': system.get('SKU'),
+                    'bios_version': system.get('BiosVersion')
+                })
+            bios_etag, bios = utils_obj.get_if_changed(systems_url + '/Bios', entry.get('bios_etag'), auth=auth)
+            if bios is not None:
+                record['changed'] = bios['Attributes'] != entry.get('attributes')
+                entry.update({'bios_etag': bios_etag, 'attributes': bios['Attributes']})
+                if record['changed']:
+                    entry['snapshot_at'] = state_store.save_snapshot(host['ip'], entry['attributes'])
+
+            state_store.save_inventory(host['ip'], entry, previous)
+            for key in ('power_state', 'model', 'service_tag', 'bios_version'):
+                record[key] = entry.get(key)
+    except DeadlineExceeded as e:
+        record['status'] = 'timeout'
+        record['error'] = "no result within %s seconds: %s" % (host_timeout, e)
+    except (RedfishError, requests.RequestException) as e:
+        record['status'] = 'failed'
+        record['error'] = str(e)
+    except Exception as e:
+        record['status'] = 'failed'
+        record['error'] = "%s: %s" % (type(e).__name__, e)
+        record['traceback'] = traceback.format_exc()
+    finally:
+        record['requests'] = get_transport(base_url).stats()['requests']
+        close_transport(base_url)
+    record['elapsed'] = round(time.time() - start, 3)
+    return record
+
+async def provision_fleet_host_async(host, async_engine, host_slots):
+    record = new_fleet_record(host)
+    async with host_slots:
+        start = time.time()
+        try:
+            with budget(host_timeout):
+                await provision_host_async(
+                    host['ip'],
+                    host['asset'],
+                    AsyncUtils(bmc_url(host['ip']), host['username'], host['password'], async_engine, session_cache=session_cache),
+                    host['new_username'],
+                    host['new_password'],
+                    log=lambda msg: record['messages'].append(msg)
+                )
+        except DeadlineExceeded as e:
+            record['status'] = 'timeout'
+            record['error'] = "no result within %s seconds: %s" % (host_timeout, e)
+        except Exception as e:
+            record['status'] = 'failed'
+            record['error'] = "%s: %s" % (type(e).__name__, e)
+            record['traceback'] = traceback.format_exc()
+        record['elapsed'] = round(time.time() - start, 3)
+    return record
+
+async def run_fleet_async(hosts, emit):
+    async_engine = await AsyncEngine(per_host_limit=pool_size).start()
+    host_slots = asyncio.Semaphore(workers)
+    try:
+        tasks = [provision_fleet_host_async(host, async_engine, host_slots) for host in hosts]
+        for next_done in asyncio.as_completed(tasks):
+            emit(await next_done)
+    finally:
+        await async_engine.close()
+
+# Drive every host in the inventory from this one process with a bounded
+# worker pool, emitting one JSON record per host as soon as it finishes
+def run_fleet(hosts):
+    out = open(results_file, 'w') if results_file else sys.stdout
+    results = {'failed': 0}
+
+    def emit(record):
+        if record['status'] != 'ok':
+            results['failed'] += 1
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+
+    try:
+        if engine == 'asyncio':
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(run_fleet_async(hosts, emit))
+            finally:
+                loop.close()
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(provision_fleet_host, host) for host in hosts]
+                for future in concurrent.futures.as_completed(futures):
+                    emit(future.result())
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print ("# INFO -- Provisioned %s hosts, %s failed" % (len(hosts), results['failed']), file=sys.stderr)
+    return results['failed']
+
+def run_collect(hosts):
+    out = open(results_file, 'w') if results_file else sys.stdout
+    failed = changed = 0
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(collect_host, host) for host in hosts]
+            for future in concurrent.futures.as_completed(futures):
+                record = future.result()
+                failed += record['status'] != 'ok'
+                changed += record['changed']
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print ("# INFO -- Collected %s hosts, %s changed, %s failed" % (len(hosts), changed, failed), file=sys.stderr)
+    return failed
+
 def main():
     parse_args()
 
-    new_username, new_password = new_user_passwd.split(',')
-
     # Parse JSON config file for BIOS attributes
     #data = json.load(open(data_file))
     #data['ServerAssetTag'] = asset_tag
     #data['ServerName'] = "mgmt-" + asset_tag + ".intacct.com"
 
-    utils_obj = Utils(iDRAC_https_url, iDRAC_account, iDRAC_password)
-    utils_obj.auth_session()
-    
-    # TODO: stuff here
-    print (utils_obj.get_power_state())
+    global bios_config
+    global state_store
+    bios_config = json.load(open(data_file)) if reconcile_flag or scp_mode else {}
+    state_store = StateStore(state_db)
 
-    # Set BIOS boot mode from default UEFI
-    data = {}
-    data['BootMode'] = 'Bios'
-    print (utils_obj.set_bios_attr(data))
-    print (utils_obj.create_bios_config_job('/redfish/v1/Systems/System.Embedded.1/Bios/Settings'))
-    if reboot_flag:
-        print (utils_obj.set_power_state('ForceOff'))
-        time.sleep(15)
-        print (utils_obj.set_power_state('On'))
-
-    time.sleep(300)
-
-    utils_obj.get_bios_boot_mode()
-    print (utils_obj.set_boot_order())
-    print (utils_obj.create_bios_config_job('/redfish/v1/Systems/System.Embedded.1/Bios/Settings'))
-    # TODO: Implement dynamic way to set credentials rather than numeric ID
-    print (utils_obj.set_idrac_credentials(new_username, new_password))
-
-#    success_flag = (utils_obj.reset_bios_dflt())
-#    if success_flag == 'Success':
-#        print (utils_obj.set_power_state('ForceOff'))
-#        
-#        counter = 0
-#        interval = 1
-#        max_count = 600
-#
-#        while counter <= max_count:
-#            time.sleep(interval)
-#            srv_power_state = utils_obj.get_power_state()
-#            print (srv_power_state)
-#            if srv_power_state == 'Off':
-#                break
-#            counter = counter + interval
-#            remainder = max_count - counter
-#            s = str(remainder) + ' seconds remaining in POST'
-#            print(s, end='')
-#            print('\r', end='')
-#
-#    print (utils_obj.set_power_state('On'))
+    if collect_mode:
+        hosts = read_inventory(inventory_file) if inventory_file else [{'ip': iDRAC_ip, 'username': iDRAC_account, 'password': iDRAC_password}]
+        sys.exit(1 if run_collect(hosts) else 0)
+
+    global scp_template
+    global scp_template_hash
+    global scp_overrides
+    global scp_share
+    scp_template = None
+    scp_template_hash = None
+    scp_overrides = {}
+    scp_share = None
+    if scp_template_file:
+        scp_template = load_template(scp_template_file)
+        with open(scp_template_file, 'rb') as f:
+            scp_template_hash = hashlib.sha256(f.read()).hexdigest()
+    if scp_overrides_file:
+        scp_overrides = json.load(open(scp_overrides_file))
+    if scp_share_address:
+        scp_share = ScpShare(scp_share_address, port=scp_share_port).start()
 
-    if reboot_flag:
-        print (utils_obj.set_power_state('ForceOff'))
-        time.sleep(15)
-        print (utils_obj.set_power_state('On'))
+    # Log out sessions that earlier, crashed runs left in the cache
+    global session_cache
+    session_cache = None
+    if session_cache_file:
+        session_cache = SessionCache(session_cache_file)
+        swept = session_cache.sweep()
+        if swept:
+            print ("# INFO -- Logged out %s stale cached sessions" % (swept), file=sys.stderr)
 
-    # Logout of iDRAC
-    print (utils_obj.del_curr_session())
+    # Receive Redfish events for the threads engine; closed (and every
+    # leftover subscription deleted) at exit
+    global event_listener
+    event_listener = None
+    if event_address and engine == 'threads':
+        event_listener = EventListener(event_address, event_cert, event_key, port=event_port).start()
+
+    if inventory_file:
+        failed = run_fleet(read_inventory(inventory_file))
+        sys.exit(1 if failed else 0)
+
+    new_username, new_password = new_user_passwd.split(',')
+    try:
+        with budget(host_timeout):
+            provision_host(iDRAC_ip, asset_tag, iDRAC_account, iDRAC_password, new_username, new_password)
+    except DeadlineExceeded as e:
+        print ("# ERROR -- No result within %s seconds: %s" % (host_timeout, e))
+        sys.exit(1)
+    except (RedfishError, BiosAttributeError) as e:
+        print (e)
+        sys.exit(1)
+
+    # Confirm the keep-alive pool actually got reused
+    for host, stats in transport_stats().items():
+        print ("# INFO -- %s: %s requests over %s connections (%s reused)" % (host, stats['requests'], stats['connections'], stats['reused']))
 
     sys.exit(0)
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+#
+# Query the BIOS attributes collected from the fleet
+#
+# dell_set_bios_attr.py --collect keeps an inverted index in its state file:
+# one row per (attribute, value, host), updated with only the rows that
+# changed whenever a host is collected. Besides the BIOS attributes, the
+# index has PowerState, Model, ServiceTag and BiosVersion of each host.
+#
+# A query is answered from the posting sets of the attributes it names
+# alone, which are read on first use, instead of scanning every host's
+# attributes:
+#
+#   ./fleet_query.py -s fleet.db 'LogicalProc=Enabled and BiosVersion<1.3.7'
+#   ./fleet_query.py -s fleet.db --drift dell_config.json --attribute SysProfile
+#   ./fleet_query.py -s fleet.db --values SysProfile
+#
+# Clauses are <attribute><op><value> with = != < <= > >=, combined with
+# and, or, not and parentheses. Values compare as versions, so 1.10.0 sorts
+# after 1.9.2. FleetIndex is usable on its own too, in memory, kept current
+# with update() and remove().
+#
+import re
+import sys
+import json
+import time
+import sqlite3
+import argparse
+
+INDEX_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS attribute_index (
+        attribute TEXT,
+        value TEXT,
+        host TEXT,
+        PRIMARY KEY (attribute, value, host)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS attribute_index_host ON attribute_index (host);
+"""
+
+# Fields of a collected inventory entry indexed next to the BIOS attributes
+SYSTEM_FIELDS = {
+    'PowerState': 'power_state',
+    'Model': 'model',
+    'ServiceTag': 'service_tag',
+    'BiosVersion': 'bios_version'
+}
+
+OPERATORS = ('=', '!=', '<', '<=', '>', '>=')
+
+class QueryError(ValueError):
+    pass
+
+# Values are indexed as text; the iDRAC reports some numeric attributes as
+# integers and dell_config.json may have them as strings, as in bios_delta()
+def value_text(value):
+    return value if isinstance(value, str) else json.dumps(value)
+
+# Natural sort key, so versions and numbers compare by their numeric parts
+def version_key(value):
+    return tuple((0, int(part)) if part.isdigit() else (1, part.lower()) for part in re.split(r'(\d+)', value) if part)
+
+def compare(value, op, target):
+    if op == '=':
+        return value == target
+    if op == '!=':
+        return value != target
+    value, target = version_key(value), version_key(target)
+    if op == '<':
+        return value < target
+    if op == '<=':
+        return value <= target
+    if op == '>':
+        return value > target
+    return value >= target
+
+# Everything indexed for one collected inventory entry
+def index_attributes(entry):
+    if not entry:
+        return {}
+    attributes = dict((k, value_text(v)) for k, v in (entry.get('attributes') or {}).items())
+    for name, field in SYSTEM_FIELDS.items():
+        if entry.get(field) is not None:
+            attributes[name] = value_text(entry[field])
+    return attributes
+
+# Rewrite the index rows of a host that changed between two collections, on
+# a sqlite3 connection inside the caller's transaction
+def update_index(conn, host, old, new):
+    removed = [(k, v, host) for k, v in old.items() if new.get(k) != v]
+    added = [(k, v, host) for k, v in new.items() if old.get(k) != v]
+    conn.executemany("DELETE FROM attribute_index WHERE attribute = ? AND value = ? AND host = ?", removed)
+    conn.executemany("INSERT OR IGNORE INTO attribute_index VALUES (?, ?, ?)", added)
+    return len(removed) + len(added)
+
+class FleetIndex:
+    # With a sqlite3 connection, posting sets are read from its
+    # attribute_index table as queries need them
+    def __init__(self, conn=None):
+        self.conn = conn
+        self.postings = {}
+        self.hosts = {}
+        self.loaded = conn is None
+
+    @classmethod
+    def open(cls, path):
+        return cls(sqlite3.connect("file:%s?mode=ro" % (path), uri=True))
+
+    def load_attribute(self, attribute):
+        postings = self.postings.get(attribute)
+        if postings is None:
+            postings = self.postings[attribute] = {}
+            if self.conn is not None:
+                for value, host in self.conn.execute("SELECT value, host FROM attribute_index WHERE attribute = ?", (attribute,)):
+                    postings.setdefault(sys.intern(value), set()).add(host)
+        return postings
+
+    # Every host and attribute, needed before incremental updates in memory
+    def load_all(self):
+        if self.loaded:
+            return
+        self.postings = {}
+        self.hosts = {}
+        for attribute, value, host in self.conn.execute("SELECT attribute, value, host FROM attribute_index"):
+            attribute, value = sys.intern(attribute), sys.intern(value)
+            self.postings.setdefault(attribute, {}).setdefault(value, set()).add(host)
+            self.hosts.setdefault(host, {})[attribute] = value
+        self.loaded = True
+
+    def all_hosts(self):
+        if not self.loaded and not self.hosts:
+            for (host,) in self.conn.execute("SELECT DISTINCT host FROM attribute_index"):
+                self.hosts[host] = None
+        return set(self.hosts)
+
+    # Move the host between posting sets for the attributes that changed
+    def update(self, host, attributes):
+        self.load_all()
+        old = self.hosts.get(host) or {}
+        new = dict((sys.intern(k), sys.intern(value_text(v))) for k, v in attributes.items())
+        for attribute, value in old.items():
+            if new.get(attribute) != value:
+                hosts = self.postings[attribute][value]
+                hosts.discard(host)
+                if not hosts:
+                    del self.postings[attribute][value]
+        for attribute, value in new.items():
+            if old.get(attribute) != value:
+                self.postings.setdefault(attribute, {}).setdefault(value, set()).add(host)
+        self.hosts[host] = new
+
+    def remove(self, host):
+        self.update(host, {})
+        del self.hosts[host]
+
+    # {value: host count} of one attribute
+    def values(self, attribute):
+        return dict((value, len(hosts)) for value, hosts in self.load_attribute(attribute).items())
+
+    def match(self, attribute, op, target):
+        if op not in OPERATORS:
+            raise QueryError("unknown operator '%s'" % (op))
+        postings = self.load_attribute(attribute)
+        if op == '=':
+            return set(postings.get(target, ()))
+        if op == '!=':
+            return self.all_hosts() - postings.get(target, set())
+        matched = set()
+        for value, hosts in postings.items():
+            if compare(value, op, target):
+                matched |= hosts
+        return matched
+
+    def query(self, expression):
+        return QueryParser(self, expression).parse()
+
+    # {attribute: hosts whose value differs from desired, or that lack it},
+    # among hosts (default: all)
+    def drift(self, desired, hosts=None):
+        hosts = self.all_hosts() if hosts is None else set(hosts)
+        drift = {}
+        for attribute, value in desired.items():
+            differ = hosts - self.load_attribute(attribute).get(value_text(value), set())
+            if differ:
+                drift[attribute] = differ
+        return drift
+
+TOKEN = re.compile(r'\s*(?:(\()|(\))|(!=|<=|>=|=|<|>)|"([^"]*)"|\'([^\']*)\'|([^\s()!=<>"\']+))')
+
+class QueryParser:
+    def __init__(self, index, expression):
+        self.index = index
+        self.tokens = []
+        position = 0
+        expression = expression.strip()
+        while position < len(expression):
+            match = TOKEN.match(expression, position)
+            if match is None or match.end() == position:
+                raise QueryError("cannot parse '%s'" % (expression[position:]))
+            position = match.end()
+            paren_open, paren_close, op, dquoted, squoted, word = match.groups()
+            if op is not None:
+                self.tokens.append(('op', op))
+            elif paren_open or paren_close:
+                self.tokens.append((paren_open or paren_close, None))
+            elif word is not None and word.lower() in ('and', 'or', 'not'):
+                self.tokens.append((word.lower(), None))
+            else:
+                self.tokens.append(('word', word if word is not None else (dquoted if dquoted is not None else squoted)))
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def take(self, kind):
+        if self.peek() != kind:
+            found = self.tokens[self.position][1] or self.peek() if self.position < len(self.tokens) else 'end of query'
+            raise QueryError("expected %s, found '%s'" % (kind, found))
+        self.position += 1
+        return self.tokens[self.position - 1][1]
+
+    def parse(self):
+        hosts = self.parse_or()
+        if self.peek() is not None:
+            raise QueryError("unexpected '%s'" % (self.tokens[self.position][1] or self.peek()))
+        return hosts
+
+    def parse_or(self):
+        hosts = self.parse_and()
+        while self.peek() == 'or':
+            self.take('or')
+            hosts = hosts | self.parse_and()
+        return hosts
+
+    def parse_and(self):
+        hosts = self.parse_not()
+        while self.peek() == 'and':
+            self.take('and')
+            hosts = hosts & self.parse_not()
+        return hosts
+
+    def parse_not(self):
+        if self.peek() == 'not':
+            self.take('not')
+            return self.index.all_hosts() - self.parse_not()
+        if self.peek() == '(':
+            self.take('(')
+            hosts = self.parse_or()
+            self.take(')')
+            return hosts
+        attribute = self.take('word')
+        op = self.take('op')
+        return self.index.match(attribute, op, self.take('word'))
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Query the BIOS attributes collected with dell_set_bios_attr.py --collect',
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('query', nargs='?', help="e.g. 'LogicalProc=Enabled and BiosVersion<1.3.7'\n"
+                                                 'Without a query, all collected hosts')
+    parser.add_argument('-s', '--state-db', help='State file written by --collect', required=True)
+    parser.add_argument('--drift', help='Per attribute, the hosts whose value differs from this JSON config file', metavar='CONFIG')
+    parser.add_argument('--attribute', help='With --drift: only this attribute (repeatable)', action='append')
+    parser.add_argument('--values', help='Number of hosts per value of this attribute', metavar='ATTRIBUTE')
+    parser.add_argument('-c', '--count', help='Print host counts instead of host lists', action='store_true')
+    parser.add_argument('--json', help='Print the result as JSON', action='store_true')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    start = time.time()
+    index = FleetIndex.open(args.state_db)
+    try:
+        hosts = index.query(args.query) if args.query else index.all_hosts()
+    except QueryError as e:
+        print ("# ERROR -- %s" % (e), file=sys.stderr)
+        sys.exit(2)
+
+    if args.values:
+        values = index.values(args.values)
+        if args.query:
+            postings = index.load_attribute(args.values)
+            values = dict((value, len(postings[value] & hosts)) for value in values)
+        result = dict((value, count) for value, count in values.items() if count)
+        lines = ["%6s  %s" % (count, value) for value, count in sorted(result.items(), key=lambda e: (-e[1], e[0]))]
+    elif args.drift:
+        desired = json.load(open(args.drift))
+        if args.attribute:
+            desired = dict((k, v) for k, v in desired.items() if k in args.attribute)
+        drift = index.drift(desired, hosts)
+        if args.count:
+            result = dict((attribute, len(differ)) for attribute, differ in drift.items())
+        else:
+            result = dict((attribute, sorted(differ)) for attribute, differ in drift.items())
+        lines = []
+        for attribute in sorted(drift):
+            lines.append("%s: %s hosts differ from '%s'" % (attribute, len(drift[attribute]), value_text(desired[attribute])))
+            if not args.count:
+                lines.extend("    %s" % (host) for host in sorted(drift[attribute]))
+    else:
+        result = len(hosts) if args.count else sorted(hosts)
+        lines = [str(result)] if args.count else result
+
+    if args.json:
+        print (json.dumps(result, indent=2, sort_keys=True))
+    else:
+        for line in lines:
+            print (line)
+    print ("# INFO -- %s hosts matched in %.1f ms" % (len(hosts), (time.time() - start) * 1000), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
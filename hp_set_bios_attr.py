@@ -16,8 +16,14 @@ import sys
 import json
 import time
 import argparse
-from _redfishobject import RedfishObject
-from redfish.rest.v1 import ServerDownOrUnreachableError
+import warnings
+import redfish_metrics
+from ilo_client import IloClient, ServerDownOrUnreachableError
+from redfish_transport import backoff_intervals, bmc_url
+from redfish_session_cache import SessionCache, DEFAULT_CACHE_FILE as DEFAULT_SESSION_CACHE_FILE
+from ilo_resource_cache import DEFAULT_CACHE_DIR as DEFAULT_RESOURCE_CACHE_DIR
+
+warnings.filterwarnings("ignore")
 
 def parse_args():
 	global iLO_https_url
@@ -27,6 +33,8 @@ def parse_args():
 	global reboot_flag
 	global data_file
 	global default
+	global session_cache_file
+	global resource_cache
 
 	parser = argparse.ArgumentParser(
 		description='Set BIOS attributes for HPE Gen9 and Gen10 servers',
@@ -39,15 +47,41 @@ def parse_args():
 	parser.add_argument('-f', '--file', help='Path to JSON config file', required=True)
 	parser.add_argument('-r', '--reboot', help='Toggle to reboot', action='store_true')
 	parser.add_argument('-d', '--default', help='Reset BIOS to factory defaults', action='store_true')
+	parser.add_argument('--session-cache', help='Reuse iLO sessions across runs via this file; stale ones\n'
+						    'are logged out at startup (default: ~/.cache/redfish/sessions.json)',
+			    nargs='?', const=DEFAULT_SESSION_CACHE_FILE)
+	parser.add_argument('--no-resource-cache', help='Read the iLO resource directory on every run', action='store_true')
+	parser.add_argument('--resource-cache', help='Directory for cached iLO resource directories (default: ~/.cache/redfish/ilo_resources)')
+	parser.add_argument('--metrics', help='Write per-endpoint request timings as a JSON report to this file', metavar='FILE')
+	parser.add_argument('--metrics-prom', help='Write the same metrics in Prometheus text format to this file', metavar='FILE')
+	parser.add_argument('--trace', help='Write every Redfish request as one JSON line to this file', metavar='FILE')
 	args = vars(parser.parse_args())
 
-	iLO_https_url = 'https://' + args['ip'] 
+	# Before any transport is created, so connection timings are collected
+	if args['metrics'] or args['metrics_prom'] or args['trace']:
+		redfish_metrics.enable(args['metrics'], args['metrics_prom'], args['trace'])
+
+	iLO_https_url = bmc_url(args['ip'])
 	iLO_account = args['username']
 	iLO_password = args['password']
 	asset_tag = args['asset']
 	data_file = args['file']
 	reboot_flag = args['reboot']
 	default = args['default']
+	session_cache_file = args['session_cache']
+	resource_cache = None
+	if not args['no_resource_cache']:
+		resource_cache = args['resource_cache'] or DEFAULT_RESOURCE_CACHE_DIR
+
+# POST states in which it is safe to change settings
+POST_DONE_STATES = ("FinishedPost", "InPostDiscoveryComplete")
+
+# Target of the ComputerSystem.Reset action
+def get_reset_target(redfishobj, instance):
+	resp = redfishobj.redfish_get(instance['@odata.id'])
+	if resp.status != 200:
+		return None
+	return resp.dict["Actions"]["#ComputerSystem.Reset"]["target"]
 
 def get_post_state(redfishobj):
 	# Different POST states below:
@@ -60,12 +94,30 @@ def get_post_state(redfishobj):
 	instances = redfishobj.search_for_type("ComputerSystem.")
 
 	for instance in instances:
-		response = REDFISH_OBJ.redfish_get(instance["@odata.id"])
+		response = redfishobj.redfish_get(instance["@odata.id"])
 		#redfishobj.error_handler(response)
 		post_state = response.dict["Oem"]["Hpe"]["PostState"]
 
 	return post_state
 
+# Wait for the server to finish POST with one fetch per tick. Poll quickly
+# at first, then back off, since a full POST takes minutes.
+@redfish_metrics.timed_operation('wait_for_post')
+def wait_for_post(redfishobj, max_count=600):
+	start = time.time()
+	for interval in backoff_intervals(initial=1.0, maximum=10.0):
+		post_state = get_post_state(redfishobj)
+		if post_state in POST_DONE_STATES:
+			return post_state
+		remainder = int(max_count - (time.time() - start))
+		if remainder <= 0:
+			break
+		s = str(remainder) + ' seconds remaining in POST'
+		print(s, end='')
+		print('\r', end='')
+		time.sleep(min(interval, remainder))
+	return post_state
+
 def set_asset_tag(redfishobj, asset_tag):
 	print("\n---------\nSet Computer Asset Tag:\n")
 	instances = redfishobj.search_for_type("ComputerSystem.")
@@ -79,14 +131,14 @@ def set_bios_attr(redfishobj, bios_data, bios_password=None):
 	print("\n---------\nSetting BIOS attributes:\n")
 	instances = redfishobj.search_for_type("Bios.")
 	#print (instances)
-	if not len(instances) and redfishobj.typepath.defs.isgen9:
+	if not len(instances) and redfishobj.isgen9:
 		sys.stderr.write("\nNOTE: This example requires the Redfish schema "\
 				 "version TBD in the managed iLO. It will fail against iLOs"\
 				 " with the 2.50 firmware or earlier. \n")
 
 	for instance in instances:
 		if 'settings' in instance['@odata.id']:
-			if redfishobj.typepath.defs.isgen9:
+			if redfishobj.isgen9:
 				body = bios_data
 			else:
 				body = {"Attributes": bios_data}
@@ -98,7 +150,7 @@ def reboot_server(redfishobj, bios_password=None):
 	print("\n---------\nRebooting server\n")
 	instances = redfishobj.search_for_type("ComputerSystem.")
 
-	if redfishobj.typepath.defs.isgen9:
+	if redfishobj.isgen9:
 		for instance in instances:
 			body = dict()
 			body["Action"] = "Reset"
@@ -108,12 +160,11 @@ def reboot_server(redfishobj, bios_password=None):
 			redfishobj.error_handler(response)
 	else:
 		for instance in instances:
-			resp = redfishobj.redfish_get(instance['@odata.id'])
-			if resp.status==200:
+			path = get_reset_target(redfishobj, instance)
+			if path:
 				body = dict()
 				body["Action"] = "ComputerSystem.Reset"
 				body["ResetType"] = "ForceRestart"
-				path = resp.dict["Actions"]["#ComputerSystem.Reset"]["target"]
 			else:
 				sys.stderr.write("ERROR: Unable to find the path for reboot.")
 				raise
@@ -125,7 +176,7 @@ def power_on_server(redfishobj, bios_password=None):
     print("\n---------\nPowering on server\n")
     instances = redfishobj.search_for_type("ComputerSystem.")
 
-    if redfishobj.typepath.defs.isgen9:
+    if redfishobj.isgen9:
         for instance in instances:
             body = dict()
             body["Action"] = "Reset"
@@ -135,12 +186,11 @@ def power_on_server(redfishobj, bios_password=None):
             redfishobj.error_handler(response)
     else:
         for instance in instances:
-            resp = redfishobj.redfish_get(instance['@odata.id'])
-            if resp.status==200:
+            path = get_reset_target(redfishobj, instance)
+            if path:
                 body = dict()
                 body["Action"] = "ComputerSystem.Reset"
                 body["ResetType"] = "On"
-                path = resp.dict["Actions"]["#ComputerSystem.Reset"]["target"]
             else:
                 sys.stderr.write("ERROR: Unable to find the path for power on.")
                 raise
@@ -163,9 +213,17 @@ if __name__ == "__main__":
 
 	parse_args()
 
+	# Log out sessions that earlier, crashed runs left behind
+	session_cache = None
+	if session_cache_file:
+		session_cache = SessionCache(session_cache_file)
+		session_cache.sweep()
+
 	# Create a REDFISH object
+	# With a session cache, a still valid session from an earlier run is
+	# reused instead of logging in again
 	try:
-		REDFISH_OBJ = RedfishObject(iLO_https_url, iLO_account, iLO_password)
+		REDFISH_OBJ = IloClient(iLO_https_url, iLO_account, iLO_password, session_cache=session_cache, resource_cache=resource_cache)
 	except ServerDownOrUnreachableError as excp:
 		sys.stderr.write("ERROR: server not reachable or doesn't support RedFish.\n")
 		sys.exit()
@@ -189,26 +247,11 @@ if __name__ == "__main__":
 	# Configure BIOS settings only if server is powered off or done with POST
 	# This is to prevent setting changes midway during POST, when other changes
 	# could be going on
-	counter = 0
-	interval = 1
-	max_count = 600
 	# Wait 10 minutes for server to finish up POST
-	# Increment every second
 	# This could be due to resetting BIOS to factory defaults, which takes a 
 	# long time to complete
 	print("\n---------\n")
-	while counter <= max_count:
-		time.sleep(interval)
-		#print (get_post_state(REDFISH_OBJ))
-		if get_post_state(REDFISH_OBJ) == "FinishedPost" or \
-					get_post_state(REDFISH_OBJ) == "InPostDiscoveryComplete":
-			break
-		counter = counter + interval
-		remainder = max_count - counter
-		s = str(remainder) + ' seconds remaining in POST'
-		print(s, end='')
-		print('\r', end='')
-	else:
+	if wait_for_post(REDFISH_OBJ, max_count=600) not in POST_DONE_STATES:
 		print("\n---------\n")
 		print("WARNING!!")
 		print("Server timed out while POSTing")
@@ -220,4 +263,4 @@ if __name__ == "__main__":
 	if reboot_flag:
 		reboot_server(REDFISH_OBJ)
 
-	REDFISH_OBJ.redfish_client.logout()
+	REDFISH_OBJ.end_session()
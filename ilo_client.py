@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+#
+# Lightweight native iLO client
+#
+# Covers the small part of python-ilorest's RedfishObject example that
+# hp_set_bios_attr.py uses: search_for_type, GET/PATCH/POST (with the BIOS
+# password header), Gen9/Gen10 detection and logout. RedfishObject crawls
+# the whole iLO type tree and loads every message registry at login; this
+# client only logs in, and fetches the service root and the resource
+# directory the first time they are actually needed. Of the resource
+# directory only each instance's '@odata.id' and '@odata.type' are kept.
+#
+# With a resource cache directory, the resource directory is read once per
+# iLO model and firmware version and the service root is revalidated by its
+# ETag (see ilo_resource_cache.py), so repeat connections skip both.
+#
+# Requests go through the shared pooled transport, so every call to the
+# same iLO reuses one keep-alive connection.
+#
+import sys
+import json
+import hashlib
+import requests
+from redfish_transport import get_transport, DeadlineExceeded
+from redfish_session_cache import session_valid
+from ilo_resource_cache import resource_key, cached_resources, store_resources, cached_service_root, store_service_root
+
+class ServerDownOrUnreachableError(Exception):
+    pass
+
+# iLO 4 (Gen9) reports its OEM data under 'Hp', iLO 5 (Gen10) under 'Hpe'
+def detect_gen9(service_root):
+    oem = service_root.get('Oem', {})
+    if 'Hpe' in oem:
+        return False
+    managers = oem.get('Hp', {}).get('Manager', [{}])
+    return managers[0].get('ManagerType', 'iLO 4') == 'iLO 4'
+
+class IloResponse:
+    __slots__ = ('status', 'headers', 'text', '_dict')
+
+    def __init__(self, response):
+        self.status = response.status_code
+        self.headers = response.headers
+        self.text = response.text
+        self._dict = None
+
+    # Body parsed on first use, as RedfishObject responses expose it
+    @property
+    def dict(self):
+        if self._dict is None:
+            try:
+                self._dict = json.loads(self.text) if self.text else {}
+            except ValueError:
+                self._dict = {}
+        return self._dict
+
+class IloClient:
+    def __init__(self, iLO_https_url, iLO_account, iLO_password, session_cache=None, resource_cache=None, timeout=10.000):
+        self.iLO_https_url = iLO_https_url
+        self.username = iLO_account
+        self.password = iLO_password
+        self.root_url = "%s/redfish/v1" % (iLO_https_url)
+        self.transport = get_transport(iLO_https_url)
+        self.session_cache = session_cache
+        self.resource_cache = resource_cache
+        self.timeout = timeout
+        self.session_key = None
+        self.session_location = None
+        self._service_root = None
+        self._isgen9 = None
+        self._resources = None
+        self.session_slot = False
+        self.login()
+
+    def url(self, suburi):
+        if suburi.startswith('http'):
+            return suburi
+        return "%s%s" % (self.iLO_https_url, suburi)
+
+    def login(self):
+        # Hold one of the iLO's session slots (see redfish_transport) until
+        # logout() or end_session()
+        if not self.session_slot:
+            self.transport.acquire_session()
+            self.session_slot = True
+        try:
+            # Reuse a cached session from an earlier run if the iLO still
+            # accepts it, instead of taking another slot in its session table
+            if self.session_cache is not None:
+                entry = self.session_cache.get(self.iLO_https_url, self.username)
+                if entry is not None and session_valid(self.transport, entry):
+                    self.session_key = entry['token']
+                    self.session_location = entry['location']
+                    self.transport.set_header('X-Auth-Token', self.session_key)
+                    self.session_cache.touch(self.iLO_https_url, self.username)
+                    return
+
+            try:
+                response = self.transport.post(
+                    "%s/SessionService/Sessions/" % (self.root_url),
+                    data=json.dumps({"UserName": self.username, "Password": self.password}),
+                    timeout=60.000
+                )
+            except DeadlineExceeded:
+                raise
+            except requests.RequestException as excp:
+                raise ServerDownOrUnreachableError("%s: %s" % (self.iLO_https_url, excp))
+            if response.status_code not in (requests.codes.ok, requests.codes.created):
+                raise ServerDownOrUnreachableError("%s: login returned err code %s" % (self.iLO_https_url, response.status_code))
+
+            self.session_key = response.headers['X-Auth-Token']
+            self.session_location = self.url(response.headers['Location'])
+            self.transport.set_header('X-Auth-Token', self.session_key)
+            if self.session_cache is not None:
+                self.session_cache.put(self.iLO_https_url, self.username, self.session_key, self.session_location)
+        except BaseException:
+            self.free_session_slot()
+            raise
+
+    def free_session_slot(self):
+        if self.session_slot:
+            self.session_slot = False
+            self.transport.release_session()
+
+    def logout(self):
+        if self.session_location is None:
+            self.free_session_slot()
+            return
+        try:
+            self.transport.delete(self.session_location, timeout=self.timeout)
+        except requests.RequestException:
+            pass
+        self.transport.del_header('X-Auth-Token')
+        if self.session_cache is not None:
+            self.session_cache.remove(self.iLO_https_url, self.username)
+        self.session_key = None
+        self.session_location = None
+        self.free_session_slot()
+
+    # With a session cache, leave the session open for the next run instead
+    # of logging out
+    def end_session(self):
+        if self.session_cache is None:
+            return self.logout()
+        self.session_cache.touch(self.iLO_https_url, self.username, in_use=False)
+        self.transport.del_header('X-Auth-Token')
+        self.free_session_slot()
+
+    # With a resource cache, ask for the service root with the ETag seen last
+    # time; a 304 means the cached copy is still current
+    def service_root(self):
+        if self._service_root is not None:
+            return self._service_root
+        if self.resource_cache is None:
+            self._service_root = self.redfish_get("/redfish/v1/").dict
+            return self._service_root
+
+        cached = cached_service_root(self.iLO_https_url, self.resource_cache)
+        headers = None
+        if cached is not None and cached.get('etag'):
+            headers = {'If-None-Match': cached['etag']}
+        response = self.transport.get(self.url("/redfish/v1/"), headers=headers, timeout=self.timeout)
+        if response.status_code == requests.codes.not_modified:
+            self._service_root = cached['service_root']
+            return self._service_root
+
+        self._service_root = IloResponse(response).dict
+        if response.status_code == requests.codes.ok and response.headers.get('ETag'):
+            store_service_root(self.iLO_https_url, response.headers['ETag'], self._service_root, self.resource_cache)
+        return self._service_root
+
+    @property
+    def isgen9(self):
+        if self._isgen9 is None:
+            self._isgen9 = detect_gen9(self.service_root())
+        return self._isgen9
+
+    @property
+    def isgen10(self):
+        return not self.isgen9
+
+    # The resource directory lists every instance the iLO knows about. It is
+    # read once, on the first search_for_type call, or taken from the cache
+    # for this iLO's model and firmware version.
+    def resources(self):
+        if self._resources is not None:
+            return self._resources
+
+        key = None
+        if self.resource_cache is not None:
+            key = resource_key(self.service_root())
+            if key is not None:
+                entry = cached_resources(key[0], key[1], self.resource_cache)
+                if entry is not None:
+                    self._isgen9 = entry['isgen9']
+                    self._resources = entry['resources']
+                    return self._resources
+
+        response = self.redfish_get("/redfish/v1/ResourceDirectory/")
+        if response.status != requests.codes.ok:
+            sys.stderr.write("ERROR: Unable to read the iLO resource directory (err code %s)\n" % (response.status))
+            return []
+        body = response.dict
+        self._resources = [
+            {'@odata.id': item['@odata.id'], '@odata.type': item['@odata.type']}
+            for item in body.get('Instances', body.get('Items', []))
+            if '@odata.id' in item and '@odata.type' in item
+        ]
+        if key is not None:
+            store_resources(key[0], key[1], self.isgen9, self._resources, self.resource_cache)
+        return self._resources
+
+    def search_for_type(self, type_name):
+        type_name = type_name.lower()
+        return [item for item in self.resources() if type_name in item['@odata.type'].lower()]
+
+    def redfish_get(self, suburi):
+        return IloResponse(self.transport.get(self.url(suburi), timeout=self.timeout))
+
+    def redfish_patch(self, suburi, request_body, optionalpassword=None):
+        return IloResponse(self.transport.patch(
+            self.url(suburi),
+            data=json.dumps(request_body),
+            headers=self.password_header(optionalpassword),
+            timeout=self.timeout
+        ))
+
+    def redfish_post(self, suburi, request_body, optionalpassword=None):
+        return IloResponse(self.transport.post(
+            self.url(suburi),
+            data=json.dumps(request_body),
+            headers=self.password_header(optionalpassword),
+            timeout=self.timeout
+        ))
+
+    # Changing BIOS settings on a server with a BIOS password needs the
+    # upper-case SHA256 of that password in this header
+    def password_header(self, bios_password):
+        if not bios_password:
+            return None
+        return {'X-HPRESTFULAPI-AuthToken': hashlib.sha256(bios_password.encode()).hexdigest().upper()}
+
+    # Same output as RedfishObject.error_handler, minus the message registry
+    # lookup that would need every registry downloaded up front
+    def error_handler(self, response):
+        if response.status in (requests.codes.ok, requests.codes.created, requests.codes.accepted, requests.codes.no_content):
+            sys.stdout.write("\tiLO return code %s: Success\n" % (response.status))
+            return
+        try:
+            info = response.dict["error"]["@Message.ExtendedInfo"][0]
+        except (KeyError, IndexError, TypeError):
+            sys.stdout.write("\tiLO return code %s: No extended error information returned by iLO.\n" % (response.status))
+            return
+        sys.stdout.write("\tiLO return code %s: %s %s\n" % (response.status, info.get("MessageId"), info.get("Message", "")))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#
+# Cached iLO resource directory
+#
+# The resource directory maps every Redfish type on an iLO to its paths.
+# It only changes with the server model and iLO firmware version, so the
+# trimmed type->path map and the Gen9/Gen10 detection are saved on disk per
+# (model, firmware) and shared by every host running that combination.
+#
+# Each host's service root is cached too, together with its ETag. On the
+# next connection the service root is fetched with If-None-Match: a 304 means
+# the model and firmware are unchanged, so the cached map is used without
+# even re-reading the service root body.
+#
+import os
+import re
+import json
+import threading
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'redfish', 'ilo_resources')
+
+_resources = {}
+_resources_lock = threading.Lock()
+
+def safe_name(name):
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', name)
+
+def cache_path(model, firmware, cache_dir=None):
+    key = safe_name("%s-%s" % (model, firmware))
+    return os.path.join(cache_dir or DEFAULT_CACHE_DIR, key + '.json')
+
+def root_path(base_url, cache_dir=None):
+    key = safe_name(base_url.split('://', 1)[-1])
+    return os.path.join(cache_dir or DEFAULT_CACHE_DIR, 'roots', key + '.json')
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+# Failing to write the cache is not fatal
+def write_json(path, doc):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = "%s.%s.%s.tmp" % (path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'w') as f:
+            json.dump(doc, f)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        pass
+
+# (model, firmware) from a service root, or None if the iLO doesn't report
+# its firmware version and the resource map can't be keyed safely
+def resource_key(service_root):
+    oem = service_root.get('Oem', {})
+    manager = (oem.get('Hpe') or oem.get('Hp') or {}).get('Manager', [{}])[0]
+    firmware = manager.get('ManagerFirmwareVersion')
+    if not firmware:
+        return None
+    model = service_root.get('Product') or manager.get('ManagerType', 'iLO')
+    return (model, firmware)
+
+# Return {'isgen9': ..., 'resources': [...]} for (model, firmware) from
+# memory or disk, or None if the resource directory has to be read
+def cached_resources(model, firmware, cache_dir=None):
+    key = (model, firmware)
+    with _resources_lock:
+        entry = _resources.get(key)
+    if entry is not None:
+        return entry
+
+    entry = read_json(cache_path(model, firmware, cache_dir))
+    if entry is None:
+        return None
+    with _resources_lock:
+        _resources[key] = entry
+    return entry
+
+def store_resources(model, firmware, isgen9, resources, cache_dir=None):
+    entry = {'isgen9': isgen9, 'resources': resources}
+    write_json(cache_path(model, firmware, cache_dir), entry)
+    with _resources_lock:
+        _resources[(model, firmware)] = entry
+    return entry
+
+# The service root and ETag last seen on this iLO, or None
+def cached_service_root(base_url, cache_dir=None):
+    return read_json(root_path(base_url, cache_dir))
+
+def store_service_root(base_url, etag, service_root, cache_dir=None):
+    write_json(root_path(base_url, cache_dir), {'etag': etag, 'service_root': service_root})
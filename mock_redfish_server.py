@@ -0,0 +1,648 @@
+#!/usr/bin/env python3
+#
+# Mock Redfish server emulating Dell iDRACs and HPE iLOs
+#
+# A local stand-in for benchmarking and load-testing the provisioning
+# scripts without real hardware. It serves the endpoints the scripts use:
+#
+#   Dell: Sessions, Systems/System.Embedded.1 (+ Reset and the boot
+#         override), Bios, Bios/Settings, Bios/BiosRegistry,
+#         BootSources(/Settings), BootOptions, EthernetInterfaces,
+#         Managers/iDRAC.Embedded.1/Jobs and Accounts, and SCP import and
+#         export (BIOS and iDRAC account components)
+#   HPE:  SessionService/Sessions, ResourceDirectory, ComputerSystem with
+#         Oem.Hpe.PostState (+ Reset), Bios and Bios/settings
+#
+# Per-request latency, a rate of random 503 errors, the session limit, and
+# config job and POST durations are configurable. Staged BIOS settings are applied once the host has
+# rebooted and the job (Dell) or POST (HPE) has run, so the waiting logic of
+# the scripts is exercised too. Any credentials are accepted. Documents
+# carry an ETag, and a GET with a matching If-None-Match gets a 304.
+#
+# Many BMCs are simulated in one process, as virtual hosts either
+#   by port: one listener per BMC, https://127.0.0.1:<port>
+#   by path: one listener, https://127.0.0.1:<port>/bmc/<n>
+# State changes are computed when a request comes in, so idle BMCs cost
+# nothing but their dict. The inventory of the virtual hosts is written as
+# CSV (ip,asset) for --inventory of the fleet tools.
+#
+# Without --cert/--key it serves plain HTTP; pass the full http:// URLs from
+# the inventory to the scripts.
+#
+import re
+import ssl
+import sys
+import json
+import time
+import base64
+import hashlib
+import random
+import secrets
+import argparse
+import threading
+import urllib.request
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+DEFAULT_MAX_SESSIONS = 8
+
+DELL_BIOS = {
+    'BootMode': 'Uefi',
+    'SysProfile': 'PerfPerWattOptimizedDapc',
+    'ProcVirtualization': 'Enabled',
+    'LogicalProc': 'Enabled',
+    'MemTest': 'Enabled',
+    'SerialComm': 'OnNoConRedir',
+    'AssetTag': '',
+    'SystemServiceTag': ''
+}
+
+HPE_BIOS = {
+    'BootMode': 'Uefi',
+    'WorkloadProfile': 'GeneralPowerEfficientCompute',
+    'ProcHyperthreading': 'Enabled',
+    'PowerRegulator': 'DynamicPowerSavings',
+    'ServerAssetTag': '',
+    'ServerName': ''
+}
+
+class MockError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+def error_body(message):
+    return {'error': {'message': message, '@Message.ExtendedInfo': [{'MessageId': 'Base.1.0.GeneralError', 'Message': message}]}}
+
+class MockBmc:
+    vendor = None
+    sessions_url = None
+
+    def __init__(self, name, options):
+        self.name = name
+        self.options = options
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.next_id = 1
+        self.power = 'On'
+        self.boot_at = 0.0
+        self.bios = dict(self.BIOS)
+        self.pending = {}
+        self.expand_requested = False
+
+    def new_id(self):
+        self.next_id += 1
+        return self.next_id
+
+    def authorized(self, headers):
+        if headers.get('X-Auth-Token') in self.sessions:
+            return True
+        auth = headers.get('Authorization', '')
+        if not auth.startswith('Basic '):
+            return False
+        try:
+            return len(base64.b64decode(auth[6:]).split(b':', 1)) == 2
+        except ValueError:
+            return False
+
+    def login(self, body):
+        if len(self.sessions) >= self.options.max_sessions:
+            raise MockError(400, "The maximum number of user sessions is reached")
+        token = secrets.token_hex(16)
+        session_id = self.new_id()
+        location = "%s/%s" % (self.sessions_url, session_id)
+        self.sessions[token] = {'Id': str(session_id), 'UserName': (body or {}).get('UserName'), '@odata.id': location}
+        return 201, {'X-Auth-Token': token, 'Location': location}, self.sessions[token]
+
+    def session_request(self, method, path, headers):
+        for token, session in list(self.sessions.items()):
+            if session['@odata.id'].rstrip('/') == path.rstrip('/'):
+                if method == 'DELETE':
+                    del self.sessions[token]
+                    return 200, {}, {}
+                return 200, {}, session
+        raise MockError(404, "No such session")
+
+    def session_collection(self):
+        return 200, {}, {'Members': [{'@odata.id': s['@odata.id']} for s in self.sessions.values()]}
+
+    def reset(self, reset_type):
+        if reset_type == 'PushPowerButton':
+            reset_type = 'ForceOff' if self.power == 'On' else 'On'
+        if reset_type in ('ForceOff', 'GracefulShutdown'):
+            self.power = 'Off'
+        elif reset_type in ('On', 'ForceRestart', 'GracefulRestart'):
+            self.power = 'On'
+            self.boot_at = time.time()
+            self.booted()
+        else:
+            raise MockError(400, "Unsupported ResetType '%s'" % (reset_type))
+        return 204, {}, None
+
+    def booted(self):
+        pass
+
+    def tick(self):
+        pass
+
+    # Returns (status, headers, body); body is JSON encoded by the handler
+    def handle(self, method, path, headers, body):
+        path, _, query = path.partition('?')
+        path = path.rstrip('/')
+        with self.lock:
+            self.tick()
+            self.expand_requested = '$expand' in query
+            if path == '/redfish/v1':
+                return 200, {}, self.service_root()
+            if method == 'POST' and path == self.sessions_url:
+                return self.login(body)
+            if not self.authorized(headers):
+                raise MockError(401, "Unauthorized")
+            status, response_headers, response = self.route(method, path, headers, body)
+        # Every JSON document gets an ETag, and If-None-Match is honored
+        if method == 'GET' and status == 200 and isinstance(response, dict):
+            etag = '"%s"' % (hashlib.sha1(json.dumps(response, sort_keys=True).encode('utf-8')).hexdigest()[:16])
+            response_headers = dict(response_headers, ETag=etag)
+            if headers.get('If-None-Match') == etag:
+                return 304, response_headers, None
+        return status, response_headers, response
+
+class DellBmc(MockBmc):
+    vendor = 'Dell'
+    BIOS = DELL_BIOS
+    sessions_url = '/redfish/v1/Sessions'
+    system_url = '/redfish/v1/Systems/System.Embedded.1'
+    manager_url = '/redfish/v1/Managers/iDRAC.Embedded.1'
+
+    def __init__(self, name, options):
+        MockBmc.__init__(self, name, options)
+        # Unique per host, like the real thing, so per-host values show up in
+        # everything collected from the mock
+        self.service_tag = "MK%05d" % (int(name))
+        self.bios['SystemServiceTag'] = self.service_tag
+        self.jobs = {}
+        self.boot_seq = [
+            {'Name': 'NIC.Integrated.1-1-1', 'Index': 0, 'Enabled': True, 'Id': 'BIOS.Setup.1-1#BootSeq#NIC.Integrated.1-1-1'},
+            {'Name': 'HardDisk.List.1-1', 'Index': 1, 'Enabled': True, 'Id': 'BIOS.Setup.1-1#BootSeq#HardDisk.List.1-1'}
+        ]
+        self.pending_boot_seq = None
+        self.boot_override = {'BootSourceOverrideEnabled': 'Disabled', 'BootSourceOverrideTarget': 'None'}
+        self.last_boot_source = None
+        self.accounts = dict((str(i), {'Id': str(i), 'UserName': 'root' if i == 2 else '', 'Enabled': i == 2}) for i in range(1, 17))
+
+    def service_root(self):
+        return {
+            '@odata.id': '/redfish/v1',
+            'Vendor': 'Dell',
+            'Oem': {'Dell': {}},
+            'ProtocolFeaturesSupported': {'ExpandQuery': {'NoLinks': self.options.expand}}
+        }
+
+    # Scheduled jobs start when the host boots, which also uses up a one-time
+    # boot override
+    def booted(self):
+        if self.boot_override['BootSourceOverrideEnabled'] == 'Disabled':
+            self.last_boot_source = self.boot_seq[0]['Name']
+        else:
+            self.last_boot_source = self.boot_override['BootSourceOverrideTarget']
+            if self.last_boot_source == 'UefiTarget':
+                self.last_boot_source = self.boot_override.get('UefiTargetBootSourceOverride')
+        if self.boot_override['BootSourceOverrideEnabled'] == 'Once':
+            self.boot_override = {'BootSourceOverrideEnabled': 'Disabled', 'BootSourceOverrideTarget': 'None'}
+        for job in self.jobs.values():
+            if job['JobState'] == 'Scheduled':
+                job['JobState'] = 'Running'
+                job['started'] = self.boot_at
+
+    def tick(self):
+        for job in self.jobs.values():
+            if job['JobState'] == 'Running' and time.time() >= job['started'] + self.options.job_duration:
+                job['JobState'] = 'Completed'
+                job['Message'] = 'Job completed successfully.'
+                self.accounts.update(job.pop('accounts', {}))
+                self.bios.update(self.pending)
+                self.pending = {}
+                if self.pending_boot_seq is not None:
+                    self.boot_seq = self.pending_boot_seq
+                    self.pending_boot_seq = None
+
+    def registry(self):
+        attributes = []
+        for name, value in self.bios.items():
+            entry = {'AttributeName': name, 'ReadOnly': name == 'SystemServiceTag'}
+            entry['Type'] = 'Integer' if isinstance(value, int) else 'String'
+            attributes.append(entry)
+        return {'RegistryEntries': {'Attributes': attributes}}
+
+    def boot_options(self):
+        options = []
+        for i, name in enumerate(['HardDisk.List.1-1'] + ["NIC.Integrated.1-%s-1" % (port) for port in range(1, 5)]):
+            option = {'@odata.id': "%s/BootOptions/Boot%04X" % (self.system_url, i), 'Id': "Boot%04X" % (i)}
+            if name.startswith('NIC'):
+                port = name.split('-')[1]
+                option['DisplayName'] = "PXE Device %s: Integrated NIC 1 Port %s Partition 1" % (port, port)
+                option['UefiDevicePath'] = "PciRoot(0x0)/Pci(0x1C,0x%s)/Pci(0x0,0x0)/MAC(0000000000%02X,0x1)/IPv4(0.0.0.0)" % (port, int(port))
+            else:
+                option['DisplayName'] = 'Integrated RAID Controller 1: Disk 0'
+                option['UefiDevicePath'] = 'PciRoot(0x0)/Pci(0x2,0x0)/Pci(0x0,0x0)/Scsi(0x0,0x0)'
+            options.append(option)
+        return options
+
+    # Profile from an SCP import, inline or fetched from its HTTP share. BIOS
+    # attributes are staged as with Bios/Settings, the boot sequence as with
+    # BootSources/Settings, and iDRAC users are changed when the job is done.
+    def import_profile(self, body):
+        share = body.get('ShareParameters', {})
+        if body.get('ImportBuffer'):
+            profile = body['ImportBuffer']
+        elif share.get('IPAddress') and share.get('FileName'):
+            url = "http://%s:%s/%s/%s" % (share['IPAddress'], share.get('PortNumber', 80), share.get('ShareName', ''), share['FileName'])
+            try:
+                with urllib.request.urlopen(url, timeout=10) as response:
+                    profile = response.read().decode('utf-8')
+            except (OSError, ValueError) as e:
+                raise MockError(400, "Could not fetch %s: %s" % (url, e))
+        else:
+            raise MockError(400, "Neither ImportBuffer nor a share given")
+        try:
+            root = ET.fromstring(profile)
+        except ET.ParseError as e:
+            raise MockError(400, "Malformed profile: %s" % (e))
+
+        job_id = "JID_%s" % (self.new_id())
+        job = {'Id': job_id, 'JobState': 'Scheduled', 'Message': 'Task successfully scheduled.', 'started': None, 'accounts': {}}
+        unknown = []
+        for component in root.iter('Component'):
+            attributes = dict((a.get('Name'), a.text or '') for a in component.findall('Attribute'))
+            if component.get('FQDD') == 'BIOS.Setup.1-1':
+                for name, value in attributes.items():
+                    if name in ('BootSeq', 'UefiBootSeq'):
+                        self.pending_boot_seq = self.reorder_boot_seq(value.split(','))
+                    elif name not in self.bios:
+                        unknown.append(name)
+                    else:
+                        self.pending[name] = int(value) if isinstance(self.bios[name], int) else value
+            elif component.get('FQDD') == 'iDRAC.Embedded.1':
+                for name, value in attributes.items():
+                    user, _, key = name.partition('#')
+                    if user.startswith('Users.') and key in ('UserName', 'Enable'):
+                        account = job['accounts'].setdefault(user[6:], dict(self.accounts.get(user[6:], {})))
+                        if key == 'UserName':
+                            account['UserName'] = value
+                        else:
+                            account['Enabled'] = value == 'Enabled'
+        if unknown:
+            job['JobState'] = 'Failed'
+            job['Message'] = "Unknown attributes: %s" % (', '.join(unknown))
+        self.jobs[job_id] = job
+        if job['JobState'] == 'Scheduled' and body.get('ShutdownType', 'Graceful') != 'NoReboot':
+            self.reset('ForceRestart')
+        return 202, {'Location': "/redfish/v1/TaskService/Tasks/%s" % (job_id)}, {}
+
+    def reorder_boot_seq(self, names):
+        order = [e for name in names for e in self.boot_seq if e['Name'] == name]
+        order += [e for e in self.boot_seq if e not in order]
+        return [dict(e, Index=i) for i, e in enumerate(order)]
+
+    def export_profile(self):
+        root = ET.Element('SystemConfiguration', Model='PowerEdge R640', ServiceTag=self.bios.get('SystemServiceTag', ''))
+        bios = ET.SubElement(root, 'Component', FQDD='BIOS.Setup.1-1')
+        for name, value in sorted(self.bios.items()):
+            ET.SubElement(bios, 'Attribute', Name=name).text = str(value)
+        ET.SubElement(bios, 'Attribute', Name='BootSeq').text = ','.join(e['Name'] for e in self.boot_seq)
+        idrac = ET.SubElement(root, 'Component', FQDD='iDRAC.Embedded.1')
+        for i, account in sorted(self.accounts.items(), key=lambda e: int(e[0])):
+            ET.SubElement(idrac, 'Attribute', Name="Users.%s#UserName" % (i)).text = account['UserName']
+        job_id = "JID_%s" % (self.new_id())
+        self.jobs[job_id] = {'Id': job_id, 'JobState': 'Completed', 'Message': 'Successfully exported Server Configuration Profile', 'started': None,
+                             'profile': ET.tostring(root, encoding='unicode')}
+        return 202, {'Location': "/redfish/v1/TaskService/Tasks/%s" % (job_id)}, {}
+
+    def collection(self, url, members):
+        if self.options.expand and self.expand_requested:
+            return {'@odata.id': url, 'Members': members}
+        return {'@odata.id': url, 'Members': [{'@odata.id': m['@odata.id']} for m in members]}
+
+    def route(self, method, path, headers, body):
+        system = self.system_url
+        if path.startswith(self.sessions_url + '/') or path.startswith('/redfish/v1/SessionService/Sessions/'):
+            return self.session_request(method, path, headers)
+        if path in (self.sessions_url, '/redfish/v1/SessionService/Sessions'):
+            return self.session_collection()
+
+        if method == 'GET' and path == system:
+            return 200, {}, {'@odata.id': system, 'PowerState': self.power, 'Model': 'PowerEdge R640', 'BiosVersion': '2.1.8', 'SKU': self.service_tag,
+                             'Boot': self.boot_override, 'Oem': {'Mock': {'LastBootSource': self.last_boot_source}}}
+        if method == 'PATCH' and path == system:
+            boot = (body or {}).get('Boot', {})
+            if boot.get('BootSourceOverrideEnabled', 'Once') not in ('Disabled', 'Once', 'Continuous'):
+                raise MockError(400, "Unsupported BootSourceOverrideEnabled '%s'" % (boot['BootSourceOverrideEnabled']))
+            if boot.get('BootSourceOverrideTarget', 'None') not in ('None', 'Pxe', 'Hdd', 'Cd', 'BiosSetup', 'UefiTarget'):
+                raise MockError(400, "Unsupported BootSourceOverrideTarget '%s'" % (boot['BootSourceOverrideTarget']))
+            self.boot_override = dict(self.boot_override, **boot)
+            return 200, {}, {}
+        if method == 'GET' and path.startswith(system + '/BootOptions'):
+            for option in self.boot_options():
+                if path == option['@odata.id']:
+                    return 200, {}, option
+            return 200, {}, self.collection(system + '/BootOptions', self.boot_options())
+        if method == 'POST' and path == system + '/Actions/ComputerSystem.Reset':
+            return self.reset((body or {}).get('ResetType'))
+        if method == 'GET' and path == system + '/Bios':
+            return 200, {}, {'@odata.id': path, 'Attributes': self.bios}
+        if method == 'PATCH' and path == system + '/Bios/Settings':
+            unknown = [k for k in (body or {}).get('Attributes', {}) if k not in self.bios]
+            if unknown:
+                raise MockError(400, "Unknown attributes: %s" % (', '.join(unknown)))
+            self.pending.update(body['Attributes'])
+            return 200, {}, {}
+        if method == 'GET' and path == system + '/Bios/BiosRegistry':
+            return 200, {}, self.registry()
+        if method == 'POST' and path == system + '/Bios/Actions/Bios.ResetBios':
+            self.pending = dict(DELL_BIOS)
+            return 200, {}, {}
+        if method == 'GET' and path == system + '/BootSources':
+            return 200, {}, {'Attributes': {'BootSeq': self.boot_seq, 'UefiBootSeq': self.boot_seq}}
+        if method == 'PATCH' and path == system + '/BootSources/Settings':
+            attributes = (body or {}).get('Attributes', {})
+            self.pending_boot_seq = attributes.get('BootSeq') or attributes.get('UefiBootSeq')
+            return 200, {}, {}
+        if method == 'GET' and path.startswith(system + '/EthernetInterfaces'):
+            nics = [{'@odata.id': "%s/EthernetInterfaces/NIC.Integrated.1-%s-1" % (system, i), 'Id': "NIC.Integrated.1-%s-1" % (i), 'SpeedMbps': 1000 if i < 3 else 10000} for i in range(1, 5)]
+            for nic in nics:
+                if path == nic['@odata.id']:
+                    return 200, {}, nic
+            return 200, {}, self.collection(system + '/EthernetInterfaces', nics)
+
+        scp_url = self.manager_url + '/Actions/Oem/EID_674_Manager.'
+        if method == 'POST' and path == scp_url + 'ImportSystemConfiguration':
+            return self.import_profile(body or {})
+        if method == 'POST' and path == scp_url + 'ExportSystemConfiguration':
+            return self.export_profile()
+        if method == 'GET' and path.startswith('/redfish/v1/TaskService/Tasks/'):
+            job = self.jobs.get(path.split('/')[-1])
+            if job is None:
+                raise MockError(404, "No such task")
+            if 'profile' in job:
+                return 200, {}, job['profile']
+            return 202, {}, {'Id': job['Id'], 'TaskState': 'Running' if job['JobState'] in ('Scheduled', 'Running') else job['JobState']}
+
+        jobs_url = self.manager_url + '/Jobs'
+        if method == 'POST' and path == jobs_url:
+            job_id = "JID_%s" % (self.new_id())
+            self.jobs[job_id] = {'Id': job_id, 'JobState': 'Scheduled', 'Message': 'Task successfully scheduled.', 'started': None}
+            return 200, {'Location': "%s/%s" % (jobs_url, job_id)}, {}
+        if method == 'GET' and path.startswith(jobs_url + '/'):
+            job = self.jobs.get(path.split('/')[-1])
+            if job is None:
+                raise MockError(404, "No such job")
+            return 200, {}, dict((k, v) for k, v in job.items() if k not in ('started', 'accounts', 'profile'))
+
+        accounts_url = self.manager_url + '/Accounts'
+        if path.startswith(accounts_url + '/'):
+            account = self.accounts.get(path.split('/')[-1])
+            if account is None:
+                raise MockError(404, "No such account")
+            if method == 'PATCH':
+                account.update(body or {})
+                return 200, {}, {}
+            return 200, {}, dict(account, **{'@odata.id': path})
+        if method == 'GET' and path == accounts_url:
+            members = [dict(a, **{'@odata.id': "%s/%s" % (accounts_url, i)}) for i, a in sorted(self.accounts.items(), key=lambda e: int(e[0]))]
+            return 200, {}, self.collection(accounts_url, members)
+
+        raise MockError(404, "%s %s is not emulated" % (method, path))
+
+class HpeBmc(MockBmc):
+    vendor = 'HPE'
+    BIOS = HPE_BIOS
+    sessions_url = '/redfish/v1/SessionService/Sessions'
+    system_url = '/redfish/v1/Systems/1'
+
+    def __init__(self, name, options):
+        MockBmc.__init__(self, name, options)
+        self.asset_tag = ''
+
+    def service_root(self):
+        return {
+            '@odata.id': '/redfish/v1/',
+            'Vendor': 'HPE',
+            'Product': 'ProLiant DL360 Gen10',
+            'Oem': {'Hpe': {'Manager': [{'ManagerType': 'iLO 5', 'ManagerFirmwareVersion': '1.40'}]}}
+        }
+
+    def post_state(self):
+        if self.power == 'Off':
+            return 'PowerOff'
+        if time.time() < self.boot_at + self.options.post_duration:
+            return 'InPost'
+        return 'FinishedPost'
+
+    # Pending BIOS settings are applied during POST
+    def booted(self):
+        self.bios.update(self.pending)
+        self.pending = {}
+
+    def resource_directory(self):
+        instances = [
+            {'@odata.id': self.system_url + '/', '@odata.type': '#ComputerSystem.v1_4_0.ComputerSystem'},
+            {'@odata.id': self.system_url + '/Bios/', '@odata.type': '#Bios.v1_0_0.Bios'},
+            {'@odata.id': self.system_url + '/Bios/settings/', '@odata.type': '#Bios.v1_0_0.Bios'},
+            {'@odata.id': '/redfish/v1/Managers/1/', '@odata.type': '#Manager.v1_3_0.Manager'}
+        ]
+        return {'@odata.id': '/redfish/v1/ResourceDirectory/', 'Instances': instances}
+
+    def route(self, method, path, headers, body):
+        system = self.system_url
+        if path.startswith(self.sessions_url + '/'):
+            return self.session_request(method, path, headers)
+        if path == self.sessions_url:
+            return self.session_collection()
+        if method == 'GET' and path == '/redfish/v1/ResourceDirectory':
+            return 200, {}, self.resource_directory()
+        if path == system:
+            if method == 'PATCH':
+                self.asset_tag = (body or {}).get('AssetTag', self.asset_tag)
+                return 200, {}, {}
+            return 200, {}, {
+                '@odata.id': system + '/',
+                'PowerState': self.power,
+                'AssetTag': self.asset_tag,
+                'Oem': {'Hpe': {'PostState': self.post_state()}},
+                'Actions': {'#ComputerSystem.Reset': {'target': system + '/Actions/ComputerSystem.Reset/'}}
+            }
+        if method == 'POST' and path == system + '/Actions/ComputerSystem.Reset':
+            return self.reset((body or {}).get('ResetType'))
+        if method == 'GET' and path == system + '/Bios':
+            return 200, {}, {'@odata.id': system + '/Bios/', 'Attributes': self.bios}
+        if path == system + '/Bios/settings':
+            if method == 'PATCH':
+                self.pending.update((body or {}).get('Attributes', {}))
+                return 200, {}, {}
+            return 200, {}, {'@odata.id': system + '/Bios/settings/', 'Attributes': dict(self.bios, **self.pending)}
+        raise MockError(404, "%s %s is not emulated" % (method, path))
+
+BMC_TYPES = {
+    'dell': DellBmc,
+    'hpe': HpeBmc
+}
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        if self.server.options.verbose:
+            BaseHTTPRequestHandler.log_message(self, *args)
+
+    # Bodies are JSON, except exported profiles, which are sent as is
+    def reply(self, status, headers, body):
+        content_type = 'application/json'
+        if isinstance(body, str):
+            data = body.encode('utf-8')
+            content_type = 'application/xml'
+        else:
+            data = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Path virtual hosts are addressed as /bmc/<n>/redfish/v1/...; the BMC
+    # itself only ever sees the /redfish/v1/... part
+    def dispatch(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        options = self.server.options
+        if options.latency or options.jitter:
+            time.sleep(options.latency + random.uniform(0, options.jitter))
+        if options.error_rate and random.random() < options.error_rate:
+            return self.reply(503, {}, error_body("Service temporarily unavailable"))
+
+        path = self.path
+        bmc = self.server.bmc
+        m = re.match(r'^/bmc/(\d+)(/.*)$', path)
+        if m:
+            bmc = self.server.bmcs.get(m.group(1))
+            path = m.group(2)
+        if bmc is None:
+            return self.reply(404, {}, error_body("No such BMC"))
+        try:
+            body = json.loads(raw) if raw else None
+        except ValueError:
+            return self.reply(400, {}, error_body("Malformed JSON"))
+        try:
+            status, headers, response = bmc.handle(method, path, self.headers, body)
+        except MockError as e:
+            return self.reply(e.status, {}, error_body(str(e)))
+        self.reply(status, headers, response)
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PATCH(self):
+        self.dispatch('PATCH')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+class MockServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+# Start the virtual BMCs and return (servers, inventory), inventory being a
+# list of (address, asset) pairs. vendor is 'dell', 'hpe' or 'mixed'.
+def start_mock(options):
+    vendors = ['dell', 'hpe'] if options.vendor == 'mixed' else [options.vendor]
+    context = None
+    scheme = 'http'
+    if options.cert:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(options.cert, options.key)
+        scheme = 'https'
+
+    def new_server(port):
+        server = MockServer((options.bind, port), MockHandler)
+        server.options = options
+        server.bmc = None
+        server.bmcs = {}
+        if context is not None:
+            server.socket = context.wrap_socket(server.socket, server_side=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    servers = []
+    inventory = []
+    if options.vhost == 'path':
+        server = new_server(options.port)
+        servers.append(server)
+        for i in range(options.hosts):
+            server.bmcs[str(i)] = BMC_TYPES[vendors[i % len(vendors)]](str(i), options)
+            address = "%s://%s:%s/bmc/%s" % (scheme, options.address, server.server_address[1], i)
+            inventory.append((address, "MOCK%04d" % (i)))
+    else:
+        for i in range(options.hosts):
+            server = new_server(options.port + i if options.port else 0)
+            server.bmc = BMC_TYPES[vendors[i % len(vendors)]](str(i), options)
+            servers.append(server)
+            address = "%s://%s:%s" % (scheme, options.address, server.server_address[1])
+            inventory.append((address, "MOCK%04d" % (i)))
+    return servers, inventory
+
+def stop_mock(servers):
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Mock Redfish server emulating Dell iDRACs and HPE iLOs',
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('-n', '--hosts', help='Number of BMCs to simulate (default: 1)', type=int, default=1)
+    parser.add_argument('--vendor', help='dell, hpe or mixed (alternating) (default: dell)', choices=sorted(BMC_TYPES) + ['mixed'], default='dell')
+    parser.add_argument('--vhost', help='Virtual hosts by port (one listener per BMC, default) or by path\n'
+                                        '(one listener, /bmc/<n>)', choices=['port', 'path'], default='port')
+    parser.add_argument('--port', help='First port to listen on (default: any free port)', type=int, default=0)
+    parser.add_argument('--bind', help='Address to listen on (default: 127.0.0.1)', default='127.0.0.1')
+    parser.add_argument('--address', help='Address written to the inventory (default: 127.0.0.1)', default='127.0.0.1')
+    parser.add_argument('--latency', help='Seconds added to every request (default: 0)', type=float, default=0.0)
+    parser.add_argument('--jitter', help='Up to this many random seconds added on top (default: 0)', type=float, default=0.0)
+    parser.add_argument('--error-rate', help='Fraction of requests answered with 503 (default: 0)', type=float, default=0.0)
+    parser.add_argument('--max-sessions', help='Sessions per BMC before logins fail (default: 8)', type=int, default=DEFAULT_MAX_SESSIONS)
+    parser.add_argument('--job-duration', help='Seconds a Dell config job runs after the reboot (default: 5)', type=float, default=5.0)
+    parser.add_argument('--post-duration', help='Seconds an HPE server spends in POST (default: 5)', type=float, default=5.0)
+    parser.add_argument('--expand', help='Advertise and serve $expand on collections', action='store_true')
+    parser.add_argument('--cert', help='TLS certificate file; serve HTTPS instead of HTTP')
+    parser.add_argument('--key', help='TLS key file')
+    parser.add_argument('-o', '--inventory', help='Write the inventory CSV here instead of stdout')
+    parser.add_argument('-v', '--verbose', help='Log every request', action='store_true')
+    options = parser.parse_args(argv)
+    if options.cert and not options.key:
+        parser.error("--cert needs --key")
+    return options
+
+def main():
+    options = parse_args()
+    servers, inventory = start_mock(options)
+    out = open(options.inventory, 'w') if options.inventory else sys.stdout
+    for address, asset in inventory:
+        out.write("%s,%s\n" % (address, asset))
+    if out is not sys.stdout:
+        out.close()
+    sys.stdout.flush()
+    print ("# INFO -- Serving %s mock BMCs, Ctrl-C to stop" % (len(inventory)), file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stop_mock(servers)
+
+if __name__ == "__main__":
+    main()
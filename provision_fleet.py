@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+#
+# Provision a mixed Dell/HPE fleet in a single pass
+#
+# Each host's vendor is detected from its service root and the matching
+# driver in redfish_drivers.py does the work, so Dell and HPE servers share
+# one worker pool, one session cache and the per-host keep-alive pools.
+# For every host the BIOS config of its vendor is reconciled (only the
+# attributes that differ are set), the asset tag is set, and with --reboot
+# the host is rebooted and the pending changes waited for.
+#
+# One JSON result record is written per host, as with the --inventory mode
+# of dell_set_bios_attr.py, with the seconds spent in each stage and the
+# number of requests sent to the BMC.
+#
+import sys
+import csv
+import json
+import time
+import argparse
+import traceback
+import warnings
+import concurrent.futures
+import redfish_metrics
+from redfish_drivers import detect_driver, RedfishError
+from redfish_transport import bmc_url, get_transport, close_transport, budget, DeadlineExceeded, CLEANUP_BUDGET
+from redfish_session_cache import SessionCache, DEFAULT_CACHE_FILE as DEFAULT_SESSION_CACHE_FILE
+from ilo_resource_cache import DEFAULT_CACHE_DIR as DEFAULT_RESOURCE_CACHE_DIR
+from dell_bios_registry import BiosAttributeError
+from redfish_events import EventListener
+
+warnings.filterwarnings("ignore")
+
+def parse_args():
+    global account
+    global password
+    global inventory_file
+    global bios_configs
+    global reboot_flag
+    global workers
+    global results_file
+    global session_cache_file
+    global driver_options
+    global event_address
+    global event_port
+    global event_cert
+    global event_key
+    global host_timeout
+
+    parser = argparse.ArgumentParser(
+        description='Set BIOS attributes for a mixed fleet of Dell and HPE servers',
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('--inventory', help='CSV file with one host per row\n'
+                                            '  ip,asset[,username,password]\n'
+                                            'Missing columns fall back to -u/-p', required=True)
+    parser.add_argument('-u', '--username', help='Enter username')
+    parser.add_argument('-p', '--password', help='Enter password')
+    parser.add_argument('--dell-config', help='Path to JSON config file for Dell hosts')
+    parser.add_argument('--hpe-config', help='Path to JSON config file for HPE hosts')
+    parser.add_argument('-r', '--reboot', help='Toggle to reboot hosts with pending changes and wait for them', action='store_true')
+    parser.add_argument('-w', '--workers', help='Number of hosts provisioned at once (default: 32)', type=int, default=32)
+    parser.add_argument('--host-timeout', help='Give up on a host after this many seconds in total; every request\n'
+                                               'and wait of the host stops at this budget (default: no limit)', type=float)
+    parser.add_argument('-o', '--results', help='Write JSON result records here instead of stdout')
+    parser.add_argument('--session-cache', help='Reuse BMC sessions across runs, cached in this file\n'
+                                                '(default: ~/.cache/redfish/sessions.json)',
+                        nargs='?', const=DEFAULT_SESSION_CACHE_FILE)
+    parser.add_argument('--events', help='Wait for jobs, power changes and POST on Redfish events instead of\n'
+                                         'polling. The BMCs send them to this host name or IP of this machine\n'
+                                         '(hosts that refuse the subscription are polled)',
+                        metavar='ADDRESS')
+    parser.add_argument('--event-port', help='Port of the event receiver (default: any free port)', type=int, default=0)
+    parser.add_argument('--event-cert', help='TLS certificate file of the event receiver')
+    parser.add_argument('--event-key', help='TLS key file of the event receiver')
+    parser.add_argument('--pool-size', help='Max keep-alive connections per BMC (default: 4)', type=int, default=None)
+    parser.add_argument('--no-registry', help='Do not validate Dell attributes against the BIOS attribute registry', action='store_true')
+    parser.add_argument('--registry-cache', help='Directory for cached Dell BIOS registries (default: ~/.cache/redfish/bios_registry)')
+    parser.add_argument('--resource-cache', help='Directory for cached iLO resource directories (default: ~/.cache/redfish/ilo_resources)',
+                        default=DEFAULT_RESOURCE_CACHE_DIR)
+    parser.add_argument('--bios-password', help='HPE BIOS password, if one is set')
+    parser.add_argument('--metrics', help='Write per-endpoint request timings as a JSON report to this file', metavar='FILE')
+    parser.add_argument('--metrics-prom', help='Write the same metrics in Prometheus text format to this file', metavar='FILE')
+    parser.add_argument('--trace', help='Write every Redfish request as one JSON line to this file', metavar='FILE')
+    args = vars(parser.parse_args())
+
+    if not args['dell_config'] and not args['hpe_config']:
+        parser.error("at least one of --dell-config and --hpe-config is required")
+    if args['events'] and not (args['event_cert'] and args['event_key']):
+        parser.error("--events needs --event-cert and --event-key")
+
+    # Before any transport is created, so connection timings are collected
+    if args['metrics'] or args['metrics_prom'] or args['trace']:
+        redfish_metrics.enable(args['metrics'], args['metrics_prom'], args['trace'])
+
+    account = args['username']
+    password = args['password']
+    inventory_file = args['inventory']
+    reboot_flag = args['reboot']
+    workers = args['workers']
+    results_file = args['results']
+    session_cache_file = args['session_cache']
+    event_address = args['events']
+    event_port = args['event_port']
+    event_cert = args['event_cert']
+    event_key = args['event_key']
+    host_timeout = args['host_timeout']
+    bios_configs = {}
+    if args['dell_config']:
+        bios_configs['Dell'] = json.load(open(args['dell_config']))
+    if args['hpe_config']:
+        bios_configs['HPE'] = json.load(open(args['hpe_config']))
+    driver_options = {
+        'pool_size': args['pool_size'],
+        'use_registry': not args['no_registry'],
+        'registry_cache': args['registry_cache'],
+        'resource_cache': args['resource_cache'],
+        'bios_password': args['bios_password']
+    }
+
+# Read the fleet inventory. Blank lines and lines starting with '#' are
+# skipped, and a header row starting with 'ip' is ignored.
+def read_inventory(path):
+    hosts = []
+    with open(path) as f:
+        for row in csv.reader(f):
+            row = [c.strip() for c in row]
+            if not row or not row[0] or row[0].startswith('#') or row[0].lower() == 'ip':
+                continue
+            row = row + [''] * (4 - len(row))
+            host = {
+                'ip': row[0],
+                'asset': row[1],
+                'username': row[2] or account,
+                'password': row[3] or password
+            }
+            missing = [k for k, v in host.items() if not v]
+            if missing:
+                print ("# ERROR -- Inventory row for %s is missing: %s" % (row[0], ', '.join(missing)), file=sys.stderr)
+                sys.exit(1)
+            hosts.append(host)
+    return hosts
+
+# Run one stage of a host and record how long it took
+def timed(record, stage, func, *args):
+    start = time.time()
+    try:
+        return func(*args)
+    finally:
+        record['stages'][stage] = round(time.time() - start, 3)
+
+def provision_host(host, record, log=print):
+    base_url = bmc_url(host['ip'])
+    try:
+        driver = timed(record, 'detect', lambda: detect_driver(base_url, host['username'], host['password'], session_cache=session_cache, log=log, **driver_options))
+        record['vendor'] = driver.vendor
+        if driver.vendor not in bios_configs:
+            raise RedfishError("# ERROR -- No BIOS config given for %s hosts, use --%s-config" % (driver.vendor, driver.vendor.lower()))
+
+        log (timed(record, 'auth', driver.auth_session))
+        if event_listener is not None and not driver.subscribe_events(event_listener):
+            log ("# WARN -- BMC refused the event subscription, polling instead")
+        try:
+            log (timed(record, 'wait_ready', driver.wait_ready))
+            desired = driver.desired_bios_attr(bios_configs[driver.vendor], host['asset'])
+            log (timed(record, 'bios', driver.apply_bios_delta, desired))
+            log (timed(record, 'asset_tag', driver.set_asset_tag, host['asset']))
+            log (timed(record, 'commit', driver.commit))
+            record['changed'] = driver.changed
+            if reboot_flag and driver.changed:
+                log (timed(record, 'reboot', driver.reboot))
+                log (timed(record, 'wait_for_commit', driver.wait_for_commit))
+        finally:
+            # On a budget of its own, in case the host's is what ran out
+            with budget(CLEANUP_BUDGET, replace=True):
+                driver.unsubscribe_events()
+                log (timed(record, 'end_session', driver.end_session))
+    finally:
+        # The host is done; don't keep an idle connection to every BMC of
+        # the fleet open until exit
+        stats = get_transport(base_url).stats()
+        record['requests'] = stats['requests']
+        record['connections'] = stats['connections']
+        close_transport(base_url)
+
+def provision_fleet_host(host):
+    record = {
+        'ip': host['ip'],
+        'asset': host['asset'],
+        'vendor': None,
+        'status': 'ok',
+        'changed': False,
+        'error': None,
+        'messages': [],
+        'stages': {}
+    }
+    start = time.time()
+    try:
+        with budget(host_timeout):
+            provision_host(host, record, log=lambda msg: record['messages'].append(msg))
+    except DeadlineExceeded as e:
+        record['status'] = 'timeout'
+        record['error'] = "no result within %s seconds: %s" % (host_timeout, e)
+    except (RedfishError, BiosAttributeError) as e:
+        record['status'] = 'failed'
+        record['error'] = str(e)
+    except SystemExit as e:
+        record['status'] = 'failed'
+        record['error'] = "exited with code %s" % (e.code)
+    except Exception as e:
+        record['status'] = 'failed'
+        record['error'] = "%s: %s" % (type(e).__name__, e)
+        record['traceback'] = traceback.format_exc()
+    record['elapsed'] = round(time.time() - start, 3)
+    return record
+
+def run_fleet(hosts):
+    out = open(results_file, 'w') if results_file else sys.stdout
+    failed = 0
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(provision_fleet_host, host) for host in hosts]
+            for future in concurrent.futures.as_completed(futures):
+                record = future.result()
+                if record['status'] != 'ok':
+                    failed += 1
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print ("# INFO -- Provisioned %s hosts, %s failed" % (len(hosts), failed), file=sys.stderr)
+    return failed
+
+def main():
+    parse_args()
+
+    # Log out sessions that earlier, crashed runs left in the cache
+    global session_cache
+    session_cache = None
+    if session_cache_file:
+        session_cache = SessionCache(session_cache_file)
+        swept = session_cache.sweep()
+        if swept:
+            print ("# INFO -- Logged out %s stale cached sessions" % (swept), file=sys.stderr)
+
+    # Receive Redfish events; closed (and every leftover subscription
+    # deleted) at exit
+    global event_listener
+    event_listener = None
+    if event_address:
+        event_listener = EventListener(event_address, event_cert, event_key, port=event_port).start()
+
+    failed = run_fleet(read_inventory(inventory_file))
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
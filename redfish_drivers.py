@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+#
+# Vendor-neutral Redfish drivers
+#
+# Every driver exposes the same provisioning operations, so one scheduler
+# can drive Dell and HPE servers side by side:
+#
+#   auth_session / end_session       log in (or reuse a cached session)
+#   get_power_state / set_power_state / reboot
+#   wait_ready                       wait until settings may be changed
+#   get_bios_attr / apply_bios_delta read BIOS, stage only what differs
+#   desired_bios_attr / set_asset_tag
+#   commit / wait_for_commit         make staged changes pending for the
+#                                    next boot, and wait for them to apply
+#   subscribe_events / unsubscribe_events
+#                                    wait on Redfish events, not polling
+#
+# apply_bios_delta and set_asset_tag set self.changed when they staged
+# something that needs commit() and a reboot. Operations return "# INFO"
+# style status strings like Utils in dell_set_bios_attr.py, and raise
+# RedfishError when they cannot continue: an "# ERROR" or missing result
+# from the BMC never comes back as a status string. Warnings about the
+# host that don't fit a return value, like BIOS attributes that were
+# skipped, go to the log the driver was given.
+#
+# RedfishDriver is abstract: a driver that lacks one of the operations
+# fails when it is created, not halfway through a host.
+#
+# detect_driver() picks the backend from the unauthenticated service root.
+#
+import time
+import requests
+import redfish_metrics
+from abc import ABC, abstractmethod
+from redfish_transport import get_transport, backoff_intervals, budget_deadline, budget_spent, clamp_interval, DeadlineExceeded
+from dell_async_utils import RedfishError
+from dell_set_bios_attr import Utils, bios_delta, checked, JOB_DONE_STATES
+from ilo_client import IloClient, ServerDownOrUnreachableError
+from ilo_resource_cache import DEFAULT_CACHE_DIR as DEFAULT_RESOURCE_CACHE_DIR
+from redfish_events import event_mark, event_pause
+
+DELL_BIOS_SETTINGS_URI = '/redfish/v1/Systems/System.Embedded.1/Bios/Settings'
+
+# iLO POST states in which it is safe to change settings
+HPE_POST_DONE_STATES = ('FinishedPost', 'InPostDiscoveryComplete')
+
+class RedfishDriver(ABC):
+    vendor = None
+
+    def __init__(self, base_url, username, password, session_cache=None, log=None, **options):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.session_cache = session_cache
+        self.log = log
+        self.options = options
+        self.changed = False
+        self.bios_attr = None
+        self.bios_delta = {}
+        self.events = None
+
+    # Pooled transport of the authenticated session
+    @property
+    @abstractmethod
+    def transport(self):
+        raise NotImplementedError
+
+    # Subscribe this BMC to an EventListener after auth_session(). Returns
+    # False if the BMC refused, in which case waits keep polling.
+    def subscribe_events(self, listener):
+        self.events = listener.subscribe(self.transport, self.base_url, auth=(self.username, self.password))
+        return self.events.subscribed
+
+    def unsubscribe_events(self):
+        if self.events is not None:
+            self.events.unsubscribe()
+
+    @abstractmethod
+    def auth_session(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def end_session(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_power_state(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_power_state(self, power_state_option):
+        raise NotImplementedError
+
+    @abstractmethod
+    def reboot(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def wait_ready(self, timeout=600):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_bios_attr(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def apply_bios_delta(self, bios_data):
+        raise NotImplementedError
+
+    # BIOS attributes that carry the asset tag on this vendor
+    @abstractmethod
+    def asset_tag_attr(self, asset_tag):
+        raise NotImplementedError
+
+    # The vendor config with this host's asset tag attributes on top, so a
+    # tag in the config file never fights with the per-host one
+    def desired_bios_attr(self, bios_config, asset_tag):
+        data = dict(bios_config)
+        data.update(self.asset_tag_attr(asset_tag))
+        return data
+
+    # What the BIOS will look like once the staged changes are applied
+    def staged_bios_attr(self):
+        if self.bios_attr is None:
+            self.get_bios_attr()
+        return dict(self.bios_attr, **self.bios_delta)
+
+    @abstractmethod
+    def set_asset_tag(self, asset_tag):
+        raise NotImplementedError
+
+    @abstractmethod
+    def commit(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def wait_for_commit(self, timeout=1800):
+        raise NotImplementedError
+
+class DellDriver(RedfishDriver):
+    vendor = 'Dell'
+
+    def __init__(self, base_url, username, password, session_cache=None, log=None, **options):
+        RedfishDriver.__init__(self, base_url, username, password, session_cache, log, **options)
+        self.utils = Utils(base_url, username, password, pool_size=options.get('pool_size'), session_cache=session_cache)
+        if log is not None:
+            self.utils.log = log
+
+    @property
+    def transport(self):
+        return self.utils.transport
+
+    def subscribe_events(self, listener):
+        subscribed = RedfishDriver.subscribe_events(self, listener)
+        self.utils.events = self.events
+        return subscribed
+
+    def auth_session(self):
+        try:
+            self.utils.auth_session()
+        except SystemExit:
+            raise RedfishError("# ERROR -- Authorization attempt for %s failed" % (self.base_url))
+        if self.options.get('use_registry', True):
+            return checked(self.utils.load_bios_registry(self.options.get('registry_cache')), 'Loading the BIOS registry')
+        return ("# INFO -- Logged in to iDRAC %s" % (self.base_url))
+
+    def end_session(self):
+        try:
+            return self.utils.end_session()
+        except SystemExit:
+            raise RedfishError("# ERROR -- Session deletion for %s failed" % (self.base_url))
+
+    def get_power_state(self):
+        return checked(self.utils.get_power_state(), 'Reading the power state')
+
+    def set_power_state(self, power_state_option):
+        return checked(self.utils.set_power_state(power_state_option), "A '%s'" % (power_state_option))
+
+    # The config job only runs after a cold boot, so power cycle. A step that
+    # fails aborts the host before the job wait.
+    def reboot(self):
+        messages = [
+            self.set_power_state('ForceOff'),
+            checked(self.utils.wait_for_power_state('Off'), 'Waiting for power off'),
+            self.set_power_state('On')
+        ]
+        return '\n'.join(messages)
+
+    # The iDRAC accepts staged settings in any power state
+    def wait_ready(self, timeout=600):
+        return ("# INFO -- iDRAC accepts settings in any power state")
+
+    def get_bios_attr(self):
+        self.bios_attr = self.utils.get_bios_attr()
+        return self.bios_attr
+
+    # Stage the BIOS attributes that differ, plus the boot sequence for the
+    # BootMode the host will have once the job has run
+    def apply_bios_delta(self, bios_data):
+        messages = [checked(self.utils.apply_bios_delta(bios_data), 'Setting BIOS attributes')]
+        self.bios_attr = self.utils.bios_attr
+        self.bios_delta = self.utils.bios_delta
+
+        target_boot_mode = bios_data.get('BootMode', self.bios_attr['BootMode'])
+        self.utils.current_boot_mode = self.bios_attr['BootMode']
+        messages.append(checked(self.utils.set_boot_order(reconcile=True, boot_mode=target_boot_mode), 'Setting the boot order'))
+        if self.utils.boot_order_deferred:
+            messages.append("# WARN -- Boot order will be set by the next run once the BootMode change is applied")
+
+        self.changed = self.changed or bool(self.bios_delta) or self.utils.boot_order_changed
+        return '\n'.join(messages)
+
+    # On Dell the asset tag is the AssetTag BIOS attribute, so it goes into
+    # the same config job as the rest
+    def asset_tag_attr(self, asset_tag):
+        return {'AssetTag': asset_tag}
+
+    def set_asset_tag(self, asset_tag):
+        delta = bios_delta(self.staged_bios_attr(), self.utils.clean_bios_attr(self.asset_tag_attr(asset_tag)))
+        if not delta:
+            return ("# INFO -- Asset tag already '%s'" % (asset_tag))
+        self.changed = True
+        self.bios_delta.update(delta)
+        return checked(self.utils.set_bios_attr(delta), 'Setting the asset tag')
+
+    # No job means the staged settings would never be applied
+    def commit(self):
+        if not self.changed:
+            return ("# INFO -- Nothing staged, no config job needed")
+        message = checked(self.utils.create_bios_config_job(DELL_BIOS_SETTINGS_URI), 'Creating the config job')
+        if not self.utils.last_job_id:
+            raise RedfishError("# ERROR -- No config job was created: %s" % (message))
+        return message
+
+    def wait_for_commit(self, timeout=1800):
+        if not getattr(self.utils, 'last_job_id', None):
+            return ("# INFO -- No config job to wait for")
+        message = self.utils.wait_for_job(self.utils.last_job_id, timeout=timeout)
+        if self.utils.last_job_state not in JOB_DONE_STATES:
+            raise RedfishError(message)
+        return message
+
+class HpeDriver(RedfishDriver):
+    vendor = 'HPE'
+
+    def __init__(self, base_url, username, password, session_cache=None, log=None, **options):
+        RedfishDriver.__init__(self, base_url, username, password, session_cache, log, **options)
+        self.client = None
+        self.bios_password = options.get('bios_password')
+
+    @property
+    def transport(self):
+        return self.client.transport
+
+    def auth_session(self):
+        resource_cache = self.options.get('resource_cache', DEFAULT_RESOURCE_CACHE_DIR)
+        try:
+            self.client = IloClient(self.base_url, self.username, self.password, session_cache=self.session_cache, resource_cache=resource_cache)
+        except ServerDownOrUnreachableError as e:
+            raise RedfishError("# ERROR -- %s" % (e))
+        return ("# INFO -- Logged in to iLO %s" % (self.base_url))
+
+    def end_session(self):
+        self.client.end_session()
+        return ("# INFO -- Ended iLO session")
+
+    # Status message of a successful response; any other raises
+    def check(self, response, action):
+        if response.status in (requests.codes.ok, requests.codes.created, requests.codes.accepted, requests.codes.no_content):
+            return ("# INFO -- Successfully performed %s" % (action))
+        try:
+            info = response.dict["error"]["@Message.ExtendedInfo"][0].get("MessageId")
+        except (KeyError, IndexError, TypeError, ValueError):
+            info = response.text
+        raise RedfishError("# ERROR -- %s returned err code '%s' with err message '%s'" % (action, response.status, info))
+
+    def get(self, path):
+        response = self.client.redfish_get(path)
+        self.check(response, "GET %s" % (path))
+        return response.dict
+
+    def system(self):
+        instances = self.client.search_for_type("ComputerSystem.")
+        if not instances:
+            raise RedfishError("# ERROR -- No ComputerSystem found on %s" % (self.base_url))
+        return instances[0]
+
+    # iLO 4 reports it under Oem/Hp, iLO 5 under Oem/Hpe
+    def get_post_state(self):
+        oem = self.get(self.system()["@odata.id"]).get("Oem", {})
+        return (oem.get("Hpe") or oem.get("Hp") or {}).get("PostState")
+
+    def get_power_state(self):
+        return self.get(self.system()["@odata.id"]).get("PowerState")
+
+    def set_power_state(self, power_state_option):
+        instance = self.system()
+        if self.client.isgen9:
+            path = instance["@odata.id"]
+            body = {"Action": "Reset", "ResetType": power_state_option}
+        else:
+            path = self.get(instance["@odata.id"])["Actions"]["#ComputerSystem.Reset"]["target"]
+            body = {"Action": "ComputerSystem.Reset", "ResetType": power_state_option}
+        return self.check(self.client.redfish_post(path, body), "a '%s'" % (power_state_option))
+
+    def reboot(self):
+        if self.get_power_state() == 'Off':
+            return self.set_power_state('On')
+        return self.set_power_state('ForceRestart')
+
+    # Settings changed midway through POST can be lost, so wait until the
+    # server is off or done with POST
+    @redfish_metrics.timed_operation('wait_for_post')
+    def wait_ready(self, timeout=600):
+        deadline = budget_deadline(timeout)
+        for interval in backoff_intervals(initial=1.0, maximum=10.0):
+            mark = event_mark(self.events)
+            post_state = self.get_post_state()
+            if post_state == 'PowerOff' or post_state in HPE_POST_DONE_STATES:
+                return ("# INFO -- Server is '%s'" % (post_state))
+            if time.time() >= deadline:
+                break
+            event_pause(self.events, 'post', mark, clamp_interval(interval, deadline), deadline)
+        if budget_spent(deadline):
+            raise DeadlineExceeded("# ERROR -- Server still '%s' when the time budget ran out" % (post_state))
+        raise RedfishError("# ERROR -- Server still '%s' after %s seconds" % (post_state, timeout))
+
+    def bios_instances(self):
+        current = settings = None
+        for instance in self.client.search_for_type("Bios."):
+            if 'settings' in instance['@odata.id'].lower():
+                settings = instance['@odata.id']
+            else:
+                current = instance['@odata.id']
+        return current, settings
+
+    def get_bios_attr(self):
+        current, settings = self.bios_instances()
+        output = self.get(current)
+        self.bios_attr = output if self.client.isgen9 else output.get('Attributes', {})
+        return self.bios_attr
+
+    def set_bios_attr(self, bios_data):
+        current, settings = self.bios_instances()
+        body = bios_data if self.client.isgen9 else {"Attributes": bios_data}
+        return self.check(self.client.redfish_patch(settings, body, optionalpassword=self.bios_password), "BIOS settings PATCH")
+
+    def apply_bios_delta(self, bios_data):
+        self.bios_delta = bios_delta(self.get_bios_attr(), bios_data)
+        if not self.bios_delta:
+            return ("# INFO -- BIOS attributes already match, nothing to set")
+        self.changed = True
+        return self.set_bios_attr(self.bios_delta)
+
+    # The ComputerSystem AssetTag applies right away; ServerAssetTag and
+    # ServerName are BIOS attributes that apply on the next boot
+    def asset_tag_attr(self, asset_tag):
+        return {'ServerAssetTag': asset_tag, 'ServerName': "mgmt-" + asset_tag + ".intacct.com"}
+
+    def set_asset_tag(self, asset_tag):
+        messages = [self.check(self.client.redfish_patch(self.system()["@odata.id"], {"AssetTag": asset_tag}), "asset tag PATCH")]
+        delta = bios_delta(self.staged_bios_attr(), self.asset_tag_attr(asset_tag))
+        if delta:
+            self.changed = True
+            self.bios_delta.update(delta)
+            messages.append(self.set_bios_attr(delta))
+        return '\n'.join(messages)
+
+    # iLO applies pending BIOS settings on the next boot without a job
+    def commit(self):
+        if not self.changed:
+            return ("# INFO -- Nothing staged")
+        return ("# INFO -- BIOS settings pending until the next boot")
+
+    # After a reboot the pending settings are applied during POST: wait for
+    # POST to start, then for it to finish
+    @redfish_metrics.timed_operation('wait_for_commit')
+    def wait_for_commit(self, timeout=1800):
+        deadline = budget_deadline(timeout)
+        start_deadline = min(deadline, time.time() + 60)
+        for interval in backoff_intervals(initial=1.0, maximum=5.0):
+            mark = event_mark(self.events)
+            if self.get_post_state() not in HPE_POST_DONE_STATES:
+                break
+            if time.time() + interval > start_deadline:
+                break
+            event_pause(self.events, 'post', mark, interval, start_deadline)
+        return self.wait_ready(timeout=max(deadline - time.time(), 1))
+
+DRIVERS = {
+    'Dell': DellDriver,
+    'HPE': HpeDriver
+}
+
+# Vendor of a BMC from its service root, which needs no authentication
+def detect_vendor(base_url, timeout=10.000):
+    try:
+        response = get_transport(base_url).get("%s/redfish/v1/" % (base_url), timeout=timeout)
+        if response.status_code != requests.codes.ok:
+            raise RedfishError("# ERROR -- Service root of %s returned err code %s" % (base_url, response.status_code))
+        service_root = response.json()
+    except DeadlineExceeded:
+        raise
+    except (requests.RequestException, ValueError) as e:
+        raise RedfishError("# ERROR -- Could not read the service root of %s: %s" % (base_url, e))
+
+    vendor = service_root.get('Vendor')
+    if vendor in DRIVERS:
+        return vendor
+    oem = service_root.get('Oem', {})
+    if 'Dell' in oem:
+        return 'Dell'
+    if 'Hpe' in oem or 'Hp' in oem:
+        return 'HPE'
+    raise RedfishError("# ERROR -- %s is neither a Dell iDRAC nor an HPE iLO" % (base_url))
+
+def detect_driver(base_url, username, password, session_cache=None, vendor=None, log=None, **options):
+    vendor = vendor or detect_vendor(base_url)
+    return DRIVERS[vendor](base_url, username, password, session_cache, log, **options)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+#
+# Redfish EventService listener
+#
+# Waiting on a job, a power transition or POST used to mean polling every
+# BMC every few seconds. With a listener, each BMC gets an
+# EventService/Subscriptions entry pointing back at a local HTTPS receiver,
+# and the host's worker sleeps until an event for that host arrives. Only
+# then does it do a single GET to check the state. Events are treated as
+# wake-up calls, not as the truth, so a missed or misclassified event only
+# costs a delay: while subscribed, workers still poll every
+# SAFETY_INTERVAL seconds.
+#
+# When the BMC refuses the subscription, the host falls back to the usual
+# adaptive polling. Subscriptions are deleted when the host is done, and any
+# left over are deleted when the listener closes (also at exit).
+#
+# Every host gets its own random token in the destination path, so events
+# are routed by token and events from anything else are ignored.
+#
+import ssl
+import json
+import time
+import atexit
+import secrets
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+DEFAULT_EVENT_TYPES = ['StatusChange', 'ResourceUpdated', 'Alert']
+
+# While subscribed, check the state at least this often anyway
+SAFETY_INTERVAL = 60.0
+
+# Context sent with every subscription, so they can be told apart from
+# subscriptions made by other tools
+EVENT_CONTEXT = 'redfish-provision'
+
+# Which waiters an event may concern. Vendors word their messages
+# differently, so this errs on the side of waking a waiter too often.
+def event_kinds(event):
+    origin = event.get('OriginOfCondition', '')
+    if isinstance(origin, dict):
+        origin = origin.get('@odata.id', '')
+    origin = str(origin).lower()
+    text = ' '.join(str(event.get(k, '')) for k in ('EventType', 'MessageId', 'Message')).lower()
+    kinds = set()
+    if '/jobs/' in origin or 'job' in text or 'jcp' in text:
+        kinds.add('job')
+    if '/systems/' in origin or 'power' in text:
+        kinds.add('power')
+    if '/systems/' in origin or 'post' in text or 'boot' in text:
+        kinds.add('post')
+    return kinds
+
+class HostEvents:
+    def __init__(self, listener, base_url, token):
+        self.listener = listener
+        self.base_url = base_url
+        self.token = token
+        self.subscription = None
+        self.transport = None
+        self.auth = None
+        self.cond = threading.Condition()
+        self.seq = {'job': 0, 'power': 0, 'post': 0}
+
+    @property
+    def subscribed(self):
+        return self.subscription is not None
+
+    def deliver(self, event):
+        with self.cond:
+            for kind in event_kinds(event):
+                self.seq[kind] += 1
+            self.cond.notify_all()
+
+    # Take a mark before checking the state, then wait() with it, so an
+    # event that arrives in between is not missed
+    def mark(self):
+        with self.cond:
+            return dict(self.seq)
+
+    def wait(self, kind, mark, timeout):
+        with self.cond:
+            return self.cond.wait_for(lambda: self.seq[kind] > mark[kind], timeout)
+
+    # Uses the host's session, or basic auth once the session is gone
+    def unsubscribe(self, timeout=10.000):
+        self.listener.forget(self.token)
+        if self.subscription is None:
+            return
+        try:
+            response = self.transport.delete(self.subscription, timeout=timeout)
+            if response.status_code == requests.codes.unauthorized and self.auth:
+                self.transport.delete(self.subscription, auth=self.auth, headers={'X-Auth-Token': None}, timeout=timeout)
+        except requests.RequestException:
+            pass
+        self.subscription = None
+
+class EventHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.send_response(204)
+        self.end_headers()
+        token = self.path.rstrip('/').split('/')[-1]
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return
+        self.server.listener.deliver(token, payload)
+
+class EventServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class EventListener:
+    # address is the host name or IP the BMCs can reach this machine at
+    def __init__(self, address, certfile, keyfile, port=0, bind='0.0.0.0'):
+        self.address = address
+        self.server = EventServer((bind, port), EventHandler)
+        self.server.listener = self
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+        self.port = self.server.server_address[1]
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+        return self
+
+    def deliver(self, token, payload):
+        with self.lock:
+            host_events = self.hosts.get(token)
+        if host_events is None:
+            return
+        events = payload.get('Events', [payload]) if isinstance(payload, dict) else []
+        for event in events:
+            host_events.deliver(event)
+
+    def forget(self, token):
+        with self.lock:
+            self.hosts.pop(token, None)
+
+    # Subscribe to events from one BMC over its authenticated transport. The
+    # returned HostEvents is not subscribed if the BMC refused, and callers
+    # then poll as before. auth is used to delete a subscription that is
+    # still there at close(), when the session may already be gone.
+    def subscribe(self, transport, base_url, auth=None, timeout=30.000):
+        token = secrets.token_hex(16)
+        host_events = HostEvents(self, base_url, token)
+        host_events.transport = transport
+        host_events.auth = auth
+        with self.lock:
+            self.hosts[token] = host_events
+
+        payload = {
+            'Destination': "https://%s:%s/events/%s" % (self.address, self.port, token),
+            'EventTypes': DEFAULT_EVENT_TYPES,
+            'Context': EVENT_CONTEXT,
+            'Protocol': 'Redfish'
+        }
+        subscriptions_url = "%s/redfish/v1/EventService/Subscriptions" % (base_url)
+        try:
+            response = transport.post(subscriptions_url, data=json.dumps(payload), timeout=timeout)
+            # Newer schemas dropped EventTypes, and some BMCs reject it
+            if response.status_code == requests.codes.bad_request:
+                del payload['EventTypes']
+                response = transport.post(subscriptions_url, data=json.dumps(payload), timeout=timeout)
+        except requests.RequestException:
+            return host_events
+        if response.status_code in (requests.codes.ok, requests.codes.created) and response.headers.get('Location'):
+            location = response.headers['Location']
+            if location.startswith('/'):
+                location = base_url + location
+            host_events.subscription = location
+        return host_events
+
+    def close(self):
+        with self.lock:
+            hosts = list(self.hosts.values())
+        for host_events in hosts:
+            host_events.unsubscribe()
+        if self.thread is not None:
+            self.server.shutdown()
+            self.thread = None
+        self.server.server_close()
+
+def event_mark(events):
+    if events is None or not events.subscribed:
+        return None
+    return events.mark()
+
+# Sleep until the next poll: until a matching event arrives (or the safety
+# interval passes) when subscribed, otherwise for the polling interval
+def event_pause(events, kind, mark, interval, deadline):
+    if mark is None:
+        time.sleep(interval)
+        return
+    events.wait(kind, mark, max(min(SAFETY_INTERVAL, deadline - time.time()), 0))
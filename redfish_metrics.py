@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+#
+# Per-endpoint Redfish request metrics
+#
+# Every Redfish call goes through Transport.request (redfish_transport.py)
+# or AsyncUtils.request (dell_async_utils.py). Once enable() has been called,
+# both record for each call:
+#
+#   method and URL template (ids replaced by {id}, see url_template)
+#   status code, or 'error' when the request raised
+#   response size in bytes
+#   total time, and for the requests transport also the TCP connect time,
+#   the TLS handshake time and the time to first byte; aiohttp only reports
+#   connect (TCP and TLS together) and the time to first byte
+#
+# Calls are aggregated into per-endpoint histograms, written at exit as a
+# JSON report and/or a Prometheus text file (for the node_exporter textfile
+# collector). Long waits (config jobs, power transitions, POST) are timed
+# as operations with timed_operation. With a trace file, every call is also
+# written as one JSON line.
+#
+# While disabled, the only cost is a check of the module's recorder global
+# per request. Connection timings are only collected for transports created
+# after enable(), so the scripts enable metrics before connecting.
+#
+import re
+import json
+import time
+import atexit
+import asyncio
+import functools
+import threading
+import contextlib
+from urllib.parse import urlsplit
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# The Recorder in use, None while metrics are disabled
+recorder = None
+
+# Histogram upper bounds in seconds. BMC calls range from a few ms to many
+# seconds (Bios/Settings PATCH, job creation), waits up to half an hour.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+OPERATION_BUCKETS = (1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1200.0, 1800.0)
+
+TIMINGS = ('seconds', 'connect', 'tls', 'ttfb')
+
+# Path segments following these collections are instance ids
+ID_COLLECTIONS = ('Sessions', 'Subscriptions', 'Jobs', 'Accounts', 'Tasks', 'Entries')
+ID_SEGMENT = re.compile(r'^(\d+|JID_\w+|RID_\w+|[0-9a-fA-F-]{16,})$')
+
+# Endpoint of a URL, so that e.g. every job status GET lands in one
+# histogram: /redfish/v1/Managers/iDRAC.Embedded.1/Jobs/{id}
+def url_template(base_url, url):
+    if base_url and url.startswith(base_url):
+        path, _, query = url[len(base_url):].partition('?')
+    else:
+        parts = urlsplit(url)
+        path, query = parts.path, parts.query
+    segments = path.rstrip('/').split('/')
+    for i in range(1, len(segments)):
+        if segments[i - 1] in ID_COLLECTIONS or ID_SEGMENT.match(segments[i]):
+            segments[i] = '{id}'
+    template = '/'.join(segments) or '/'
+    if '$expand' in query:
+        template += '?$expand'
+    return template
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.bounds) and value > self.bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    # Estimated from the buckets, interpolating within the bucket
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, n in enumerate(self.counts):
+            upper = self.bounds[i] if i < len(self.bounds) else self.max
+            if n and seen + n >= rank:
+                return round(min(lower + (upper - lower) * (rank - seen) / n, self.max), 4)
+            seen += n
+            lower = upper
+        return round(self.max, 4)
+
+    def to_dict(self):
+        if not self.count:
+            return None
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 4),
+            'mean': round(self.sum / self.count, 4),
+            'p50': self.quantile(0.50),
+            'p90': self.quantile(0.90),
+            'p99': self.quantile(0.99),
+            'max': round(self.max, 4)
+        }
+
+class Endpoint:
+    def __init__(self, method, template):
+        self.method = method
+        self.template = template
+        self.count = 0
+        self.statuses = {}
+        self.bytes = 0
+        self.timings = dict((name, Histogram()) for name in TIMINGS)
+
+    def to_dict(self):
+        data = {
+            'method': self.method,
+            'endpoint': self.template,
+            'count': self.count,
+            'status': dict(self.statuses),
+            'bytes': self.bytes
+        }
+        for name in TIMINGS:
+            data[name] = self.timings[name].to_dict()
+        return data
+
+class Call:
+    __slots__ = ('base_url', 'method', 'url', 'started', 'start', 'status', 'bytes', 'connect', 'tls', 'ttfb', 'sent')
+
+    def __init__(self, base_url, method, url):
+        self.base_url = base_url
+        self.method = method
+        self.url = url
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.status = 'error'
+        self.bytes = 0
+        self.connect = None
+        self.tls = None
+        self.ttfb = None
+        self.sent = None
+
+# Call being made by this thread, for the connection classes below
+_local = threading.local()
+
+def current_call():
+    return getattr(_local, 'call', None)
+
+class Recorder:
+    def __init__(self, json_path=None, prometheus_path=None, trace_path=None):
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.operations = {}
+        self.started = time.time()
+        self.trace = open(trace_path, 'w') if trace_path else None
+
+    # Time one request. The block sets call.status and call.bytes; an
+    # exception leaves the status at 'error'.
+    @contextlib.contextmanager
+    def call(self, base_url, method, url):
+        call = Call(base_url, method, url)
+        previous = current_call()
+        _local.call = call
+        try:
+            yield call
+        finally:
+            _local.call = previous
+            self.finish(call)
+
+    def finish(self, call):
+        seconds = time.perf_counter() - call.start
+        template = url_template(call.base_url, call.url)
+        key = (call.method, template)
+        with self.lock:
+            endpoint = self.endpoints.get(key)
+            if endpoint is None:
+                endpoint = self.endpoints[key] = Endpoint(call.method, template)
+            endpoint.count += 1
+            endpoint.statuses[str(call.status)] = endpoint.statuses.get(str(call.status), 0) + 1
+            endpoint.bytes += call.bytes
+            endpoint.timings['seconds'].observe(seconds)
+            for name in ('connect', 'tls', 'ttfb'):
+                value = getattr(call, name)
+                if value is not None:
+                    endpoint.timings[name].observe(value)
+            if self.trace is not None:
+                self.trace.write(json.dumps({
+                    'time': round(call.started, 6),
+                    'host': call.base_url,
+                    'method': call.method,
+                    'url': call.url,
+                    'endpoint': template,
+                    'status': call.status,
+                    'bytes': call.bytes,
+                    'seconds': round(seconds, 6),
+                    'connect': call.connect,
+                    'tls': call.tls,
+                    'ttfb': call.ttfb
+                }) + "\n")
+
+    def observe_operation(self, name, seconds):
+        with self.lock:
+            histogram = self.operations.get(name)
+            if histogram is None:
+                histogram = self.operations[name] = Histogram(OPERATION_BUCKETS)
+            histogram.observe(seconds)
+
+    def report(self):
+        with self.lock:
+            endpoints = sorted(self.endpoints.values(), key=lambda e: -e.timings['seconds'].sum)
+            return {
+                'started': round(self.started, 3),
+                'elapsed': round(time.time() - self.started, 3),
+                'requests': sum(e.count for e in endpoints),
+                'endpoints': [e.to_dict() for e in endpoints],
+                'operations': dict((name, h.to_dict()) for name, h in sorted(self.operations.items()))
+            }
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            endpoints = sorted(self.endpoints.values(), key=lambda e: (e.template, e.method))
+            operations = sorted(self.operations.items())
+
+            lines.append("# HELP redfish_requests_total Redfish requests by endpoint and status")
+            lines.append("# TYPE redfish_requests_total counter")
+            for e in endpoints:
+                for status, n in sorted(e.statuses.items()):
+                    lines.append("redfish_requests_total{%s} %s" % (labels(method=e.method, endpoint=e.template, status=status), n))
+
+            lines.append("# HELP redfish_response_bytes_total Redfish response body bytes by endpoint")
+            lines.append("# TYPE redfish_response_bytes_total counter")
+            for e in endpoints:
+                lines.append("redfish_response_bytes_total{%s} %s" % (labels(method=e.method, endpoint=e.template), e.bytes))
+
+            for name, help_text in (('seconds', 'Redfish request time'),
+                                    ('connect', 'TCP connect time of new connections'),
+                                    ('tls', 'TLS handshake time of new connections'),
+                                    ('ttfb', 'Time from sending the request to the first response byte')):
+                metric = 'redfish_request_seconds' if name == 'seconds' else 'redfish_%s_seconds' % (name)
+                lines.append("# HELP %s %s" % (metric, help_text))
+                lines.append("# TYPE %s histogram" % (metric))
+                for e in endpoints:
+                    histogram_lines(lines, metric, e.timings[name], method=e.method, endpoint=e.template)
+
+            lines.append("# HELP redfish_operation_seconds Time spent waiting on jobs, power transitions and POST")
+            lines.append("# TYPE redfish_operation_seconds histogram")
+            for name, histogram in operations:
+                histogram_lines(lines, 'redfish_operation_seconds', histogram, operation=name)
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        if self.json_path:
+            with open(self.json_path, 'w') as f:
+                json.dump(self.report(), f, indent=2)
+                f.write("\n")
+        if self.prometheus_path:
+            with open(self.prometheus_path, 'w') as f:
+                f.write(self.prometheus())
+        if self.trace is not None:
+            with self.lock:
+                self.trace.close()
+                self.trace = None
+
+def labels(**values):
+    return ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                    for k, v in sorted(values.items()))
+
+def histogram_lines(lines, metric, histogram, **label_values):
+    if not histogram.count:
+        return
+    cumulative = 0
+    for bound, n in zip(histogram.bounds, histogram.counts):
+        cumulative += n
+        lines.append("%s_bucket{%s} %s" % (metric, labels(le=repr(bound), **label_values), cumulative))
+    lines.append("%s_bucket{%s} %s" % (metric, labels(le='+Inf', **label_values), histogram.count))
+    lines.append("%s_sum{%s} %s" % (metric, labels(**label_values), round(histogram.sum, 6)))
+    lines.append("%s_count{%s} %s" % (metric, labels(**label_values), histogram.count))
+
+# Turn metrics on for the rest of the process. The report files are
+# written at exit.
+def enable(json_path=None, prometheus_path=None, trace_path=None):
+    global recorder
+    if recorder is None:
+        recorder = Recorder(json_path, prometheus_path, trace_path)
+        atexit.register(recorder.write)
+    return recorder
+
+# Time a long-running wait as a named operation
+def timed_operation(name):
+    def decorate(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if recorder is None:
+                    return await func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    recorder.observe_operation(name, time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if recorder is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                recorder.observe_operation(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+# urllib3 connections that report their connect, TLS and first byte timings
+# to the call being made by the current thread
+class TimedHTTPConnection(HTTPConnection):
+    def _new_conn(self):
+        start = time.perf_counter()
+        try:
+            return super()._new_conn()
+        finally:
+            call = current_call()
+            if call is not None:
+                call.connect = round(time.perf_counter() - start, 6)
+
+    def request(self, *args, **kwargs):
+        result = super().request(*args, **kwargs)
+        call = current_call()
+        if call is not None:
+            call.sent = time.perf_counter()
+        return result
+
+    def getresponse(self, *args, **kwargs):
+        response = super().getresponse(*args, **kwargs)
+        call = current_call()
+        if call is not None and call.sent is not None:
+            call.ttfb = round(time.perf_counter() - call.sent, 6)
+        return response
+
+class TimedHTTPSConnection(TimedHTTPConnection, HTTPSConnection):
+    # HTTPSConnection.connect opens the socket with _new_conn, then does the
+    # handshake; whatever isn't TCP connect is TLS
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        call = current_call()
+        if call is not None and call.connect is not None:
+            call.tls = round(max(time.perf_counter() - start - call.connect, 0.0), 6)
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+# Make a requests HTTPAdapter open timed connections
+def instrument_adapter(adapter):
+    adapter.poolmanager.pool_classes_by_scheme = {
+        'http': TimedHTTPConnectionPool,
+        'https': TimedHTTPSConnectionPool
+    }
+
+# aiohttp reports connect and first byte timings through a TraceConfig; the
+# Call is passed to each request as its trace_request_ctx
+def aiohttp_trace_config():
+    import aiohttp
+    config = aiohttp.TraceConfig()
+
+    async def on_request_start(session, ctx, params):
+        ctx.sent = time.perf_counter()
+
+    async def on_connection_create_start(session, ctx, params):
+        ctx.connect_start = time.perf_counter()
+
+    async def on_connection_create_end(session, ctx, params):
+        call = ctx.trace_request_ctx
+        ctx.sent = time.perf_counter()
+        if isinstance(call, Call):
+            call.connect = round(ctx.sent - ctx.connect_start, 6)
+
+    async def on_request_end(session, ctx, params):
+        call = ctx.trace_request_ctx
+        if isinstance(call, Call):
+            call.ttfb = round(time.perf_counter() - ctx.sent, 6)
+
+    config.on_request_start.append(on_request_start)
+    config.on_connection_create_start.append(on_connection_create_start)
+    config.on_connection_create_end.append(on_connection_create_end)
+    config.on_request_end.append(on_request_end)
+    return config
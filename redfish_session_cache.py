@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+#
+# Persistent Redfish session token cache
+#
+# Every login POSTs to the session service and takes a slot in the BMC's
+# small session table. When a run crashes before logging out, that slot
+# leaks until the BMC times it out, and enough leaks make later logins
+# fail. This cache remembers the X-Auth-Token and session URI per
+# (host, user), so the next invocation can reuse a still valid session
+# instead of logging in again. Sessions that sat idle longer than the TTL
+# are swept (DELETEd) at startup, unless the process using them is still
+# running: a run records itself as the owner of a session while it holds it
+# and clears that when it hands the session back.
+#
+# The cache file holds live tokens, so it is created with mode 0600.
+#
+import os
+import json
+import time
+import fcntl
+import socket
+import threading
+import contextlib
+import requests
+from redfish_transport import get_transport
+
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'redfish', 'sessions.json')
+
+# iDRAC and iLO drop idle sessions after 30 minutes by default; stay under it
+DEFAULT_TTL = 1500
+
+class SessionCache:
+    def __init__(self, path=None, ttl=DEFAULT_TTL):
+        self.path = path or DEFAULT_CACHE_FILE
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+    def key(self, base_url, username):
+        return "%s|%s" % (base_url, username)
+
+    # Hold both the in-process lock and an flock on a side file, so parallel
+    # threads and parallel invocations don't clobber each other's entries
+    @contextlib.contextmanager
+    def locked(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def save(self, entries):
+        tmp_path = "%s.%s.tmp" % (self.path, os.getpid())
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f, indent=2, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+    def expired(self, entry):
+        return time.time() - entry.get('last_used', 0) > self.ttl
+
+    def owner(self):
+        return {'hostname': socket.gethostname(), 'pid': os.getpid()}
+
+    # True while the process that holds the session is still running. A
+    # long host (a BIOS job, a slow POST) can hold its session well past
+    # the TTL. Owners on other machines can't be checked and fall back on
+    # the TTL alone.
+    def in_use(self, entry):
+        owner = entry.get('owner')
+        if owner is None or owner.get('hostname') != socket.gethostname():
+            return False
+        try:
+            os.kill(owner['pid'], 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    # Cached session for (host, user), or None if there is none or it sat
+    # idle past the TTL. The caller still has to validate it against the BMC.
+    def get(self, base_url, username):
+        with self.locked():
+            entry = self.load().get(self.key(base_url, username))
+        if entry is None or self.expired(entry):
+            return None
+        return entry
+
+    def put(self, base_url, username, token, location):
+        with self.locked():
+            entries = self.load()
+            entries[self.key(base_url, username)] = {
+                'base_url': base_url,
+                'username': username,
+                'token': token,
+                'location': location,
+                'created': time.time(),
+                'last_used': time.time(),
+                'owner': self.owner()
+            }
+            self.save(entries)
+
+    # Mark the session as used now. in_use=True claims it for this process,
+    # False hands it back for the next run to reuse (or sweep).
+    def touch(self, base_url, username, in_use=True):
+        with self.locked():
+            entries = self.load()
+            entry = entries.get(self.key(base_url, username))
+            if entry is not None:
+                entry['last_used'] = time.time()
+                if in_use:
+                    entry['owner'] = self.owner()
+                else:
+                    entry.pop('owner', None)
+                self.save(entries)
+
+    def remove(self, base_url, username):
+        with self.locked():
+            entries = self.load()
+            if entries.pop(self.key(base_url, username), None) is not None:
+                self.save(entries)
+
+    # Log out every cached session that sat idle past the TTL and forget it.
+    # These are sessions a crashed or interrupted run left behind; sessions
+    # a running process still holds are left alone.
+    def sweep(self, timeout=10.000):
+        with self.locked():
+            entries = self.load()
+            stale = dict((k, e) for k, e in entries.items() if self.expired(e) and not self.in_use(e))
+            for key in stale:
+                del entries[key]
+            if stale:
+                self.save(entries)
+
+        swept = 0
+        for entry in stale.values():
+            try:
+                response = get_transport(entry['base_url']).delete(
+                    entry['location'],
+                    headers={'X-Auth-Token': entry['token']},
+                    timeout=timeout
+                )
+            except requests.RequestException:
+                continue
+            if response.status_code in (200, 204):
+                swept += 1
+        return swept
+
+# True if the BMC still accepts the cached token. Any authenticated GET on
+# the session's own URI is the cheapest check there is.
+def session_valid(transport, entry, timeout=10.000):
+    try:
+        response = transport.get(
+            entry['location'],
+            headers={'X-Auth-Token': entry['token']},
+            timeout=timeout
+        )
+    except requests.RequestException:
+        return False
+    return response.status_code == 200
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+#
+# Shared HTTP transport for the Redfish scripts.
+#
+# Every BMC gets exactly one pooled requests.Session, so consecutive Redfish
+# calls against the same iDRAC/iLO reuse a keep-alive TCP+TLS connection
+# instead of paying a fresh handshake per request. The BMC TLS handshake is
+# slow and CPU heavy, so this matters a lot when provisioning many hosts.
+#
+# Each transport is also the admission control for its BMC:
+#   in-flight requests are capped by the pool size (pool_block=True)
+#   sessions are capped by session slots, see acquire_session()
+#   connection errors, 503s, and other 5xx on reads and DELETEs, are
+#   retried after a jittered exponential backoff
+#   a circuit breaker fails every request fast once the BMC has stopped
+#   answering, so a dead host gives its worker back to the rest of the fleet
+#   instead of burning a timeout on every call; after BREAKER_COOLDOWN one
+#   request is let through to see whether it is back
+#
+# Requests also honour the deadline budget of the calling thread or task
+# (see budget()): the connect and read timeouts are cut to what is left
+# of it, and once it is spent requests raise DeadlineExceeded without
+# touching the BMC. A fleet gives each host a budget, and the waits for
+# jobs, power and POST stop at it.
+#
+import time
+import random
+import threading
+import contextlib
+import contextvars
+import concurrent.futures
+import requests
+import redfish_metrics
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# Most BMCs only allow a handful of concurrent connections, so keep the
+# default pool small. Override with get_transport(..., pool_size=N).
+DEFAULT_POOL_SIZE = 4
+
+# The auth token lives on the shared requests.Session, so by default only
+# one session per BMC can be open in this process at a time
+DEFAULT_MAX_SESSIONS = 1
+SESSION_WAIT = 600.0
+
+DEFAULT_RETRIES = 2
+RETRY_BASE = 0.5
+RETRY_CAP = 8.0
+RETRY_STATUSES = (500, 502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'PATCH', 'DELETE')
+# A PATCH that failed with a 500 may still have been applied, so only these
+# are resent on an error status other than 503
+STATUS_RETRY_METHODS = ('GET', 'HEAD', 'DELETE')
+
+# Budget for logging out and unsubscribing once a host's own is spent
+CLEANUP_BUDGET = 15.0
+
+# Nobody waits this long for a TCP connect to a BMC on the same network,
+# whatever the read timeout of the call
+CONNECT_TIMEOUT = 10.0
+
+# Consecutive connection failures that open the breaker, and how long it
+# stays open before the next probe
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN = 60.0
+
+DEFAULT_HEADERS = {
+    'Content-Type': "application/json"
+}
+
+# A Redfish operation failed in a way its caller can't continue from
+class RedfishError(Exception):
+    pass
+
+# Raised without contacting the BMC while its circuit breaker is open, or
+# when no session slot frees up. A ConnectionError, so existing handlers of
+# unreachable BMCs apply.
+class BmcUnavailable(requests.ConnectionError):
+    pass
+
+# Raised when the deadline budget of the calling thread or task is spent. A
+# Timeout, so existing handlers of slow BMCs apply.
+class DeadlineExceeded(requests.Timeout):
+    pass
+
+_deadline = contextvars.ContextVar('redfish_deadline', default=None)
+
+# Run the block with a budget of this many seconds. A nested budget can only
+# shorten the enclosing one, unless replace is set (e.g. to give cleanup a
+# short budget of its own after the host's is spent). None means no budget
+# of its own.
+@contextlib.contextmanager
+def budget(seconds, replace=False):
+    at = time.time() + seconds if seconds is not None else None
+    current = _deadline.get()
+    if not replace and current is not None and (at is None or current < at):
+        at = current
+    token = _deadline.set(at)
+    try:
+        yield at
+    finally:
+        _deadline.reset(token)
+
+# Seconds left of the current budget, None without one
+def time_left():
+    at = _deadline.get()
+    return None if at is None else at - time.time()
+
+# Absolute deadline for a wait of timeout seconds within the budget
+def budget_deadline(timeout):
+    at = time.time() + timeout
+    current = _deadline.get()
+    return at if current is None else min(at, current)
+
+# Whether a wait that gave up at deadline was cut short by the budget
+# rather than by its own timeout
+def budget_spent(deadline_at):
+    current = _deadline.get()
+    return current is not None and current <= deadline_at
+
+# (connect, read) timeouts for a call, cut to what is left of the budget
+def request_timeout(timeout, what='request'):
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+    else:
+        connect, read = min(CONNECT_TIMEOUT, timeout or CONNECT_TIMEOUT), timeout
+    left = time_left()
+    if left is None:
+        return connect, read
+    if left <= 0:
+        raise DeadlineExceeded("%s: deadline budget spent" % (what))
+    return min(connect, left), min(read, left) if read is not None else left
+
+class CircuitBreaker:
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def open(self):
+        return self.opened_at is not None
+
+    # Raises BmcUnavailable while open. Once the cooldown has passed, a
+    # single caller is let through as the probe; check() then returns True
+    # and the caller must end_probe() however its request ends.
+    def check(self, base_url):
+        with self.lock:
+            if self.opened_at is None:
+                return False
+            if not self.probing and time.time() - self.opened_at >= self.cooldown:
+                self.probing = True
+                return True
+            failures = self.failures
+        raise BmcUnavailable("%s: not answering after %s connection failures, failing fast" % (base_url, failures))
+
+    # A probe that was cut short showed nothing either way; the next
+    # caller probes again
+    def end_probe(self):
+        with self.lock:
+            self.probing = False
+
+    # Any response, even an error status, shows the BMC is up
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.failures >= self.threshold:
+                self.opened_at = time.time()
+
+# Full jitter: attempt n waits a random time up to base * 2**n
+def retry_delays(retries=DEFAULT_RETRIES, base=RETRY_BASE, cap=RETRY_CAP):
+    for attempt in range(retries):
+        yield random.uniform(0, min(cap, base * 2 ** attempt))
+
+# A 503 means the BMC did not take the request on, so it can be resent
+# whatever the method; other 5xx only for reads and DELETEs
+def retryable_status(method, status):
+    if status == 503:
+        return True
+    return status in RETRY_STATUSES and method in STATUS_RETRY_METHODS
+
+# A 503 may say when to come back
+def retry_after(response, delay, cap=RETRY_CAP):
+    try:
+        return min(max(float(response.headers.get('Retry-After', '')), 0.0), cap)
+    except ValueError:
+        return delay
+
+# Whether a failed request may be sent again. A read timeout already used
+# up the caller's timeout, and a POST is only resent if it never reached
+# the BMC: creating a job or a session twice is worse than failing.
+def retryable_error(method, error):
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if isinstance(error, requests.Timeout):
+        return False
+    if method in IDEMPOTENT_METHODS:
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+class Transport:
+    def __init__(self, base_url, pool_size=DEFAULT_POOL_SIZE, headers=None, verify=False,
+                 max_sessions=DEFAULT_MAX_SESSIONS, retries=DEFAULT_RETRIES):
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.retries = retries
+        self.breaker = CircuitBreaker()
+        self.session_slots = threading.BoundedSemaphore(max_sessions)
+        self.session = requests.Session()
+        self.session.verify = verify
+        self.session.headers.update(DEFAULT_HEADERS)
+        if headers:
+            self.session.headers.update(headers)
+
+        # One connection pool per BMC; block instead of opening extra
+        # throw-away connections when the pool is exhausted
+        self.adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=True
+        )
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        if redfish_metrics.recorder is not None:
+            redfish_metrics.instrument_adapter(self.adapter)
+
+    def set_header(self, name, value):
+        self.session.headers[name] = value
+
+    def del_header(self, name):
+        self.session.headers.pop(name, None)
+
+    # Take one of the BMC's session slots before logging in, waiting for
+    # another owner to log out if they are all taken. Owners must
+    # release_session() exactly once.
+    def acquire_session(self, timeout=SESSION_WAIT):
+        if not self.session_slots.acquire(timeout=timeout):
+            raise BmcUnavailable("%s: no free session slot after %s seconds" % (self.base_url, timeout))
+
+    def release_session(self):
+        self.session_slots.release()
+
+    def request(self, method, url, **kwargs):
+        # Pass verify explicitly: requests lets REQUESTS_CA_BUNDLE override
+        # the session's own setting
+        kwargs.setdefault('verify', self.session.verify)
+        timeout = kwargs.get('timeout')
+        delays = retry_delays(self.retries)
+        while True:
+            kwargs['timeout'] = request_timeout(timeout, "%s %s" % (method, url))
+            probe = self.breaker.check(self.base_url)
+            try:
+                response = self.send(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # Out of budget is not the BMC's fault
+                left = time_left()
+                if left is not None and left <= 0:
+                    raise DeadlineExceeded("%s %s: deadline budget spent" % (method, url)) from e
+                self.breaker.failure()
+                delay = next(delays, None) if retryable_error(method, e) else None
+                if delay is None or (left is not None and delay >= left):
+                    raise
+            except Exception:
+                self.breaker.failure()
+                raise
+            else:
+                self.breaker.success()
+                if not retryable_status(method, response.status_code):
+                    return response
+                delay = next(delays, None)
+                if delay is None:
+                    return response
+                delay = retry_after(response, delay)
+                left = time_left()
+                if left is not None and delay >= left:
+                    return response
+            finally:
+                if probe:
+                    self.breaker.end_probe()
+            time.sleep(delay)
+
+    def send(self, method, url, **kwargs):
+        recorder = redfish_metrics.recorder
+        if recorder is None:
+            return self.session.request(method, url, **kwargs)
+        with recorder.call(self.base_url, method, url) as call:
+            response = self.session.request(method, url, **kwargs)
+            call.status = response.status_code
+            call.bytes = len(response.content)
+            return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    # Connection reuse counters, straight from the urllib3 connection pool.
+    # Every request beyond the number of opened connections was served over
+    # an already established keep-alive connection.
+    def stats(self):
+        connections = 0
+        requests_sent = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            connections += pool.num_connections
+            requests_sent += pool.num_requests
+        return {
+            'connections': connections,
+            'requests': requests_sent,
+            'reused': max(requests_sent - connections, 0)
+        }
+
+    def close(self):
+        self.session.close()
+
+    # The $expand flavour this service supports, read once from the service
+    # root's ProtocolFeaturesSupported. None if it doesn't support $expand.
+    def expand_query(self, root_url, timeout=10.000):
+        if not hasattr(self, '_expand_query'):
+            self._expand_query = None
+            try:
+                response = self.get(root_url, timeout=timeout)
+                features = response.json().get('ProtocolFeaturesSupported', {}).get('ExpandQuery', {})
+            except DeadlineExceeded:
+                del self._expand_query
+                raise
+            except (requests.RequestException, ValueError):
+                features = {}
+            if features.get('NoLinks'):
+                self._expand_query = '.($levels=1)'
+            elif features.get('ExpandAll'):
+                self._expand_query = '*($levels=1)'
+        return self._expand_query
+
+# Return the shared transport for a BMC, creating it on first use
+def get_transport(base_url, pool_size=None, headers=None):
+    with _transports_lock:
+        transport = _transports.get(base_url)
+        if transport is None:
+            transport = Transport(base_url, pool_size=pool_size or DEFAULT_POOL_SIZE, headers=headers)
+            _transports[base_url] = transport
+        elif headers:
+            transport.session.headers.update(headers)
+        return transport
+
+def close_transport(base_url):
+    with _transports_lock:
+        transport = _transports.pop(base_url, None)
+    if transport is not None:
+        transport.close()
+
+def transport_stats():
+    with _transports_lock:
+        transports = list(_transports.items())
+    return dict((base_url, t.stats()) for base_url, t in transports)
+
+# Base URL of a BMC given as an address on the command line or in an
+# inventory. Plain addresses get https://, a full URL (e.g. a virtual host of
+# mock_redfish_server.py) is used as is.
+def bmc_url(address):
+    if '://' in address:
+        return address.rstrip('/')
+    return 'https://' + address
+
+# Adaptive polling intervals. Start short so that quick transitions are
+# noticed right away, then back off so long waits don't hammer the BMC.
+def backoff_intervals(initial=1.0, maximum=15.0, factor=1.5):
+    interval = initial
+    while True:
+        yield interval
+        interval = min(interval * factor, maximum)
+
+# Poll interval shortened so the last poll happens right at the deadline
+def clamp_interval(interval, deadline_at):
+    return max(min(interval, deadline_at - time.time()), 0.0)
+
+def collection_document(response, url):
+    if response.status_code != 200:
+        raise RedfishError("# ERROR -- GET %s returned err code %s" % (url, response.status_code))
+    return response.json()
+
+# Generic walker for Redfish collections (Accounts, EthernetInterfaces, ...).
+# Yields member documents as they arrive. When the service supports $expand
+# the whole collection comes back in a single request; otherwise members are
+# fetched concurrently over the host's keep-alive pool instead of one by one.
+def iter_collection(transport, base_url, collection_url, root_url=None, timeout=10.000):
+    expand = transport.expand_query(root_url or "%s/redfish/v1" % (base_url), timeout=timeout)
+    if expand:
+        response = transport.get("%s?$expand=%s" % (collection_url, expand), timeout=timeout)
+    else:
+        response = transport.get(collection_url, timeout=timeout)
+    members = collection_document(response, collection_url).get('Members', [])
+
+    # Expanded members carry their properties, plain ones only '@odata.id'
+    pending = []
+    for member in members:
+        if len(member) > 1:
+            yield member
+        else:
+            pending.append("%s%s" % (base_url, member['@odata.id']))
+    if not pending:
+        return
+
+    def fetch(url):
+        return collection_document(transport.get(url, timeout=timeout), url)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=transport.pool_size) as executor:
+        # Each fetch runs in the caller's context, so within its budget
+        futures = [executor.submit(contextvars.copy_context().run, fetch, url) for url in pending]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
+        finally:
+            # The caller may stop early once it has found what it wanted
+            for future in futures:
+                future.cancel()
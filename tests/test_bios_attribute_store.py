@@ -0,0 +1,68 @@
+import sqlite3
+import threading
+import pytest
+from bios_attribute_store import AttributeStore, HostAttributes, attribute_delta
+
+BASE = dict(('Attr%02d' % (i), 'Value%02d' % (i)) for i in range(20))
+
+@pytest.fixture
+def store():
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    lock = threading.Lock()
+
+    def execute(sql, params=()):
+        with lock, conn:
+            return conn.execute(sql, params).fetchall()
+    return AttributeStore(execute)
+
+def host_attributes(asset_tag, **changes):
+    return dict(BASE, AssetTag=asset_tag, **changes)
+
+def test_host_attributes_reads_through_the_delta():
+    attributes = HostAttributes({'A': 1, 'B': 2, 'C': 3}, {'set': {'B': 20, 'D': 4}, 'unset': ['C']})
+    assert dict(attributes) == {'A': 1, 'B': 20, 'D': 4}
+    assert len(attributes) == 3
+    assert 'C' not in attributes
+    with pytest.raises(KeyError):
+        attributes['C']
+    assert attributes == {'A': 1, 'B': 20, 'D': 4}
+
+def test_attribute_delta():
+    assert attribute_delta({'A': 1, 'B': 2}, {'A': 1, 'B': 3, 'C': 4}) == {'set': {'B': 3, 'C': 4}, 'unset': []}
+    assert attribute_delta({'A': 1, 'B': 2}, {'A': 1}) == {'set': {}, 'unset': ['B']}
+
+def test_hosts_of_one_config_share_one_base(store):
+    bases = set()
+    for i in range(10):
+        store.save('host%s' % (i), host_attributes('MOCK%04d' % (i)))
+        bases.add(store.execute("SELECT base FROM attribute_snapshots WHERE host = ?", ('host%s' % (i),))[0][0])
+    assert len(bases) == 1
+    assert store.stats()['bases'] == 1
+    # Only the host attributes are stored per host
+    assert store.latest('host3') == host_attributes('MOCK0003')
+
+def test_choose_base_reuses_a_base_for_a_small_delta(store):
+    store.save('host0', host_attributes('A'))
+    base_hash, delta = store.choose_base('host1', dict(BASE, Attr00='Changed'))
+    assert base_hash == store.host_base('host0')
+    assert delta == {'set': {'Attr00': 'Changed'}, 'unset': []}
+
+def test_choose_base_adds_a_base_for_a_large_delta(store):
+    store.save('host0', host_attributes('A'))
+    other = dict((k, v + 'x') for k, v in BASE.items())
+    base_hash, delta = store.choose_base('host1', other)
+    assert base_hash != store.host_base('host0')
+    assert delta == {'set': {}, 'unset': []}
+    assert store.base(base_hash) == other
+
+def test_snapshots_and_fleet(store):
+    first = store.save('host0', host_attributes('A'), taken_at=100.0)
+    store.save('host0', host_attributes('A', Attr01='Changed'), taken_at=200.0)
+    store.save('host1', host_attributes('B'), taken_at=150.0)
+    assert [taken_at for taken_at, _ in store.snapshots('host0')] == [100.0, 200.0]
+    assert store.snapshot('host0', first) == host_attributes('A')
+    fleet = store.fleet()
+    assert fleet['host0']['Attr01'] == 'Changed'
+    assert fleet['host1'] == host_attributes('B')
+    # A fleet view of given snapshots instead of the latest ones
+    assert store.fleet({'host0': first}) == {'host0': host_attributes('A')}
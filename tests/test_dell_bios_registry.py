@@ -0,0 +1,52 @@
+import pytest
+from dell_bios_registry import BiosRegistry, BiosAttributeError
+
+ENTRIES = [
+    {'AttributeName': 'LogicalProc', 'Type': 'Enumeration', 'Value': [{'ValueName': 'Enabled'}, {'ValueName': 'Disabled'}]},
+    {'AttributeName': 'MemFrequency', 'Type': 'Integer', 'LowerBound': 1600, 'UpperBound': 3200},
+    {'AttributeName': 'AssetTag', 'Type': 'String', 'MaxLength': 10, 'ValueExpression': '^[A-Z0-9]*$'},
+    {'AttributeName': 'PxeDev1EnDis', 'Type': 'Boolean'},
+    {'AttributeName': 'SystemServiceTag', 'Type': 'String', 'ReadOnly': True}
+]
+
+@pytest.fixture
+def registry():
+    return BiosRegistry('PowerEdge R640', '2.1.8', ENTRIES)
+
+@pytest.mark.parametrize('name, value', [
+    ('LogicalProc', 'Enabled'),
+    ('MemFrequency', 1600),
+    ('MemFrequency', 3200),
+    ('AssetTag', 'MOCK0001'),
+    ('PxeDev1EnDis', False)
+])
+def test_check_value_accepts(registry, name, value):
+    assert registry.check_value(registry.entries[name], value) is None
+
+@pytest.mark.parametrize('name, value, error', [
+    ('LogicalProc', 'On', "is not one of Enabled, Disabled"),
+    ('MemFrequency', '2400', "is not an integer"),
+    ('MemFrequency', True, "is not an integer"),
+    ('MemFrequency', 1333, "below the minimum of 1600"),
+    ('MemFrequency', 4800, "above the maximum of 3200"),
+    ('AssetTag', 'MOCK000001X', "longer than 10 characters"),
+    ('AssetTag', 'mock', "does not match"),
+    ('PxeDev1EnDis', 'Enabled', "is not a boolean")
+])
+def test_check_value_rejects(registry, name, value, error):
+    assert error in registry.check_value(registry.entries[name], value)
+
+def test_check_drops_read_only_and_unknown(registry):
+    clean, skipped, errors = registry.check({'LogicalProc': 'Disabled', 'SystemServiceTag': 'X', 'LogicalPorc': 'Enabled'})
+    assert clean == {'LogicalProc': 'Disabled'}
+    assert sorted(skipped) == ['LogicalPorc', 'SystemServiceTag']
+    assert errors == []
+
+def test_clean_reports_skipped_names(registry):
+    skipped = []
+    assert registry.clean({'LogicalProc': 'Enabled', 'LogicalPorc': 'Enabled'}, skip=skipped.extend) == {'LogicalProc': 'Enabled'}
+    assert skipped == ['LogicalPorc']
+
+def test_clean_raises_on_invalid_values(registry):
+    with pytest.raises(BiosAttributeError, match='MemFrequency'):
+        registry.clean({'MemFrequency': 99})
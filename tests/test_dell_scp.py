@@ -0,0 +1,45 @@
+import xml.etree.ElementTree as ET
+from dell_scp import render_profile, merge_components, BIOS_FQDD, IDRAC_FQDD
+
+TEMPLATE = """<SystemConfiguration>
+  <Component FQDD="RAID.Integrated.1-1">
+    <Component FQDD="Disk.Virtual.0:RAID.Integrated.1-1">
+      <Attribute Name="RAIDTypes">RAID 1</Attribute>
+    </Component>
+  </Component>
+  <Component FQDD="BIOS.Setup.1-1">
+    <Attribute Name="LogicalProc">Enabled</Attribute>
+  </Component>
+</SystemConfiguration>"""
+
+def attributes(xml, fqdd):
+    for component in ET.fromstring(xml).iter('Component'):
+        if component.get('FQDD') == fqdd:
+            return dict((a.get('Name'), a.text) for a in component.findall('Attribute'))
+
+def test_render_profile_without_template():
+    xml = render_profile({BIOS_FQDD: {'BootMode': 'Uefi', 'MemTest': 'Disabled'}})
+    assert ET.fromstring(xml).tag == 'SystemConfiguration'
+    assert attributes(xml, BIOS_FQDD) == {'BootMode': 'Uefi', 'MemTest': 'Disabled'}
+
+def test_render_profile_sets_template_attributes_in_place():
+    template = ET.fromstring(TEMPLATE)
+    xml = render_profile({BIOS_FQDD: {'LogicalProc': 'Disabled', 'BootMode': 'Bios'},
+                          'Disk.Virtual.0:RAID.Integrated.1-1': {'RAIDTypes': 'RAID 5'},
+                          IDRAC_FQDD: {'Users.2#UserName': 'admin'}}, template=template)
+    assert attributes(xml, BIOS_FQDD) == {'LogicalProc': 'Disabled', 'BootMode': 'Bios'}
+    # Nested components are found where they are, new ones are added
+    assert attributes(xml, 'Disk.Virtual.0:RAID.Integrated.1-1') == {'RAIDTypes': 'RAID 5'}
+    assert attributes(xml, IDRAC_FQDD) == {'Users.2#UserName': 'admin'}
+    assert len(list(ET.fromstring(xml).iter('Component'))) == 4
+    # The template is shared by every host and must stay as it was
+    assert attributes(ET.tostring(template, encoding='unicode'), BIOS_FQDD) == {'LogicalProc': 'Enabled'}
+
+def test_render_profile_writes_values_as_text():
+    assert attributes(render_profile({BIOS_FQDD: {'ProcCores': 8}}), BIOS_FQDD) == {'ProcCores': '8'}
+
+def test_merge_components_overrides_per_attribute():
+    base = {BIOS_FQDD: {'BootMode': 'Bios', 'MemTest': 'Enabled'}}
+    merged = merge_components(base, {BIOS_FQDD: {'MemTest': 'Disabled'}, IDRAC_FQDD: {'Users.2#Enable': 'Enabled'}})
+    assert merged == {BIOS_FQDD: {'BootMode': 'Bios', 'MemTest': 'Disabled'}, IDRAC_FQDD: {'Users.2#Enable': 'Enabled'}}
+    assert base == {BIOS_FQDD: {'BootMode': 'Bios', 'MemTest': 'Enabled'}}
@@ -0,0 +1,68 @@
+import sqlite3
+import pytest
+from fleet_query import FleetIndex, QueryError, INDEX_SCHEMA, index_attributes, update_index, version_key
+
+HOSTS = {
+    'bmc0': {'LogicalProc': 'Enabled', 'SysProfile': 'PerfOptimized', 'BiosVersion': '1.10.0'},
+    'bmc1': {'LogicalProc': 'Disabled', 'SysProfile': 'PerfOptimized', 'BiosVersion': '1.9.2'},
+    'bmc2': {'LogicalProc': 'Enabled', 'SysProfile': 'Custom', 'BiosVersion': '1.3.7'}
+}
+
+@pytest.fixture
+def index():
+    index = FleetIndex()
+    for host, attributes in HOSTS.items():
+        index.update(host, attributes)
+    return index
+
+@pytest.mark.parametrize('query, hosts', [
+    ('LogicalProc=Enabled', {'bmc0', 'bmc2'}),
+    ('LogicalProc!=Enabled', {'bmc1'}),
+    ('BiosVersion>1.9.2', {'bmc0'}),
+    ('BiosVersion<=1.9.2', {'bmc1', 'bmc2'}),
+    ('LogicalProc=Enabled and SysProfile=PerfOptimized', {'bmc0'}),
+    ('SysProfile=Custom or LogicalProc=Disabled', {'bmc1', 'bmc2'}),
+    ('not LogicalProc=Enabled', {'bmc1'}),
+    ('not (SysProfile=Custom or LogicalProc=Disabled)', {'bmc0'}),
+    ('SysProfile="PerfOptimized" and not BiosVersion>=1.10', {'bmc1'}),
+    ('MemTest=Enabled', set())
+])
+def test_query(index, query, hosts):
+    assert index.query(query) == hosts
+
+@pytest.mark.parametrize('query', ['LogicalProc', 'LogicalProc=', '(LogicalProc=Enabled', 'LogicalProc=Enabled and', 'a=b c=d'])
+def test_query_errors(index, query):
+    with pytest.raises(QueryError):
+        index.query(query)
+
+def test_versions_compare_numerically():
+    assert version_key('1.10.0') > version_key('1.9.2')
+    assert version_key('2.1.8') < version_key('2.10')
+
+def test_update_moves_hosts_between_postings(index):
+    index.update('bmc1', dict(HOSTS['bmc1'], LogicalProc='Enabled'))
+    assert index.query('LogicalProc=Enabled') == {'bmc0', 'bmc1', 'bmc2'}
+    assert 'Disabled' not in index.values('LogicalProc')
+    index.remove('bmc2')
+    assert index.values('SysProfile') == {'PerfOptimized': 2}
+
+def test_drift(index):
+    drift = index.drift({'LogicalProc': 'Enabled', 'SysProfile': 'PerfOptimized', 'MemTest': 'Disabled'})
+    assert drift == {'LogicalProc': {'bmc1'}, 'SysProfile': {'bmc2'}, 'MemTest': {'bmc0', 'bmc1', 'bmc2'}}
+
+def test_sqlite_index_matches_memory(index):
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(INDEX_SCHEMA)
+    for host, attributes in HOSTS.items():
+        update_index(conn, host, {}, index_attributes({'attributes': attributes}))
+    # Only the rows that changed are rewritten
+    assert update_index(conn, 'bmc1', index_attributes({'attributes': HOSTS['bmc1']}),
+                        index_attributes({'attributes': dict(HOSTS['bmc1'], LogicalProc='Enabled')})) == 2
+    index.update('bmc1', dict(HOSTS['bmc1'], LogicalProc='Enabled'))
+    stored = FleetIndex(conn)
+    for query in ('LogicalProc=Enabled', 'BiosVersion<1.10', 'not SysProfile=Custom'):
+        assert stored.query(query) == index.query(query)
+
+def test_index_attributes_adds_system_fields():
+    attributes = index_attributes({'attributes': {'ProcCores': 8}, 'model': 'PowerEdge R640', 'power_state': 'On', 'service_tag': None})
+    assert attributes == {'ProcCores': '8', 'Model': 'PowerEdge R640', 'PowerState': 'On'}
@@ -0,0 +1,128 @@
+# Failure paths of the provisioning code against mock_redfish_server.py,
+# with failures injected into single endpoints of one BMC
+import time
+import asyncio
+import pytest
+import provision_fleet
+import mock_redfish_server
+from mock_redfish_server import MockError, start_mock, stop_mock
+from dell_set_bios_attr import Utils
+from redfish_drivers import detect_driver, detect_vendor, RedfishError
+
+@pytest.fixture
+def mock_bmc():
+    started = []
+
+    def start(vendor='dell', *args):
+        servers, inventory = start_mock(mock_redfish_server.parse_args(['--vendor', vendor, '--job-duration', '0', '--post-duration', '0'] + list(args)))
+        started.extend(servers)
+        return inventory[0][0], servers[0].bmc
+    yield start
+    stop_mock(started)
+
+# Answer method on paths ending in suffix with an error status, after delay
+# seconds
+def fail(bmc, method, suffix, status=503, delay=0):
+    route = bmc.route
+
+    def failing(request_method, path, headers, body):
+        if request_method == method and path.endswith(suffix):
+            time.sleep(delay)
+            raise MockError(status, "injected failure")
+        return route(request_method, path, headers, body)
+    bmc.route = failing
+
+def test_get_bios_attr_raises_on_an_error_status(mock_bmc):
+    url, bmc = mock_bmc()
+    fail(bmc, 'GET', '/Bios')
+    utils_obj = Utils(url, 'root', 'calvin')
+    utils_obj.auth_session()
+    with pytest.raises(RedfishError, match="returned err code 503"):
+        utils_obj.get_bios_attr()
+
+def test_collection_walker_raises_on_an_error_status(mock_bmc):
+    url, bmc = mock_bmc()
+    fail(bmc, 'GET', '/Accounts/2', status=500)
+    utils_obj = Utils(url, 'root', 'calvin')
+    utils_obj.auth_session()
+    with pytest.raises(RedfishError, match="returned err code 500"):
+        list(utils_obj.iter_collection(utils_obj.root_url + '/Managers/iDRAC.Embedded.1/Accounts'))
+
+def test_async_collection_walker_cancels_what_it_did_not_need(mock_bmc):
+    pytest.importorskip('aiohttp')
+    from dell_async_utils import AsyncEngine, AsyncUtils
+    url, bmc = mock_bmc()
+    # Every account but the one looked for fails, once that one is found
+    for account in range(3, 17):
+        fail(bmc, 'GET', '/Accounts/%s' % (account), delay=0.2)
+
+    async def run():
+        engine = await AsyncEngine().start()
+        try:
+            utils_obj = AsyncUtils(url, 'root', 'calvin', engine)
+            await utils_obj.auth_session()
+            message = await utils_obj.set_idrac_credentials('admin', 'secret')
+            await asyncio.sleep(0.5)
+            leftover = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            return message, leftover
+        finally:
+            await engine.close()
+    loop = asyncio.new_event_loop()
+    unretrieved = []
+    loop.set_exception_handler(lambda loop, context: unretrieved.append(context))
+    try:
+        message, leftover = loop.run_until_complete(run())
+    finally:
+        loop.close()
+    assert message.startswith('# INFO')
+    assert leftover == []
+    assert unretrieved == []
+
+def test_detect_vendor_reports_the_status(mock_bmc):
+    url, bmc = mock_bmc()
+
+    def unavailable():
+        raise MockError(503, "injected failure")
+    bmc.service_root = unavailable
+    with pytest.raises(RedfishError, match="returned err code 503"):
+        detect_vendor(url)
+
+@pytest.mark.parametrize('vendor, method, suffix, operation', [
+    ('dell', 'PATCH', '/Bios/Settings', 'apply_bios_delta'),
+    ('dell', 'PATCH', '/BootSources/Settings', 'apply_bios_delta'),
+    ('dell', 'POST', '/Jobs', 'commit'),
+    ('hpe', 'PATCH', '/Bios/settings', 'apply_bios_delta'),
+    ('hpe', 'PATCH', '/Systems/1', 'set_asset_tag'),
+    ('hpe', 'POST', '/ComputerSystem.Reset', 'reboot')
+])
+def test_driver_operations_raise(mock_bmc, vendor, method, suffix, operation):
+    url, bmc = mock_bmc(vendor)
+    fail(bmc, method, suffix, status=400)
+    driver = detect_driver(url, 'root', 'calvin', use_registry=False)
+    driver.auth_session()
+    config = {'LogicalProc': 'Disabled'} if vendor == 'dell' else {'WorkloadProfile': 'Virtualization-MaxPerformance'}
+    with pytest.raises(RedfishError, match="400"):
+        if operation in ('commit', 'reboot'):
+            driver.apply_bios_delta(config)
+            driver.set_asset_tag('MOCK0000')
+        getattr(driver, operation)(*{'apply_bios_delta': (config,), 'set_asset_tag': ('MOCK0000',)}.get(operation, ()))
+
+@pytest.fixture
+def fleet(monkeypatch):
+    for name, value in (('bios_configs', {'Dell': {'LogicalProc': 'Disabled'}}), ('reboot_flag', True), ('session_cache', None),
+                        ('event_listener', None), ('host_timeout', 60), ('driver_options', {'use_registry': True})):
+        monkeypatch.setattr(provision_fleet, name, value, raising=False)
+
+def test_fleet_host_fails_when_a_step_fails(mock_bmc, fleet):
+    url, bmc = mock_bmc()
+    fail(bmc, 'PATCH', '/Bios/Settings')
+    record = provision_fleet.provision_fleet_host({'ip': url, 'asset': 'MOCK0000', 'username': 'root', 'password': 'calvin'})
+    assert record['status'] == 'failed'
+    assert 'err code' in record['error']
+
+def test_fleet_host_logs_skipped_attributes(mock_bmc, fleet, monkeypatch):
+    url, bmc = mock_bmc()
+    monkeypatch.setitem(provision_fleet.bios_configs, 'Dell', {'LogicalProc': 'Disabled', 'LogicalPorc': 'Enabled'})
+    record = provision_fleet.provision_fleet_host({'ip': url, 'asset': 'MOCK0000', 'username': 'root', 'password': 'calvin'})
+    assert record['status'] == 'ok', record['error']
+    assert any(m.startswith('# WARN -- Not setting LogicalPorc') for m in record['messages'])
@@ -0,0 +1,115 @@
+import pytest
+import requests
+import redfish_transport
+from redfish_transport import CircuitBreaker, Transport, BmcUnavailable, DeadlineExceeded, budget, time_left, retryable_status, retryable_error
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(redfish_transport, 'retry_delays', lambda retries: iter([0.0] * retries))
+
+def open_breaker(breaker):
+    for _ in range(breaker.threshold):
+        breaker.failure()
+
+def test_breaker_opens_after_threshold_and_fails_fast():
+    breaker = CircuitBreaker(threshold=3, cooldown=60)
+    breaker.failure()
+    breaker.failure()
+    assert breaker.check('bmc') is False
+    breaker.failure()
+    assert breaker.open
+    with pytest.raises(BmcUnavailable):
+        breaker.check('bmc')
+
+def test_breaker_lets_one_probe_through_after_cooldown():
+    breaker = CircuitBreaker(threshold=1, cooldown=0)
+    open_breaker(breaker)
+    assert breaker.check('bmc') is True
+    with pytest.raises(BmcUnavailable):
+        breaker.check('bmc')
+    breaker.success()
+    assert not breaker.open
+    assert breaker.check('bmc') is False
+
+@pytest.mark.parametrize('method, status, retry', [
+    ('GET', 503, True),
+    ('POST', 503, True),
+    ('PATCH', 503, True),
+    ('GET', 500, True),
+    ('DELETE', 502, True),
+    ('PATCH', 500, False),
+    ('POST', 500, False),
+    ('GET', 404, False)
+])
+def test_retryable_status(method, status, retry):
+    assert retryable_status(method, status) is retry
+
+def test_post_is_only_resent_when_it_never_connected():
+    assert retryable_error('POST', requests.ConnectTimeout())
+    assert not retryable_error('POST', requests.ConnectionError())
+    assert retryable_error('GET', requests.ConnectionError())
+    assert not retryable_error('GET', requests.ReadTimeout())
+
+def transport(send):
+    transport = Transport('http://bmc.invalid', retries=2)
+    transport.send = send
+    return transport
+
+def test_request_retries_503_then_succeeds():
+    statuses = [503, 503, 200]
+    t = transport(lambda method, url, **kwargs: Response(statuses.pop(0)))
+    assert t.request('PATCH', 'http://bmc.invalid/x', timeout=5).status_code == 200
+    assert statuses == []
+
+def test_request_does_not_resend_a_failed_patch():
+    calls = []
+    t = transport(lambda method, url, **kwargs: calls.append(method) or Response(500))
+    assert t.request('PATCH', 'http://bmc.invalid/x', timeout=5).status_code == 500
+    assert calls == ['PATCH']
+
+def probe_fails(t):
+    t.breaker.cooldown = 0
+    open_breaker(t.breaker)
+
+def probe_recovers(t):
+    assert not t.breaker.probing
+    # The next request is the next probe, not failed fast for good
+    t.send = lambda method, url, **kwargs: Response(200)
+    assert t.request('GET', 'http://bmc.invalid/x', timeout=5).status_code == 200
+    assert not t.breaker.open
+
+def test_probe_ends_on_an_unexpected_exception():
+    def send(method, url, **kwargs):
+        raise ValueError('bug')
+    t = transport(send)
+    probe_fails(t)
+    with pytest.raises(ValueError):
+        t.request('GET', 'http://bmc.invalid/x', timeout=5)
+    probe_recovers(t)
+
+def test_probe_ends_when_interrupted():
+    def send(method, url, **kwargs):
+        raise KeyboardInterrupt()
+    t = transport(send)
+    probe_fails(t)
+    with pytest.raises(KeyboardInterrupt):
+        t.request('GET', 'http://bmc.invalid/x', timeout=5)
+    probe_recovers(t)
+
+def test_probe_ends_when_the_budget_runs_out():
+    # The budget runs out while the probe is in flight
+    def send(method, url, **kwargs):
+        while time_left() > 0:
+            pass
+        raise requests.ReadTimeout()
+    t = transport(send)
+    probe_fails(t)
+    with pytest.raises(DeadlineExceeded):
+        with budget(0.01):
+            t.request('GET', 'http://bmc.invalid/x', timeout=5)
+    probe_recovers(t)
@@ -0,0 +1,59 @@
+import json
+import sqlite3
+from dell_set_bios_attr import StateStore
+
+ATTRIBUTES = {'BootMode': 'Bios', 'LogicalProc': 'Enabled', 'AssetTag': 'MOCK0000'}
+
+def entry(**attributes):
+    return {'power_state': 'On', 'model': 'PowerEdge R640', 'service_tag': 'MK00000', 'bios_version': '2.1.8',
+            'system_etag': '"s"', 'bios_etag': '"b"', 'attributes': dict(ATTRIBUTES, **attributes)}
+
+def collect(store, host, new):
+    previous = store.inventory_entry(host)
+    new['snapshot_at'] = store.save_snapshot(host, new['attributes'])
+    store.save_inventory(host, new, previous)
+
+def index_rows(store, host):
+    return dict((a, v) for a, v, h in store.execute("SELECT attribute, value, host FROM attribute_index") if h == host)
+
+def test_inventory_references_its_snapshot(tmp_path):
+    store = StateStore(str(tmp_path / 'state.db'))
+    collect(store, 'bmc0', entry())
+    # A provisioning run saves a newer snapshot; the entry still reads the
+    # attributes it was collected with
+    store.save_snapshot('bmc0', dict(ATTRIBUTES, LogicalProc='Disabled'))
+    assert dict(store.inventory_entry('bmc0')['attributes']) == ATTRIBUTES
+    assert index_rows(store, 'bmc0')['LogicalProc'] == 'Enabled'
+
+    collect(store, 'bmc0', entry(LogicalProc='Disabled'))
+    assert index_rows(store, 'bmc0')['LogicalProc'] == 'Disabled'
+    assert 'attributes' not in [row[1] for row in store.execute("PRAGMA table_info(inventory)")]
+
+def test_index_is_rebuilt_from_the_fleet_view(tmp_path):
+    path = str(tmp_path / 'state.db')
+    store = StateStore(path)
+    collect(store, 'bmc0', entry())
+    collect(store, 'bmc1', entry(AssetTag='MOCK0001'))
+    before = sorted(store.execute("SELECT * FROM attribute_index"))
+    store.execute("DELETE FROM attribute_index")
+    assert sorted(StateStore(path).execute("SELECT * FROM attribute_index")) == before
+
+def test_inventory_with_attributes_is_migrated(tmp_path):
+    path = str(tmp_path / 'state.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE inventory (host TEXT PRIMARY KEY, collected_at REAL, power_state TEXT, model TEXT, service_tag TEXT, "
+                 "bios_version TEXT, system_etag TEXT, bios_etag TEXT, attributes TEXT)")
+    conn.execute("INSERT INTO inventory VALUES ('bmc0', 100.0, 'On', 'PowerEdge R640', 'MK00000', '2.1.8', '\"s\"', '\"b\"', ?)",
+                 (json.dumps(ATTRIBUTES),))
+    conn.execute("INSERT INTO inventory VALUES ('bmc1', 100.0, 'Off', NULL, NULL, NULL, NULL, NULL, NULL)")
+    conn.commit()
+    conn.close()
+
+    store = StateStore(path)
+    migrated = store.inventory_entry('bmc0')
+    assert dict(migrated['attributes']) == ATTRIBUTES
+    assert migrated['bios_etag'] == '"b"'
+    assert store.inventory_entry('bmc1')['attributes'] is None
+    assert index_rows(store, 'bmc0')['LogicalProc'] == 'Enabled'
+    # Opening it again finds nothing left to migrate
+    assert len(StateStore(path).attribute_store.snapshots('bmc0')) == 1